@@ -1,10 +1,14 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 from datetime import datetime
-import databutton as db
+from app.libs.storage import json_storage
 from app.auth import AuthorizedUser
 from app.apis.estate import Estate, sanitize_storage_key
+from app.libs.estate_index import COLLABORATING, add_estate_to_index
+from app.libs.invitation_index import add_invitation_to_index, remove_invitation_from_index, get_pending_invitations
+from app.libs.estate_access import EstateViewer, resolve_estate_access
+from app.libs.comment_log import append_comment, read_comments
 
 class Role(BaseModel):
     estate_id: str
@@ -43,27 +47,33 @@ router = APIRouter()
 @router.post("/accept-invite/{estate_id}")
 async def accept_invite(estate_id: str, user: AuthorizedUser, email: str = Query(...)) -> AcceptInviteResponse:
     try:
-        # Get roles for estate
         roles_key = sanitize_storage_key(f"roles_{estate_id}")
-        roles = db.storage.json.get(roles_key, default=[])
-        
-        # Find pending invitation for this email
-        invitation = next((r for r in roles if r["email"] == email and r["status"] == "pending"), None)
-        if not invitation:
-            raise HTTPException(status_code=404, detail="Invitation not found")
-        
-        # Update invitation
-        invitation["status"] = "accepted"
-        invitation["user_id"] = user.sub
-        invitation["accepted_at"] = datetime.now().isoformat()
-        
-        # Save updated roles
-        db.storage.json.put(roles_key, roles)
+        with json_storage.transaction():
+            # Read around the cache so a concurrent invite or acceptance is not overwritten
+            roles = json_storage.get_fresh(roles_key, default=[])
+            
+            # Find pending invitation for this email
+            invitation = next((r for r in roles if r["email"] == email and r["status"] == "pending"), None)
+            if not invitation:
+                raise HTTPException(status_code=404, detail="Invitation not found")
+            
+            # Update invitation
+            invitation["status"] = "accepted"
+            invitation["user_id"] = user.sub
+            invitation["accepted_at"] = datetime.now().isoformat()
+            
+            # Save updated roles
+            json_storage.put(roles_key, roles)
+        add_estate_to_index(user.sub, estate_id, COLLABORATING)
+        if not any(r["email"] == email and r["status"] == "pending" for r in roles):
+            remove_invitation_from_index(email, estate_id)
         
         return AcceptInviteResponse(
             message="Invitation accepted successfully",
             role=Role(**invitation)
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
@@ -71,18 +81,9 @@ async def accept_invite(estate_id: str, user: AuthorizedUser, email: str = Query
 async def invite_collaborator(request: InviteRequest, user: AuthorizedUser) -> InviteResponse:
     try:
         # Check if user has admin access to estate
-        storage_key = sanitize_storage_key(f"estates_{request.estate_id}")
-        estate = db.storage.json.get(storage_key)
-        if not estate:
-            raise HTTPException(status_code=404, detail="Estate not found")
-        
-        if estate["userId"] != user.sub:
-            # Check if user is an admin collaborator
-            roles_key = sanitize_storage_key(f"roles_{request.estate_id}")
-            roles = db.storage.json.get(roles_key, default=[])
-            user_role = next((r for r in roles if r["user_id"] == user.sub and r["role"] == "admin"), None)
-            if not user_role:
-                raise HTTPException(status_code=403, detail="Unauthorized to invite collaborators")
+        access = resolve_estate_access(request.estate_id, user.sub)
+        if not access.has_role("admin"):
+            raise HTTPException(status_code=403, detail="Unauthorized to invite collaborators")
         
         # Create new role
         now = datetime.now()
@@ -98,9 +99,12 @@ async def invite_collaborator(request: InviteRequest, user: AuthorizedUser) -> I
         
         # Save role
         roles_key = sanitize_storage_key(f"roles_{request.estate_id}")
-        roles = db.storage.json.get(roles_key, default=[])
-        roles.append(new_role.dict())
-        db.storage.json.put(roles_key, roles)
+        with json_storage.transaction():
+            # Read around the cache so a concurrent invite or acceptance is not overwritten
+            roles = json_storage.get_fresh(roles_key, default=[])
+            roles.append(new_role.dict())
+            json_storage.put(roles_key, roles)
+        add_invitation_to_index(request.email, request.estate_id)
         
         # TODO: Send invitation email
         
@@ -108,50 +112,31 @@ async def invite_collaborator(request: InviteRequest, user: AuthorizedUser) -> I
             message="Invitation sent successfully",
             invitation=new_role
         )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+@router.get("/invitations")
+async def list_my_invitations(user: AuthorizedUser) -> List[Role]:
+    """List pending invitations for the authenticated user's email across all estates."""
+    try:
+        if not user.email:
+            return []
+        return [Role(**role) for role in get_pending_invitations(user.email)]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 @router.get("/roles/{estate_id}")
-async def get_roles(estate_id: str, user: AuthorizedUser) -> List[Role]:
+async def get_roles(estate_id: str, access: EstateViewer) -> List[Role]:
     try:
-        # Check if user has access to estate
-        storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        estate = db.storage.json.get(storage_key)
-        if not estate:
-            raise HTTPException(status_code=404, detail="Estate not found")
-        
-        if estate["userId"] != user.sub:
-            # Check if user is a collaborator
-            roles_key = sanitize_storage_key(f"roles_{estate_id}")
-            roles = db.storage.json.get(roles_key, default=[])
-            user_role = next((r for r in roles if r["user_id"] == user.sub), None)
-            if not user_role:
-                raise HTTPException(status_code=403, detail="Unauthorized access to roles")
-        
-        # Get roles
-        roles_key = sanitize_storage_key(f"roles_{estate_id}")
-        roles = db.storage.json.get(roles_key, default=[])
-        return [Role(**role) for role in roles]
+        return [Role(**role) for role in access.roles]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 @router.post("/comments/{estate_id}")
-async def add_comment(estate_id: str, comment: Comment, user: AuthorizedUser) -> Comment:
+async def add_comment(estate_id: str, comment: Comment, user: AuthorizedUser, access: EstateViewer) -> Comment:
     try:
-        # Check if user has access to estate
-        storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        estate = db.storage.json.get(storage_key)
-        if not estate:
-            raise HTTPException(status_code=404, detail="Estate not found")
-        
-        if estate["userId"] != user.sub:
-            # Check if user is a collaborator
-            roles_key = sanitize_storage_key(f"roles_{estate_id}")
-            roles = db.storage.json.get(roles_key, default=[])
-            user_role = next((r for r in roles if r["user_id"] == user.sub), None)
-            if not user_role:
-                raise HTTPException(status_code=403, detail="Unauthorized to add comments")
-        
         # Create new comment
         now = datetime.now()
         new_comment = Comment(
@@ -163,42 +148,35 @@ async def add_comment(estate_id: str, comment: Comment, user: AuthorizedUser) ->
             created_at=now
         )
         
-        # Save comment
-        comments_key = sanitize_storage_key(f"comments_{estate_id}")
-        comments = db.storage.json.get(comments_key, default=[])
-        comments.append(new_comment.dict())
-        db.storage.json.put(comments_key, comments)
+        # Append comment to the estate's comment log
+        append_comment(estate_id, new_comment.dict())
         
         return new_comment
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 @router.get("/comments/{estate_id}")
-async def get_comments(estate_id: str, user: AuthorizedUser, task_id: Optional[str] = None) -> List[Comment]:
+async def get_comments(
+    estate_id: str,
+    access: EstateViewer,
+    response: Response,
+    task_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+) -> List[Comment]:
+    """Get comments, oldest first.
+
+    With `limit` only the latest page is returned. The cursor for the page
+    before it is in the X-Next-Cursor header; the header is absent on the first page.
+    """
     try:
-        # Check if user has access to estate
-        storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        estate = db.storage.json.get(storage_key)
-        if not estate:
-            raise HTTPException(status_code=404, detail="Estate not found")
-        
-        if estate["userId"] != user.sub:
-            # Check if user is a collaborator
-            roles_key = sanitize_storage_key(f"roles_{estate_id}")
-            roles = db.storage.json.get(roles_key, default=[])
-            user_role = next((r for r in roles if r["user_id"] == user.sub), None)
-            if not user_role:
-                raise HTTPException(status_code=403, detail="Unauthorized access to comments")
-        
-        # Get comments
-        comments_key = sanitize_storage_key(f"comments_{estate_id}")
-        comments = db.storage.json.get(comments_key, default=[])
-        comments = [Comment(**comment) for comment in comments]
-        
-        # Filter by task if provided
-        if task_id:
-            comments = [c for c in comments if c.task_id == task_id]
-        
-        return comments
+        # Get a page of comments, filtered by task if provided
+        comments, next_cursor = read_comments(estate_id, task_id=task_id, limit=limit, cursor=cursor)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
+        
+        return [Comment(**comment) for comment in comments]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
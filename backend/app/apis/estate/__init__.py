@@ -1,14 +1,16 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional, Dict
+from fastapi import APIRouter, HTTPException, Header, Response
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Any, List, Optional, Dict
+import copy
 from datetime import datetime
-import databutton as db
 from app.auth import AuthorizedUser
-import re
-
-def sanitize_storage_key(key: str) -> str:
-    """Sanitize storage key to only allow alphanumeric and ._- symbols"""
-    return re.sub(r'[^a-zA-Z0-9._-]', '', key)
+from app.libs.storage import json_storage, sanitize_storage_key
+from app.libs.json_patch import JsonPatchError, JsonPatchTestFailed, apply_json_patch, apply_item_operation, parse_pointer
+from app.libs.comment_log import delete_comment_log
+from app.libs.invitation_index import remove_invitation_from_index
+from app.libs.estate_access import EstateViewer, EstateEditor, EstateAdmin
+from app.libs.estate_index import OWNED, add_estate_to_index, remove_estate_from_index, get_user_estate_ids
+from app.libs.transaction_ledger import create_ledger, delete_ledger
 
 router = APIRouter()
 
@@ -57,6 +59,7 @@ class Estate(BaseModel):
     progress: Optional[int] = 0
     tasks: List[Task] = []
     collaborators: Dict[str, str] = {}  # user_id -> role mapping
+    version: int = 0  # Incremented on every write, exposed as the ETag
 
 class UpdateEstateRequest(BaseModel):
     deceased: Optional[Person] = None
@@ -69,6 +72,34 @@ class UpdateEstateRequest(BaseModel):
     deceasedName: Optional[str] = None
     progress: Optional[int] = None
     tasks: Optional[List[Task]] = None
+    version: Optional[int] = None  # Version the client edited, checked before saving
+
+class PatchOperation(BaseModel):
+    """RFC 6902 JSON Patch operation on the estate document."""
+    model_config = ConfigDict(populate_by_name=True)
+
+    op: str  # add, remove, replace, move, copy, test
+    path: str
+    value: Optional[Any] = None
+    from_: Optional[str] = Field(None, alias="from")
+
+class ItemOperation(BaseModel):
+    """Add, update or remove a single asset, debt, heir or task."""
+    collection: str  # assets, debts, heirs, tasks
+    action: str  # add, update, remove
+    id: Optional[str] = None  # Item id for assets, debts and tasks
+    index: Optional[int] = None  # Position for heirs, which have no id
+    value: Optional[Dict[str, Any]] = None
+
+class PatchEstateRequest(BaseModel):
+    operations: List[PatchOperation] = []
+    items: List[ItemOperation] = []
+    version: Optional[int] = None  # Version the client edited, checked before saving
+
+class PatchEstateResponse(BaseModel):
+    id: str
+    version: int
+    updatedAt: datetime
 
 class CreateEstateResponse(BaseModel):
     id: str
@@ -81,6 +112,7 @@ class CreateEstateResponse(BaseModel):
     deceasedName: Optional[str] = None
     progress: Optional[int] = 0
     tasks: List[Task] = []
+    version: int = 0
 
 @router.post("/estate")
 async def create_estate(user: AuthorizedUser) -> CreateEstateResponse:
@@ -110,11 +142,14 @@ async def create_estate(user: AuthorizedUser) -> CreateEstateResponse:
         "deceasedName": None,
         "progress": 0,
         "tasks": [task.dict() for task in test_tasks],
+        "version": 1,
     }
 
     # Save to storage with sanitized key
     storage_key = sanitize_storage_key(f"estates_{estate['id']}")
-    db.storage.json.put(storage_key, estate)
+    json_storage.put(storage_key, estate)
+    add_estate_to_index(user.sub, estate["id"], OWNED)
+    create_ledger(estate["id"])
 
     return CreateEstateResponse(
         id=estate["id"],
@@ -123,148 +158,208 @@ async def create_estate(user: AuthorizedUser) -> CreateEstateResponse:
         currentStep=estate["currentStep"],
         createdAt=estate["createdAt"],
         updatedAt=estate["updatedAt"],
+        version=estate["version"],
     )
 
-@router.get("/estate/{estate_id}")
-async def get_estate(estate_id: str, user: AuthorizedUser) -> Estate:
-    try:
-        storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        estate = db.storage.json.get(storage_key)
-        if not estate:
-            raise HTTPException(status_code=404, detail="Estate not found")
-
-        # Check if user has access to this estate
-        if estate["userId"] != user.sub:
-            # Check if user is a collaborator
-            roles_key = sanitize_storage_key(f"roles_{estate_id}")
-            roles = db.storage.json.get(roles_key, default=[])
-            user_role = next((r for r in roles if r["user_id"] == user.sub and r["status"] == "accepted"), None)
-            if not user_role:
-                raise HTTPException(status_code=403, detail="Unauthorized access to estate")
+def estate_etag(estate: dict) -> str:
+    """ETag for an estate document, derived from its version."""
+    return f'"{estate.get("version", 0)}"'
 
-        return Estate(**estate)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) from e
+def etag_matches(header: Optional[str], etag: str, weak: bool = False) -> bool:
+    """Check an If-Match / If-None-Match header value against an ETag.
+
+    If-Match uses strong comparison, so a weak tag never matches. Pass
+    weak=True for If-None-Match, which ignores the W/ prefix.
+    """
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(",")]
+    if weak:
+        candidates = [c.removeprefix("W/") for c in candidates]
+    return "*" in candidates or etag in candidates
+
+def bump_version(estate: dict) -> None:
+    """Increment the version and update timestamp before saving an estate."""
+    estate["version"] = estate.get("version", 0) + 1
+    estate["updatedAt"] = datetime.now().isoformat()
+
+@router.get("/estate/{estate_id}")
+async def get_estate(
+    estate_id: str,
+    access: EstateViewer,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+) -> Estate:
     try:
-        storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        estate = db.storage.json.get(storage_key)
-        if not estate:
-            raise HTTPException(status_code=404, detail="Estate not found")
+        estate = access.estate
 
-        # Check if user has access to this estate
-        if estate["userId"] != user.sub:
-            raise HTTPException(status_code=403, detail="Unauthorized access to estate")
+        # Let clients revalidate without downloading an unchanged estate
+        etag = estate_etag(estate)
+        if etag_matches(if_none_match, etag, weak=True):
+            return Response(status_code=304, headers={"ETag": etag})
 
+        response.headers["ETag"] = etag
         return Estate(**estate)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 @router.put("/estate/{estate_id}")
-async def update_estate(estate_id: str, request: UpdateEstateRequest, user: AuthorizedUser) -> Estate:
+async def update_estate(
+    estate_id: str,
+    request: UpdateEstateRequest,
+    access: EstateEditor,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+) -> Estate:
     try:
         storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        estate = db.storage.json.get(storage_key)
-        if not estate:
-            raise HTTPException(status_code=404, detail="Estate not found")
-
-        # Check if user has access to this estate
-        if estate["userId"] != user.sub:
-            # Check if user is a collaborator with edit rights
-            roles_key = sanitize_storage_key(f"roles_{estate_id}")
-            roles = db.storage.json.get(roles_key, default=[])
-            user_role = next((r for r in roles if r["user_id"] == user.sub and r["status"] == "accepted"), None)
-            if not user_role or user_role["role"] == "viewer":
-                raise HTTPException(status_code=403, detail="Unauthorized to update estate")
-
-        # Update fields if provided
-        if request.deceased:
-            estate["deceased"] = request.deceased.dict()
-        if request.heirs is not None:
-            estate["heirs"] = [heir.dict() for heir in request.heirs]
-        if request.assets is not None:
-            estate["assets"] = [asset.dict() for asset in request.assets]
-        if request.debts is not None:
-            estate["debts"] = [debt.dict() for debt in request.debts]
-        if request.status:
-            estate["status"] = request.status
-        if request.currentStep is not None:
-            estate["currentStep"] = request.currentStep
-
-        estate["updatedAt"] = datetime.now().isoformat()
-
-        # Save updated estate
-        db.storage.json.put(storage_key, estate)
-
+        with json_storage.transaction():
+            # Access was checked by the dependency. Read again around the cache
+            # so the version check sees the latest write
+            estate = json_storage.get_fresh(storage_key, default=None)
+            if not estate:
+                raise HTTPException(status_code=404, detail="Estate not found")
+
+            # Reject edits based on an outdated version of the estate
+            if if_match and not etag_matches(if_match, estate_etag(estate)):
+                raise HTTPException(status_code=412, detail="Estate has been modified")
+            if request.version is not None and request.version != estate.get("version", 0):
+                raise HTTPException(status_code=409, detail="Estate has been modified")
+
+            # Update fields if provided
+            if request.deceased:
+                estate["deceased"] = request.deceased.dict()
+            if request.heirs is not None:
+                estate["heirs"] = [heir.dict() for heir in request.heirs]
+            if request.assets is not None:
+                estate["assets"] = [asset.dict() for asset in request.assets]
+            if request.debts is not None:
+                estate["debts"] = [debt.dict() for debt in request.debts]
+            if request.status:
+                estate["status"] = request.status
+            if request.currentStep is not None:
+                estate["currentStep"] = request.currentStep
+
+            bump_version(estate)
+
+            # Save updated estate
+            json_storage.put(storage_key, estate)
+
+        response.headers["ETag"] = estate_etag(estate)
         return Estate(**estate)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
+
+# Item models for the list fields that can be edited item by item
+ITEM_MODELS = {"assets": Asset, "debts": Debt, "heirs": Person, "tasks": Task}
+
+# Fields managed by the server that patches may not change
+PROTECTED_FIELDS = {"id", "userId", "version", "createdAt", "updatedAt", "collaborators"}
+
+@router.patch("/estate/{estate_id}")
+async def patch_estate(
+    estate_id: str,
+    request: PatchEstateRequest,
+    access: EstateEditor,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+) -> PatchEstateResponse:
+    """Apply JSON Patch and item-level operations to an estate atomically.
+
+    Either all operations are applied and saved, or none are.
+    """
     try:
         storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        estate = db.storage.json.get(storage_key)
-        if not estate:
-            raise HTTPException(status_code=404, detail="Estate not found")
-
-        # Check if user has access to this estate
-        if estate["userId"] != user.sub:
-            raise HTTPException(status_code=403, detail="Unauthorized access to estate")
-
-        # Update fields if provided
-        if request.deceased:
-            estate["deceased"] = request.deceased.dict()
-        if request.heirs is not None:
-            estate["heirs"] = [heir.dict() for heir in request.heirs]
-        if request.assets is not None:
-            estate["assets"] = [asset.dict() for asset in request.assets]
-        if request.debts is not None:
-            estate["debts"] = [debt.dict() for debt in request.debts]
-        if request.status:
-            estate["status"] = request.status
-        if request.currentStep is not None:
-            estate["currentStep"] = request.currentStep
-
-        estate["updatedAt"] = datetime.now().isoformat()
-
-        # Save updated estate
-        storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        db.storage.json.put(storage_key, estate)
-
-        return Estate(**estate)
+        with json_storage.transaction():
+            # Access was checked by the dependency. Read again around the cache
+            # so the version check sees the latest write
+            estate = json_storage.get_fresh(storage_key, default=None)
+            if not estate:
+                raise HTTPException(status_code=404, detail="Estate not found")
+
+            # Reject edits based on an outdated version of the estate
+            if if_match and not etag_matches(if_match, estate_etag(estate)):
+                raise HTTPException(status_code=412, detail="Estate has been modified")
+            if request.version is not None and request.version != estate.get("version", 0):
+                raise HTTPException(status_code=409, detail="Estate has been modified")
+
+            # Only copy the fields that are touched, so untouched lists are not copied
+            touched = {op.collection for op in request.items}
+            for operation in request.operations:
+                for pointer in (operation.path, operation.from_):
+                    if pointer is None:
+                        continue
+                    tokens = parse_pointer(pointer)
+                    if not tokens or tokens[0] in PROTECTED_FIELDS:
+                        raise HTTPException(status_code=422, detail=f"Cannot patch {pointer}")
+                    touched.add(tokens[0])
+            patched = {**estate, **{field: copy.deepcopy(estate.get(field)) for field in touched if field in estate}}
+
+            try:
+                if request.operations:
+                    apply_json_patch(patched, [op.dict(by_alias=True, exclude_none=True) for op in request.operations])
+                for op in request.items:
+                    model = ITEM_MODELS.get(op.collection)
+                    if model is None:
+                        raise HTTPException(status_code=422, detail=f"Unknown collection {op.collection}")
+                    item = apply_item_operation(patched, op.collection, op.action, item_id=op.id, index=op.index, value=op.value)
+                    if item is not None:
+                        model(**item)
+            except JsonPatchTestFailed as e:
+                raise HTTPException(status_code=409, detail=str(e)) from e
+            except (JsonPatchError, ValueError) as e:
+                raise HTTPException(status_code=422, detail=str(e)) from e
+
+            # JSON Patch may touch any field, so validate the whole result
+            if request.operations:
+                try:
+                    Estate(**patched)
+                except ValueError as e:
+                    raise HTTPException(status_code=422, detail=str(e)) from e
+
+            bump_version(patched)
+            json_storage.put(storage_key, patched)
+
+        response.headers["ETag"] = estate_etag(patched)
+        return PatchEstateResponse(id=patched["id"], version=patched["version"], updatedAt=patched["updatedAt"])
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 @router.delete("/estate/{estate_id}")
-async def delete_estate(estate_id: str, user: AuthorizedUser):
+async def delete_estate(estate_id: str, access: EstateAdmin):
     try:
+        estate = access.estate
         storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        estate = db.storage.json.get(storage_key)
-        if not estate:
-            raise HTTPException(status_code=404, detail="Estate not found")
-        
-        # Check if user has access to this estate
-        if estate["userId"] != user.sub:
-            # Check if user is an admin collaborator
-            roles_key = sanitize_storage_key(f"roles_{estate_id}")
-            roles = db.storage.json.get(roles_key, default=[])
-            user_role = next((r for r in roles if r["user_id"] == user.sub and r["status"] == "accepted" and r["role"] == "admin"), None)
-            if not user_role:
-                raise HTTPException(status_code=403, detail="Unauthorized to delete estate")
         
         # Delete estate and related data
-        db.storage.json.delete(storage_key)
+        json_storage.delete(storage_key)
+        
+        # Drop the estate from the owner's and collaborators' estate index
+        # and from the invitation index of pending invitees
+        remove_estate_from_index(estate["userId"], estate_id)
+        for role in access.roles:
+            if role["status"] == "accepted":
+                remove_estate_from_index(role["user_id"], estate_id)
+            elif role["status"] == "pending":
+                remove_invitation_from_index(role["email"], estate_id)
         
         # Delete roles
-        roles_key = sanitize_storage_key(f"roles_{estate_id}")
         try:
-            db.storage.json.delete(roles_key)
+            json_storage.delete(sanitize_storage_key(f"roles_{estate_id}"))
         except FileNotFoundError:
             pass
         
         # Delete comments
-        comments_key = sanitize_storage_key(f"comments_{estate_id}")
-        try:
-            db.storage.json.delete(comments_key)
-        except FileNotFoundError:
-            pass
+        delete_comment_log(estate_id)
+        
+        # Delete the transaction ledger
+        delete_ledger(estate_id)
         
         return {"message": "Estate deleted successfully"}
     except Exception as e:
@@ -273,23 +368,14 @@ async def delete_estate(estate_id: str, user: AuthorizedUser):
 @router.get("/estates")
 async def list_estates(user: AuthorizedUser) -> List[Estate]:
     try:
-        # Get all estates where user is owner
+        # Get all estates where user is owner or accepted collaborator
         all_estates = []
 
-        # List all estate files
-        estate_files = db.storage.json.list()
-        for file in estate_files:
-            if file.name.startswith("estates_"):
-                estate = db.storage.json.get(file.name)
-                if estate["userId"] == user.sub:
-                    all_estates.append(estate)
-                else:
-                    # Check if user is a collaborator
-                    roles_key = sanitize_storage_key(f"roles_{estate['id']}")
-                    roles = db.storage.json.get(roles_key, default=[])
-                    user_role = next((r for r in roles if r["user_id"] == user.sub and r["status"] == "accepted"), None)
-                    if user_role:
-                        all_estates.append(estate)
+        # Only load the estates listed in the user's estate index
+        estate_keys = [sanitize_storage_key(f"estates_{estate_id}") for estate_id in get_user_estate_ids(user.sub)]
+        for estate in json_storage.get_many(estate_keys).values():
+            if estate:
+                all_estates.append(estate)
 
         return [Estate(**estate) for estate in all_estates]
     except Exception as e:
@@ -423,16 +509,15 @@ async def update_estate_status(estate_id: str, status: str) -> Estate:
     """Update the status of an estate. This is an internal function used by the payment webhook."""
     try:
         storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        estate = db.storage.json.get(storage_key)
-        if not estate:
-            raise ValueError("Estate not found")
-
-        estate["status"] = status
-        estate["updatedAt"] = datetime.now()
-
-        # Save updated estate
-        storage_key = sanitize_storage_key(f"estates_{estate_id}")
-        db.storage.json.put(storage_key, estate)
+        with json_storage.transaction():
+            # Read around the cache so newer edits and versions are not overwritten
+            estate = json_storage.get_fresh(storage_key, default=None)
+            if not estate:
+                raise ValueError("Estate not found")
+
+            estate["status"] = status
+            bump_version(estate)
+            json_storage.put(storage_key, estate)
 
         return Estate(**estate)
     except Exception as e:
@@ -1,17 +1,46 @@
-from fastapi import APIRouter, HTTPException, UploadFile, Body, File
+from fastapi import APIRouter, HTTPException, Request, UploadFile, Body, File, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
 import json
-import databutton as db
+import os
+from app.libs.storage import json_storage
 from app.auth import AuthorizedUser
+from app.libs.ai_clients import openai_client, vision_client
+from app.libs.concurrency import get_provider
+from app.libs.estate_access import EstateEditor, EstateViewer, resolve_estate_access
+from app.libs.jobs import SUCCEEDED, JobContext, enqueue_job, new_job_id, read_job, register_job_handler, watch_job
+from app.libs.merchant_cache import CLASSIFICATION_FIELDS, lookup_merchants, normalize_recipient, remember_merchants
+from app.libs.merchant_dictionary import MerchantMatch, match_merchant
+from app.libs.ocr_cache import content_hash, get_cached_text, get_previous_upload, record_upload, store_text
+from app.libs.recurring_payments import RecurringPattern, detect_estate_recurring
+from app.libs.statement_ocr import is_pdf, ocr_statement, vision_provider
+from app.libs.statement_parsers import parse_statement
+from app.libs.transaction_analytics import compute_analytics, recipient_key
+from app.libs.transaction_codec import decode_transactions, encode_transactions
+from app.libs.transaction_ledger import find_known_transactions, fingerprint_transactions, get_ledger_transaction, merge_transactions, read_transactions
+from app.libs.uploads import ReceivedFile, file_upload_openapi, receive_file, receive_files
+from google.api_core import exceptions as google_exceptions
 from google.cloud import vision
-from openai import OpenAI
+import openai
+import asyncio
+import copy
 import io
-import re
+import shutil
+import tempfile
 
 router = APIRouter()
 
+# Bounded concurrency, rate limits and retries for the external APIs, so many
+# calls can be in flight without blocking the event loop or hitting quotas
+openai_provider = get_provider("openai", retry_on=(
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+))
+
 class Transaction(BaseModel):
     id: str
     date: str
@@ -25,6 +54,42 @@ class Transaction(BaseModel):
 class TransactionList(BaseModel):
     transactions: List[Transaction]
     estate_id: str
+    next_cursor: Optional[str] = None
+
+class CategoryTotal(BaseModel):
+    category: str
+    spent: float
+    income: float
+    count: int
+
+class MonthlySpend(BaseModel):
+    month: str
+    spent: float
+    income: float
+    count: int
+
+class RecurringTotals(BaseModel):
+    transactions: int
+    subscriptions: int
+    total: float
+    monthly_cost: float
+
+class RecipientTotal(BaseModel):
+    recipient: str
+    spent: float
+    count: int
+
+class TransactionAnalytics(BaseModel):
+    estate_id: str
+    transactions: int
+    spent: float
+    income: float
+    first_date: Optional[str] = None
+    last_date: Optional[str] = None
+    categories: List[CategoryTotal]
+    months: List[MonthlySpend]
+    recurring: RecurringTotals
+    top_recipients: List[RecipientTotal]
 
 class SubscriptionCancellation(BaseModel):
     transaction_id: str
@@ -49,20 +114,10 @@ class CancellationStatusUpdate(BaseModel):
     comment: str
 
 def initialize_vision_client():
-    """Initialize Google Cloud Vision client with credentials."""
-    try:
-        credentials_json = db.secrets.get("GOOGLE_VISION_CREDENTIALS")
-        print("Got credentials from secrets")
-        credentials_dict = json.loads(credentials_json)
-        print("Parsed credentials JSON")
-        client = vision.ImageAnnotatorClient.from_service_account_info(credentials_dict)
-        print("Created Vision client")
-        return client
-    except Exception as e:
-        print(f"Error initializing Vision client: {str(e)}")
-        raise
+    """Get the shared Google Cloud Vision client, created with credentials on first use."""
+    return vision_client.get()
 
-def extract_text_from_image(image_content: bytes) -> str:
+async def extract_text_from_image(image_content: bytes) -> str:
     """Extract text from image using Google Cloud Vision API."""
     try:
         print("Initializing Vision client...")
@@ -70,127 +125,212 @@ def extract_text_from_image(image_content: bytes) -> str:
         print("Creating Image object...")
         image = vision.Image(content=image_content)
         print("Calling document_text_detection...")
-        response = client.document_text_detection(image=image)
+        response = await vision_provider.call(
+            client.batch_annotate_images,
+            requests=[vision.AnnotateImageRequest(
+                image=image,
+                features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+            )],
+        )
+        response = response.responses[0]
+        if response.error.message:
+            raise ValueError(response.error.message)
         print("Got response from Vision API")
         if not response.full_text_annotation:
             raise ValueError("No text found in image")
         return response.full_text_annotation.text
+    except (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied):
+        # The credentials may have been rotated, the next call reads them again
+        vision_client.rotate()
+        raise
     except Exception as e:
         print(f"Error in extract_text_from_image: {str(e)}")
         raise
 
 def parse_transaction_text(text: str) -> List[dict]:
-    """Parse transaction text into structured data."""
-    # Split text into lines
-    lines = text.strip().split('\n')
-    transactions = []
-    
-    # Regular expression for date, recipient, and amount
-    pattern = r'(\d{2}\.\d{2}\.\d{4})\s+([^\d-]+)\s+(-?\d+[,.]\d{2})\s*(?:NOK)?'
-    
-    for line in lines:
-        match = re.match(pattern, line)
-        if match:
-            date_str, recipient, amount_str = match.groups()
-            
-            # Convert date to ISO format
-            date = datetime.strptime(date_str, '%d.%m.%Y').strftime('%Y-%m-%d')
-            
-            # Clean up amount
-            amount = float(amount_str.replace(',', '.'))
-            
-            # Clean up recipient
-            recipient = recipient.strip()
-            
-            transactions.append({
-                'date': date,
-                'recipient': recipient,
-                'amount': amount,
-            })
-    
-    return transactions
+    """Parse transaction text into structured data, detecting the bank's layout."""
+    return parse_statement(text)
 
 def get_openai_client():
-    """Initialize OpenAI client with API key."""
-    return OpenAI(api_key=db.secrets.get("OPENAI_API_KEY"))
+    """Get the shared OpenAI client, created with the API key on first use."""
+    return openai_client.get()
+
+# Number of transactions classified per chat completion
+AI_BATCH_SIZE = int(os.environ.get("AI_BATCH_SIZE", "25"))
 
-def analyze_transaction_with_ai(transaction: dict) -> dict:
+# Confidence stored in the merchant cache for classifications made by OpenAI
+AI_CONFIDENCE = 0.8
+
+async def analyze_transaction_with_ai(transaction: dict) -> dict:
     """Use OpenAI to analyze transaction and identify subscriptions."""
-    client = get_openai_client()
-    
-    prompt = f"""Analyze this transaction and determine:
+    return (await analyze_transaction_batch([transaction]))[0]
+
+async def analyze_transactions_with_ai(
+    transactions: List[dict],
+    batch_size: int = AI_BATCH_SIZE,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    recurring: Optional[Dict[str, RecurringPattern]] = None,
+) -> List[dict]:
+    """Analyze transactions in batches of batch_size, one OpenAI request per batch.
+
+    Merchants in the merchant cache are classified without calling OpenAI.
+    For recipients the recurring-payment patterns in `recurring` are
+    confident about, the patterns decide whether they are subscriptions;
+    they are only classified without OpenAI when the merchant dictionary
+    knows their category. Each remaining merchant is only sent once. Batches
+    are sent concurrently within the OpenAI provider limits. `on_progress` is
+    called with (batches done, batches) as batches complete.
+    """
+    cached = await asyncio.to_thread(lookup_merchants, transactions)
+    for i, classification in cached.items():
+        transactions[i].update(classification)
+
+    patterns: Dict[int, RecurringPattern] = {}
+    decided = set()
+    for i, transaction in enumerate(transactions):
+        pattern = (recurring or {}).get(recipient_key(transaction['recipient']))
+        if i not in cached and pattern is not None and pattern.is_recurring is not None:
+            patterns[i] = pattern
+            merchant = match_merchant(transaction['recipient'])
+            if merchant is not None:
+                categorize_recurring_transaction(transaction, pattern, merchant)
+                decided.add(i)
+    if decided:
+        print(f"Classified {len(decided)} of {len(transactions)} transactions from their payment history")
+
+    unknown: dict = {}
+    for i, transaction in enumerate(transactions):
+        if i not in cached and i not in decided:
+            merchant = normalize_recipient(transaction['recipient']) or transaction['recipient']
+            unknown.setdefault(merchant, []).append(transaction)
+
+    representatives = [group[0] for group in unknown.values()]
+    batches = [
+        analyze_transaction_batch(representatives[start:start + batch_size])
+        for start in range(0, len(representatives), batch_size)
+    ]
+    if on_progress is not None:
+        on_progress(0, len(batches))
+    for done, batch in enumerate(asyncio.as_completed(batches), 1):
+        await batch
+        if on_progress is not None:
+            on_progress(done, len(batches))
+
+    # Repeated payments to the same merchant get the same classification
+    for group in unknown.values():
+        for transaction in group[1:]:
+            transaction.update({field: copy.deepcopy(group[0].get(field)) for field in CLASSIFICATION_FIELDS})
+
+    # The payment history decides subscriptions over OpenAI's guess
+    for i, pattern in patterns.items():
+        if i not in decided:
+            apply_recurring_pattern(transactions[i], pattern)
+
+    return transactions
+
+def _valid_analysis(analysis) -> bool:
+    return (
+        isinstance(analysis, dict)
+        and isinstance(analysis.get("is_subscription"), bool)
+        and isinstance(analysis.get("category"), str)
+        and analysis["category"] != ""
+        and isinstance(analysis.get("subscription_frequency"), (str, type(None)))
+        and isinstance(analysis.get("contact_info"), (dict, type(None)))
+    )
+
+async def analyze_transaction_batch(transactions: List[dict]) -> List[dict]:
+    """Analyze several transactions with a single OpenAI request.
+
+    Transactions missing from the response or with malformed analysis are
+    categorized with categorize_transaction_fallback.
+    """
+    if not transactions:
+        return transactions
+
+    lines = "\n".join(
+        f"{i}. Recipient: {t['recipient']} | Amount: {t['amount']} NOK | Date: {t['date']}"
+        for i, t in enumerate(transactions)
+    )
+    prompt = f"""Analyze each of these transactions and determine:
 1. Is it likely a subscription? (true/false)
 2. What category does it belong to?
 3. What is the likely subscription frequency if it's a subscription?
 4. What is the contact information for cancellation?
 
-Transaction:
-Recipient: {transaction['recipient']}
-Amount: {transaction['amount']} NOK
-Date: {transaction['date']}
+Transactions:
+{lines}
 
-Respond in this JSON format:
+Respond with a JSON object with one result per transaction, using the transaction's number as index:
 {{
-    "is_subscription": boolean,
-    "category": string,
-    "subscription_frequency": string or null,
-    "contact_info": {{
-        "email": string or null,
-        "phone": string or null,
-        "website": string or null
-    }}
+    "results": [
+        {{
+            "index": number,
+            "is_subscription": boolean,
+            "category": string,
+            "subscription_frequency": string or null,
+            "contact_info": {{
+                "email": string or null,
+                "phone": string or null,
+                "website": string or null
+            }}
+        }}
+    ]
 }}
 """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are an AI trained to analyze bank transactions and identify subscriptions. You have extensive knowledge of Norwegian companies and their subscription services."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    
+    analyses = {}
     try:
-        analysis = json.loads(response.choices[0].message.content)
-        
+        client = get_openai_client()
+        response = await openai_provider.call(
+            client.chat.completions.create,
+            model="gpt-4o-mini",
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": "You are an AI trained to analyze bank transactions and identify subscriptions. You have extensive knowledge of Norwegian companies and their subscription services."},
+                {"role": "user", "content": prompt}
+            ]
+        )
+        results = json.loads(response.choices[0].message.content).get("results", [])
+        for result in results:
+            if isinstance(result, dict) and isinstance(result.get("index"), int):
+                analyses[result["index"]] = result
+    except openai.AuthenticationError as e:
+        print(f"OpenAI authentication failed: {e}")
+        openai_client.rotate()
+    except Exception as e:
+        print(f"Error analyzing transactions with AI: {e}")
+
+    analyzed = []
+    for i, transaction in enumerate(transactions):
+        analysis = analyses.get(i)
+        if not _valid_analysis(analysis):
+            print(f"Missing or malformed AI analysis for transaction {i}, using fallback")
+            categorize_transaction_fallback(transaction)
+            continue
+
         # Update transaction with AI analysis
         transaction['is_subscription'] = analysis['is_subscription']
         transaction['category'] = analysis['category']
         transaction['subscription_frequency'] = analysis['subscription_frequency']
         transaction['contact_info'] = analysis['contact_info']
-        
-        return transaction
+        analyzed.append(transaction)
+
+    # Remember the merchants so later uploads skip OpenAI for them
+    try:
+        await asyncio.to_thread(remember_merchants, analyzed, confidence=AI_CONFIDENCE)
     except Exception as e:
-        print(f"Error parsing AI response: {e}")
-        return categorize_transaction_fallback(transaction)
+        print(f"Error storing merchant classifications: {e}")
+
+    return transactions
 
 def categorize_transaction_fallback(transaction: dict) -> dict:
-    """Fallback categorization if AI fails."""
-    # Basic categorization rules
-    categories = {
-        'streaming': ['spotify', 'netflix', 'hbo', 'disney', 'viaplay'],
-        'telecom': ['telia', 'telenor', 'ice', 'one call'],
-        'utilities': ['fortum', 'hafslund', 'fjordkraft'],
-        'groceries': ['kiwi', 'rema', 'meny', 'coop', 'spar', 'bunnpris'],
-        'transport': ['ruter', 'vy', 'flytoget'],
-    }
-    
-    recipient_lower = transaction['recipient'].lower()
-    
-    # Check categories
-    for category, keywords in categories.items():
-        if any(keyword in recipient_lower for keyword in keywords):
-            transaction['category'] = category
-            break
-    else:
-        transaction['category'] = 'other'
-    
-    # Check if it's likely a subscription
-    subscription_keywords = ['spotify', 'netflix', 'hbo', 'telia', 'telenor', 'fortum']
-    transaction['is_subscription'] = any(keyword in recipient_lower for keyword in subscription_keywords)
+    """Fallback categorization if AI fails, from the merchant dictionary."""
+    merchant = match_merchant(transaction['recipient'])
+    transaction['category'] = merchant.category if merchant else 'other'
+    transaction['is_subscription'] = bool(merchant and merchant.is_subscription)
     
     if transaction['is_subscription']:
-        transaction['subscription_frequency'] = 'monthly'  # Default to monthly
+        transaction['subscription_frequency'] = merchant.subscription_frequency
         transaction['contact_info'] = {
             'email': None,
             'phone': None,
@@ -199,123 +339,332 @@ def categorize_transaction_fallback(transaction: dict) -> dict:
     
     return transaction
 
-class UploadTransactionsRequest(BaseModel):
-    file: str
+def categorize_recurring_transaction(transaction: dict, pattern: RecurringPattern, merchant: MerchantMatch) -> dict:
+    """Categorize a transaction of a dictionary merchant the recurring-payment detector is confident about."""
+    transaction['category'] = merchant.category
+    return apply_recurring_pattern(transaction, pattern)
+
+def apply_recurring_pattern(transaction: dict, pattern: RecurringPattern) -> dict:
+    """Set whether a transaction is a subscription from its recipient's recurring-payment pattern.
+
+    The category and any contact info found for the transaction are kept.
+    """
+    transaction['is_subscription'] = bool(pattern.is_recurring)
+    transaction['subscription_frequency'] = pattern.frequency if pattern.is_recurring else None
+
+    if transaction['is_subscription'] and not transaction.get('contact_info'):
+        transaction['contact_info'] = {
+            'email': None,
+            'phone': None,
+            'website': None
+        }
+
+    return transaction
+
+class StatementJob(BaseModel):
+    job_id: str
+    estate_id: str
+    status: str
+    stage: str
+    done: int = 0
+    total: Optional[int] = None
+    error: Optional[str] = None
+    result: Optional[TransactionList] = None
+    created_at: str
+    updated_at: str
 
-@router.post("/upload/{estate_id}", summary="Upload Transactions")
+# Uploaded files are kept here until their job has processed them
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "statement-uploads"))
+
+def statement_job_response(job: dict) -> StatementJob:
+    """Convert a stored job, loading its transactions once it has succeeded."""
+    result = None
+    if job["status"] == SUCCEEDED and job["result"]:
+        stored = json_storage.get(job["result"]["storage_key"], default=None)
+        if stored:
+            result = TransactionList(
+                transactions=[Transaction(**t) for t in decode_transactions(stored['transactions'])],
+                estate_id=stored['estate_id']
+            )
+    return StatementJob(
+        job_id=job["id"],
+        estate_id=job["info"]["estate_id"],
+        status=job["status"],
+        stage=job["stage"],
+        done=job["done"],
+        total=job["total"],
+        error=job["error"],
+        result=result,
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+    )
+
+async def enqueue_statement_job(estate_id: str, files: List[ReceivedFile], digest: str, user_id: str) -> StatementJob:
+    """Keep the uploaded files for the workers and queue a job processing them."""
+    job_id = new_job_id()
+    directory = os.path.join(UPLOAD_DIR, job_id)
+    saved = [file.save(directory) for file in files]
+    job = await enqueue_job("statement", {
+        "files": saved,
+        "directory": directory,
+        "digest": digest,
+    }, user_id=user_id, job_id=job_id, info={"estate_id": estate_id})
+    return statement_job_response(job)
+
+@router.post("/upload/{estate_id}", summary="Upload Transactions", status_code=202, openapi_extra=file_upload_openapi("file"))
 async def upload_transactions(
     estate_id: str,
-    body: UploadTransactionsRequest,
-    user: AuthorizedUser = None
-) -> TransactionList:
+    request: Request,
+    access: EstateEditor,
+) -> StatementJob:
+    """Upload a bank statement image as multipart/form-data in the `file` field.
+
+    Returns a job at once; poll it or stream its events for the transactions.
+    """
     try:
-        # Decode base64 content
-        import base64
-        content = base64.b64decode(body.file)
-        
-        # Extract text from image
+        # Stream the upload to a temporary file, hashing it as it arrives
+        upload = await receive_file(request, "file")
+        with upload:
+            return await enqueue_statement_job(estate_id, [upload], upload.sha256, access.user_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+@router.post("/upload-statement/{estate_id}", summary="Upload Statement", status_code=202, openapi_extra=file_upload_openapi("files", multiple=True))
+async def upload_statement(
+    estate_id: str,
+    request: Request,
+    access: EstateEditor,
+) -> StatementJob:
+    """Upload a bank statement as PDFs or several images in the `files` field.
+
+    All pages are read with batched Vision requests in parallel, and the
+    transactions of all pages are stored as one list in page order. Returns
+    a job at once; poll it or stream its events for the transactions.
+    """
+    try:
+        files = await receive_files(request, "files")
         try:
-            print("Content length:", len(content))
-            text = extract_text_from_image(content)
-            print("Extracted text:", text)
-        except Exception as e:
-            print(f"Error extracting text: {str(e)}")
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to extract text from image: {str(e)}"
-            ) from e
+            # Identifies the same set of files uploaded again, in the same order
+            digest = content_hash("".join(f.sha256 for f in files).encode())
+            return await enqueue_statement_job(estate_id, files, digest, access.user_id)
+        finally:
+            for file in files:
+                file.close()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+async def _get_user_job(job_id: str, user) -> dict:
+    job = await read_job(job_id)
+    if not job or job["kind"] != "statement" or job["user_id"] != user.sub:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/statement-jobs/{job_id}", summary="Get Statement Job")
+async def get_statement_job(job_id: str, user: AuthorizedUser = None) -> StatementJob:
+    """Get the status and progress of an upload, with its transactions once done."""
+    job = await _get_user_job(job_id, user)
+    return await asyncio.to_thread(statement_job_response, job)
+
+@router.get("/statement-jobs/{job_id}/events", summary="Stream Statement Job")
+async def stream_statement_job(job_id: str, user: AuthorizedUser = None):
+    """Stream the job as server-sent events on every change until it is finished."""
+    await _get_user_job(job_id, user)
+
+    async def events():
+        async for job in watch_job(job_id):
+            if job is None:
+                yield ": keep-alive\n\n"
+                continue
+            response = await asyncio.to_thread(statement_job_response, job)
+            data = json.dumps(response.dict())
+            yield f"event: {job['status']}\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def process_statement_job(job: JobContext) -> dict:
+    """Read, parse, classify and store the transactions of an uploaded statement."""
+    estate_id = job.info["estate_id"]
+    digest = job.payload["digest"]
+    
+    files = []
+    try:
+        # The same statement uploaded again, return the earlier result
+        previous = await asyncio.to_thread(get_previous_upload, estate_id, digest)
+        if previous:
+            print(f"Upload {digest} already processed, returning stored transactions")
+            return {"storage_key": previous}
+        
+        files = [ReceivedFile.load(saved) for saved in job.payload["files"]]
         
-        # Parse transactions
+        # Parse each page as soon as its text is read
+        job.progress("reading")
+        page_transactions = {}
         try:
-            transactions = parse_transaction_text(text)
+            if len(files) == 1 and not is_pdf(files[0]):
+                job.progress("reading", total=1)
+                pages = read_image(files[0], digest)
+            else:
+                pages = ocr_statement(files, on_page_count=lambda total: job.progress("reading", total=total))
+            async for page, text in pages:
+                try:
+                    page_transactions[page] = parse_transaction_text(text)
+                except Exception as e:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Failed to parse transactions: {str(e)}"
+                    ) from e
+                job.progress("reading", done=len(page_transactions), total=job.job["total"])
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"Error parsing transactions: {str(e)}")
+            print(f"Error extracting text: {str(e)}")
             raise HTTPException(
                 status_code=400,
-                detail=f"Failed to parse transactions: {str(e)}"
+                detail=f"Failed to extract text from statement: {str(e)}"
             ) from e
-        
-        # Analyze transactions with AI
-        transactions = [analyze_transaction_with_ai(t) for t in transactions]
-        
-        # Add IDs to transactions
-        for i, t in enumerate(transactions):
-            t['id'] = f"tx_{datetime.now().strftime('%Y%m%d%H%M%S')}_{i}"
-        
-        # Convert to Transaction objects
-        transaction_objects = [Transaction(**t) for t in transactions]
-        
-        # Save to storage
-        storage_key = f"transactions/{estate_id}/{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        db.storage.json.put(storage_key, {
+    finally:
+        for file in files:
+            file.close()
+        shutil.rmtree(job.payload["directory"], ignore_errors=True)
+    
+    print(f"Read {len(page_transactions)} pages from {len(files)} files")
+    transactions = [t for page in sorted(page_transactions) for t in page_transactions[page]]
+    storage_key = await classify_and_store_transactions(
+        estate_id, digest, transactions,
+        on_progress=lambda done, total: job.progress("classifying", done=done, total=total),
+    )
+    return {"storage_key": storage_key}
+
+async def read_image(file: ReceivedFile, digest: str):
+    """Read a single image as page 0, unless its text was read before."""
+    text = await asyncio.to_thread(get_cached_text, digest)
+    if text is None:
+        text = await extract_text_from_image(file.read())
+        await asyncio.to_thread(store_text, digest, text)
+    else:
+        print(f"Using cached OCR text for {digest}")
+    yield 0, text
+
+register_job_handler("statement", process_statement_job)
+
+async def classify_and_store_transactions(
+    estate_id: str,
+    digest: str,
+    transactions: List[dict],
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> str:
+    """Classify parsed transactions, store them for the estate and record the upload.
+
+    Returns the storage key of the stored transactions.
+    """
+    # Transactions already in the estate's ledger from an overlapping upload
+    # are neither classified nor stored again
+    fingerprints = fingerprint_transactions(transactions)
+    # Storage and ledger work runs in worker threads, off the event loop
+    known = await asyncio.to_thread(find_known_transactions, estate_id, transactions, fingerprints)
+    new = [i for i in range(len(transactions)) if i not in known]
+    if known:
+        print(f"Skipping {len(known)} of {len(transactions)} transactions already in the ledger")
+    
+    # Recipients charged at regular intervals, with the ledger's earlier charges as history
+    new_transactions = [transactions[i] for i in new]
+    try:
+        recurring = await asyncio.to_thread(detect_estate_recurring, estate_id, new_transactions)
+    except Exception as e:
+        print(f"Error detecting recurring payments: {e}")
+        recurring = None
+
+    # Analyze the rest with AI, several per request
+    classified = await analyze_transactions_with_ai(new_transactions, on_progress=on_progress, recurring=recurring)
+    
+    # Merge into the estate's ledger, which assigns the IDs
+    rows = [Transaction(**{**t, 'id': ''}).dict() for t in classified]
+    stored = await asyncio.to_thread(merge_transactions, estate_id, rows, [fingerprints[i] for i in new])
+    stored_by_index = {**known, **dict(zip(new, stored))}
+    transaction_objects = [Transaction(**stored_by_index[i]) for i in range(len(transactions))]
+    
+    # Save the upload's snapshot, returned as the job's result
+    storage_key = f"transactions/{estate_id}/{datetime.now().strftime('%Y%m%d%H%M%S')}_{digest[:12]}"
+
+    def store_snapshot():
+        json_storage.put(storage_key, {
             'estate_id': estate_id,
-            'transactions': [t.dict() for t in transaction_objects]
+            'transactions': encode_transactions([t.dict() for t in transaction_objects])
         })
+        record_upload(estate_id, digest, storage_key)
+
+    await asyncio.to_thread(store_snapshot)
+    return storage_key
+
+@router.get("/transaction/{estate_id}")
+async def get_transactions(
+    estate_id: str,
+    access: EstateViewer,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    category: Optional[str] = None,
+    is_subscription: Optional[bool] = None,
+) -> TransactionList:
+    """Get a page of the estate's transactions, newest first.
+
+    Dates are inclusive ISO dates. Pass `next_cursor` from the response as
+    `cursor` to get the next page; it is null on the last page.
+    """
+    try:
+        transactions, next_cursor = read_transactions(
+            estate_id,
+            limit=limit,
+            cursor=cursor,
+            date_from=date_from,
+            date_to=date_to,
+            category=category,
+            is_subscription=is_subscription,
+        )
         
         return TransactionList(
-            transactions=transaction_objects,
-            estate_id=estate_id
+            transactions=[Transaction(**t) for t in transactions],
+            estate_id=estate_id,
+            next_cursor=next_cursor
         )
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
-@router.get("/transaction/{estate_id}")
-async def get_transactions(estate_id: str, user: AuthorizedUser = None) -> TransactionList:
-    # Test data
-    test_transactions = [
-        {
-            "id": "tx_1",
-            "date": "2024-02-24",
-            "recipient": "Spotify AB",
-            "amount": -129.00,
-            "category": "streaming",
-            "is_subscription": True,
-            "subscription_frequency": "monthly",
-            "contact_info": {
-                "email": "support@spotify.com",
-                "phone": None,
-                "website": "https://spotify.com"
-            }
-        },
-        {
-            "id": "tx_2",
-            "date": "2024-02-25",
-            "recipient": "Telia Mobil",
-            "amount": -349.00,
-            "category": "telecom",
-            "is_subscription": True,
-            "subscription_frequency": "monthly",
-            "contact_info": {
-                "email": "support@telia.no",
-                "phone": "915 09000",
-                "website": "https://telia.no"
-            }
-        },
-        {
-            "id": "tx_3",
-            "date": "2024-02-26",
-            "recipient": "Kiwi butikk",
-            "amount": -199.50,
-            "category": "groceries",
-            "is_subscription": False,
-            "subscription_frequency": None,
-            "contact_info": None
-        }
-    ]
+@router.get("/transaction/{estate_id}/analytics")
+async def get_transaction_analytics(
+    estate_id: str,
+    access: EstateViewer,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    top: int = Query(10, ge=1, le=100),
+) -> TransactionAnalytics:
+    """Totals over the estate's transactions: per category, per month, subscriptions and top recipients.
+
+    Spending is reported as positive amounts. Dates are inclusive ISO dates.
+    """
     try:
-        # Return test data
-        transaction_objects = [Transaction(**t) for t in test_transactions]
-        
-        return TransactionList(
-            transactions=transaction_objects,
-            estate_id=estate_id
+        analytics = await asyncio.to_thread(
+            compute_analytics, estate_id, date_from=date_from, date_to=date_to, top=top
         )
-        
+        return TransactionAnalytics(**analytics)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
-def generate_cancellation_content(transaction: Transaction, estate: dict, method: str) -> str:
+async def generate_cancellation_content(transaction: Transaction, estate: dict, method: str) -> str:
     """Generate cancellation content using OpenAI."""
     client = get_openai_client()
     
@@ -337,7 +686,8 @@ The {method} should:
 6. Include relevant account or customer numbers if available
 """
 
-    response = client.chat.completions.create(
+    response = await openai_provider.call(
+        client.chat.completions.create,
         model="gpt-4o-mini",
         messages=[
             {"role": "system", "content": "You are an AI trained to write formal Norwegian cancellation letters and emails. You write in a clear, professional tone suitable for business communication."},
@@ -351,11 +701,11 @@ The {method} should:
 async def get_cancellation_status(
     estate_id: str,
     transaction_id: str,
-    user: AuthorizedUser = None
+    access: EstateViewer,
 ) -> CancellationStatus:
     try:
         storage_key = f"cancellations/{estate_id}/{transaction_id}"
-        cancellation = db.storage.json.get(storage_key)
+        cancellation = json_storage.get(storage_key)
         
         if not cancellation:
             raise HTTPException(status_code=404, detail="Cancellation not found")
@@ -373,11 +723,11 @@ async def update_cancellation_status(
     estate_id: str,
     transaction_id: str,
     update: CancellationStatusUpdate,
-    user: AuthorizedUser = None
+    access: EstateEditor,
 ) -> CancellationStatus:
     try:
         storage_key = f"cancellations/{estate_id}/{transaction_id}"
-        cancellation = db.storage.json.get(storage_key)
+        cancellation = json_storage.get(storage_key)
         
         if not cancellation:
             raise HTTPException(status_code=404, detail="Cancellation not found")
@@ -394,7 +744,7 @@ async def update_cancellation_status(
         })
         
         # Save updated cancellation
-        db.storage.json.put(storage_key, cancellation)
+        json_storage.put(storage_key, cancellation)
         
         return CancellationStatus(
             status=cancellation['status'],
@@ -410,23 +760,20 @@ async def cancel_subscription(
     user: AuthorizedUser = None
 ) -> CancellationResponse:
     try:
+        # The estate is in the body, so the role is checked here instead of by a dependency
+        access = resolve_estate_access(request.estate_id, user.sub)
+        if not access.has_role("editor"):
+            raise HTTPException(status_code=403, detail="Unauthorized to update estate")
+        estate = access.estate
+
         # Get transaction details
-        transactions = await get_transactions(request.estate_id)
-        transaction = next(
-            (t for t in transactions.transactions if t.id == request.transaction_id),
-            None
-        )
-        
-        if not transaction:
+        stored = get_ledger_transaction(request.estate_id, request.transaction_id)
+        if not stored:
             raise HTTPException(status_code=404, detail="Transaction not found")
-        
-        # Get estate details for the cancellation letter
-        estate = db.storage.json.get(f"estates/{request.estate_id}")
-        if not estate:
-            raise HTTPException(status_code=404, detail="Estate not found")
+        transaction = Transaction(**stored)
         
         # Generate cancellation content using AI
-        cancellation_content = generate_cancellation_content(
+        cancellation_content = await generate_cancellation_content(
             transaction,
             estate,
             'letter' if request.cancellation_method == 'letter' else 'email'
@@ -434,7 +781,7 @@ async def cancel_subscription(
         
         # Save cancellation details
         storage_key = f"cancellations/{request.estate_id}/{transaction.id}"
-        db.storage.json.put(storage_key, {
+        json_storage.put(storage_key, {
             'estate_id': request.estate_id,
             'transaction_id': transaction.id,
             'cancellation_method': request.cancellation_method,
@@ -459,5 +806,7 @@ async def cancel_subscription(
             contact_info=request.contact_info
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
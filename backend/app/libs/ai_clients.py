@@ -0,0 +1,165 @@
+"""Process-wide clients for Google Cloud Vision and OpenAI.
+
+Each client is created on first use and then shared by all requests, so the
+credentials are read, the gRPC channel is opened and the HTTP connection pool
+is filled once instead of per call. Connections are kept alive between calls:
+
+    OPENAI_MAX_CONNECTIONS        connections in the OpenAI HTTP pool (default 20)
+    OPENAI_KEEPALIVE_SECONDS      idle time before a pooled connection is closed (default 60)
+    VISION_KEEPALIVE_SECONDS      interval of gRPC keepalive pings (default 30)
+
+Credentials come from the environment when set there, otherwise from
+Databutton secrets. When they are rotated, call `rotate()` on the client and
+the next call uses a client built from the new credentials; the old one is
+closed after in-flight calls had time to finish.
+
+Usage:
+
+    from app.libs.ai_clients import openai_client, vision_client
+
+    client = openai_client.get()
+    response = await client.chat.completions.create(...)
+"""
+
+import asyncio
+import json
+import os
+import threading
+from typing import Any, Callable, Optional
+
+# Seconds a replaced client stays open for calls that are still using it
+ROTATION_GRACE_SECONDS = 60
+
+
+def get_secret(name: str) -> str:
+    value = os.environ.get(name)
+    if value is None:
+        import databutton as db
+
+        value = db.secrets.get(name)
+    return value
+
+
+async def _close_client(client: Any) -> None:
+    try:
+        if hasattr(client, "close"):
+            await client.close()
+        else:
+            await client.transport.close()
+    except Exception as e:
+        print(f"Error closing client: {e}")
+
+
+class SharedClient:
+    """Lazily created, thread-safe client singleton that can be rebuilt on rotation."""
+
+    def __init__(self, name: str, secret_name: str, create: Callable[[str], Any]):
+        self.name = name
+        self.secret_name = secret_name
+        self._create = create
+        self._client: Any = None
+        self._credentials: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                credentials = get_secret(self.secret_name)
+                self._client = self._create(credentials)
+                self._credentials = credentials
+                print(f"Created {self.name} client")
+            return self._client
+
+    def rotate(self) -> bool:
+        """Re-read the credentials and rebuild the client if they changed.
+
+        Returns True if the client was replaced.
+        """
+        with self._lock:
+            if self._client is None:
+                return False
+            credentials = get_secret(self.secret_name)
+            if credentials == self._credentials:
+                return False
+            old = self._client
+            self._client = self._create(credentials)
+            self._credentials = credentials
+            print(f"Rotated {self.name} client credentials")
+        try:
+            loop = asyncio.get_running_loop()
+            loop.call_later(ROTATION_GRACE_SECONDS, lambda: loop.create_task(_close_client(old)))
+        except RuntimeError:
+            # No event loop to close it on, it is closed when garbage collected
+            pass
+        return True
+
+    async def close(self) -> None:
+        with self._lock:
+            client, self._client, self._credentials = self._client, None, None
+        if client is not None:
+            await _close_client(client)
+
+
+def _create_openai_client(api_key: str) -> Any:
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    max_connections = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "20"))
+    return AsyncOpenAI(
+        api_key=api_key,
+        # Retries are made by the OpenAI provider, with its rate limit and backoff
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=float(os.environ.get("OPENAI_KEEPALIVE_SECONDS", "60")),
+        )),
+    )
+
+
+def _create_vision_client(credentials_json: str) -> Any:
+    from google.cloud import vision
+    from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcAsyncIOTransport
+    from google.oauth2 import service_account
+
+    credentials = service_account.Credentials.from_service_account_info(json.loads(credentials_json))
+    keepalive_ms = int(float(os.environ.get("VISION_KEEPALIVE_SECONDS", "30")) * 1000)
+    channel = ImageAnnotatorGrpcAsyncIOTransport.create_channel(
+        credentials=credentials,
+        options=[
+            ("grpc.keepalive_time_ms", keepalive_ms),
+            ("grpc.keepalive_timeout_ms", 10000),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.max_receive_message_length", -1),
+            ("grpc.max_send_message_length", -1),
+        ],
+    )
+    return vision.ImageAnnotatorAsyncClient(transport=ImageAnnotatorGrpcAsyncIOTransport(channel=channel))
+
+
+openai_client = SharedClient("OpenAI", "OPENAI_API_KEY", _create_openai_client)
+vision_client = SharedClient("Vision", "GOOGLE_VISION_CREDENTIALS", _create_vision_client)
+
+
+def rotate_credentials() -> None:
+    """Pick up rotated credentials for all clients."""
+    openai_client.rotate()
+    vision_client.rotate()
+
+
+async def close_clients() -> None:
+    await openai_client.close()
+    await vision_client.close()
+
+
+__all__ = [
+    "get_secret",
+    "SharedClient",
+    "openai_client",
+    "vision_client",
+    "rotate_credentials",
+    "close_clients",
+]
@@ -0,0 +1,226 @@
+"""Append-only comment log per estate, stored in fixed-size segments.
+
+Documents for an estate:
+
+    comments_{estate_id}.head             {"count": n, "tasks": {task id: [k, ...]}}
+    comments_{estate_id}.seg.{k}          comments with sequence numbers k*SEGMENT_SIZE ...
+    comments_{estate_id}.task.{id}.{k}    sequence numbers of the task's comments in segment k
+
+The task index is segmented like the comments, and the head lists the
+segments each task has comments in. Appending a comment rewrites only the
+head, the last segment and the task's last index segment, whatever the
+number of comments. Reading a page only loads the segments that page falls
+in, and the task's index segments back to its first comment. Estates with
+comments in the old single `comments_{estate_id}` list, or with a single
+index per task, are migrated on first access.
+
+Usage:
+
+    from app.libs.comment_log import append_comment, read_comments
+
+    append_comment(estate_id, comment.dict())
+    comments, next_cursor = read_comments(estate_id, task_id=None, limit=50)
+"""
+
+from typing import Dict, List, Optional, Tuple
+from app.libs.storage import json_storage, sanitize_storage_key
+
+SEGMENT_SIZE = 100
+
+
+def _legacy_key(estate_id: str) -> str:
+    return sanitize_storage_key(f"comments_{estate_id}")
+
+
+def _head_key(estate_id: str) -> str:
+    return sanitize_storage_key(f"comments_{estate_id}.head")
+
+
+def _segment_key(estate_id: str, segment: int) -> str:
+    return sanitize_storage_key(f"comments_{estate_id}.seg.{segment}")
+
+
+def _task_key(estate_id: str, task_id: str, segment: int) -> str:
+    return sanitize_storage_key(f"comments_{estate_id}.task.{task_id}.{segment}")
+
+
+def _legacy_task_key(estate_id: str, task_id: str) -> str:
+    return sanitize_storage_key(f"comments_{estate_id}.task.{task_id}")
+
+
+def _load_head(estate_id: str) -> Dict:
+    head = json_storage.get(_head_key(estate_id), default=None)
+    if head is None:
+        head = _migrate_legacy_comments(estate_id)
+    elif isinstance(head["tasks"], list):
+        head = _segment_task_indexes(estate_id)
+    return head
+
+
+def _task_index_documents(estate_id: str, task_seqs: Dict[str, List[int]]) -> Tuple[Dict, Dict]:
+    """Return the segmented index documents of the tasks' sequence numbers and the head's tasks."""
+    documents: Dict[str, List[int]] = {}
+    tasks: Dict[str, List[int]] = {}
+    for task_id, seqs in task_seqs.items():
+        for seq in seqs:
+            segment = seq // SEGMENT_SIZE
+            key = _task_key(estate_id, task_id, segment)
+            if key not in documents:
+                documents[key] = []
+                tasks.setdefault(task_id, []).append(segment)
+            documents[key].append(seq)
+    return documents, tasks
+
+
+def _migrate_legacy_comments(estate_id: str) -> Dict:
+    """Convert the old single-list comments document into segments."""
+    comments = json_storage.get(_legacy_key(estate_id), default=[])
+    head = {"count": len(comments), "tasks": {}}
+    if not comments:
+        return head
+
+    task_seqs: Dict[str, List[int]] = {}
+    for seq, comment in enumerate(comments):
+        if comment.get("task_id"):
+            task_seqs.setdefault(comment["task_id"], []).append(seq)
+    documents, head["tasks"] = _task_index_documents(estate_id, task_seqs)
+    for start in range(0, len(comments), SEGMENT_SIZE):
+        documents[_segment_key(estate_id, start // SEGMENT_SIZE)] = comments[start:start + SEGMENT_SIZE]
+    documents[_head_key(estate_id)] = head
+
+    with json_storage.transaction():
+        json_storage.put_many(documents)
+        json_storage.delete(_legacy_key(estate_id))
+    return head
+
+
+def _segment_task_indexes(estate_id: str) -> Dict:
+    """Split the single index document of each task into segments."""
+    with json_storage.transaction():
+        head = json_storage.get_fresh(_head_key(estate_id))
+        if not isinstance(head["tasks"], list):
+            return head
+        legacy_keys = {task_id: _legacy_task_key(estate_id, task_id) for task_id in head["tasks"]}
+        stored = json_storage.get_many(legacy_keys.values(), default=[])
+        task_seqs = {task_id: stored[key] for task_id, key in legacy_keys.items()}
+        documents, head["tasks"] = _task_index_documents(estate_id, task_seqs)
+        documents[_head_key(estate_id)] = head
+        json_storage.put_many(documents)
+        for key in legacy_keys.values():
+            try:
+                json_storage.delete(key)
+            except FileNotFoundError:
+                pass
+    return head
+
+
+def append_comment(estate_id: str, comment: Dict) -> int:
+    """Append a comment to the estate's log and return its sequence number."""
+    with json_storage.transaction():
+        head = _load_head(estate_id)
+        seq = head["count"]
+        segment_key = _segment_key(estate_id, seq // SEGMENT_SIZE)
+        segment = json_storage.get(segment_key, default=[]) if seq % SEGMENT_SIZE else []
+        segment.append(comment)
+        documents = {segment_key: segment}
+
+        task_id = comment.get("task_id")
+        if task_id:
+            task_segments = head["tasks"].setdefault(task_id, [])
+            task_key = _task_key(estate_id, task_id, seq // SEGMENT_SIZE)
+            if task_segments and task_segments[-1] == seq // SEGMENT_SIZE:
+                seqs = json_storage.get(task_key, default=[])
+            else:
+                seqs = []
+                task_segments.append(seq // SEGMENT_SIZE)
+            documents[task_key] = seqs + [seq]
+
+        head["count"] = seq + 1
+        documents[_head_key(estate_id)] = head
+        json_storage.put_many(documents)
+    return seq
+
+
+def _load_by_seq(estate_id: str, seqs: List[int]) -> List[Dict]:
+    keys = sorted({_segment_key(estate_id, seq // SEGMENT_SIZE) for seq in seqs})
+    segments = json_storage.get_many(keys, default=[])
+    return [
+        segments[_segment_key(estate_id, seq // SEGMENT_SIZE)][seq % SEGMENT_SIZE]
+        for seq in seqs
+    ]
+
+
+def _decode_cursor(cursor: str) -> int:
+    """Raises ValueError for cursors not returned by read_comments."""
+    if not cursor.isdigit():
+        raise ValueError("Invalid cursor")
+    return int(cursor)
+
+
+def read_comments(
+    estate_id: str,
+    task_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """Read a page of comments, oldest first within the page.
+
+    Without a cursor the latest `limit` comments are returned. Pass the
+    returned cursor to get the page before it; it is None on the first page.
+    Without a limit all comments before the cursor are returned. Raises
+    ValueError for a bad cursor.
+    """
+    before = None if cursor is None else _decode_cursor(cursor)
+    head = _load_head(estate_id)
+    end = head["count"] if before is None else min(before, head["count"])
+
+    if task_id:
+        if task_id not in head["tasks"]:
+            return [], None
+        # The task's index segments from the newest back, until the page and one more are found
+        seqs = []
+        for segment in reversed(head["tasks"][task_id]):
+            if segment * SEGMENT_SIZE >= end:
+                continue
+            task_seqs = json_storage.get(_task_key(estate_id, task_id, segment), default=[])
+            seqs[:0] = [seq for seq in task_seqs if seq < end]
+            if limit is not None and len(seqs) > limit:
+                break
+    else:
+        seqs = list(range(end))
+
+    page = seqs if limit is None else seqs[max(0, len(seqs) - limit):]
+    has_more = len(page) < len(seqs)
+    next_cursor = str(page[0]) if page and has_more else None
+    return _load_by_seq(estate_id, page), next_cursor
+
+
+def delete_comment_log(estate_id: str) -> None:
+    """Delete all comment documents of an estate."""
+    head = json_storage.get(_head_key(estate_id), default=None)
+    keys = [_legacy_key(estate_id)]
+    if head is not None:
+        segment_count = (head["count"] + SEGMENT_SIZE - 1) // SEGMENT_SIZE
+        keys += [_segment_key(estate_id, segment) for segment in range(segment_count)]
+        if isinstance(head["tasks"], list):
+            keys += [_legacy_task_key(estate_id, task_id) for task_id in head["tasks"]]
+        else:
+            keys += [
+                _task_key(estate_id, task_id, segment)
+                for task_id, segments in head["tasks"].items()
+                for segment in segments
+            ]
+        keys.append(_head_key(estate_id))
+    for key in keys:
+        try:
+            json_storage.delete(key)
+        except FileNotFoundError:
+            pass
+
+
+__all__ = [
+    "SEGMENT_SIZE",
+    "append_comment",
+    "read_comments",
+    "delete_comment_log",
+]
@@ -0,0 +1,114 @@
+"""Concurrency limits, rate limits and retries for calls to external providers.
+
+Each provider (e.g. "openai", "vision") gets a semaphore bounding the calls
+in flight, a token bucket bounding the request rate and retry with jittered
+exponential backoff. Limits are read from the environment:
+
+    {PROVIDER}_MAX_CONCURRENCY   calls in flight at once (default 8)
+    {PROVIDER}_RATE_PER_SECOND   sustained requests per second (default 10)
+    {PROVIDER}_MAX_RETRIES       retries after the first attempt (default 3)
+
+Usage:
+
+    from app.libs.concurrency import get_provider
+
+    openai_provider = get_provider("openai", retry_on=(openai.RateLimitError,))
+    response = await openai_provider.call(client.chat.completions.create, model=..., messages=...)
+"""
+
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple, Type
+
+
+class RateLimiter:
+    """Async token bucket allowing `rate` requests per second with bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Provider:
+    """Runs calls to one provider within its concurrency and rate limits, with retries."""
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        rate_per_second: float,
+        max_retries: int,
+        retry_on: Tuple[Type[BaseException], ...] = (),
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+    ):
+        self.name = name
+        self.max_retries = max_retries
+        self.retry_on = retry_on
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._limiter = RateLimiter(rate_per_second, burst=max(1, max_concurrency))
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                await self._limiter.acquire()
+                try:
+                    return await fn(*args, **kwargs)
+                except self.retry_on as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    # Full jitter, so retries from many calls do not line up
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                    print(f"{self.name} call failed ({e}), retrying in {delay:.2f}s")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def run_in_thread(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking call in a worker thread within this provider's limits."""
+        return await self.call(asyncio.to_thread, fn, *args, **kwargs)
+
+
+_providers: Dict[str, Provider] = {}
+
+
+def get_provider(name: str, retry_on: Tuple[Type[BaseException], ...] = ()) -> Provider:
+    """Get the shared Provider for name, created from the environment on first use."""
+    provider = _providers.get(name)
+    if provider is None:
+        prefix = name.upper()
+        provider = _providers[name] = Provider(
+            name,
+            max_concurrency=int(os.environ.get(f"{prefix}_MAX_CONCURRENCY", "8")),
+            rate_per_second=float(os.environ.get(f"{prefix}_RATE_PER_SECOND", "10")),
+            max_retries=int(os.environ.get(f"{prefix}_MAX_RETRIES", "3")),
+            retry_on=retry_on,
+        )
+    return provider
+
+
+__all__ = [
+    "RateLimiter",
+    "Provider",
+    "get_provider",
+]
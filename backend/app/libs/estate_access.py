@@ -0,0 +1,114 @@
+"""FastAPI dependencies that resolve an estate and the user's role on it.
+
+The estate and its roles are loaded at most once per request and kept in
+`request.state`, so handlers use the loaded documents instead of reading
+them again. The roles document is only loaded when the user is not the owner.
+
+Usage:
+
+    from app.libs.estate_access import EstateEditor
+
+    @router.put("/estate/{estate_id}")
+    def update_estate(estate_id: str, access: EstateEditor):
+        estate = access.estate
+"""
+
+from typing import Annotated, Dict, List, Optional
+from fastapi import Depends, HTTPException, Request
+from app.auth import AuthorizedUser
+from app.libs.storage import json_storage, sanitize_storage_key
+
+# Role hierarchy, a role grants everything the lower ranks can do
+ROLE_RANKS = {"viewer": 1, "editor": 2, "admin": 3, "owner": 4}
+
+
+class EstateAccess:
+    """An estate together with the effective role of the requesting user."""
+
+    def __init__(self, estate_id: str, estate: dict, user_id: str):
+        self.estate_id = estate_id
+        self.estate = estate
+        self.user_id = user_id
+        self._roles: Optional[List[dict]] = None
+        self._roles_by_user: Optional[Dict[str, dict]] = None
+
+    @property
+    def roles(self) -> List[dict]:
+        """The estate's roles document, loaded on first use."""
+        if self._roles is None:
+            self._roles = json_storage.get(sanitize_storage_key(f"roles_{self.estate_id}"), default=[])
+        return self._roles
+
+    @property
+    def roles_by_user(self) -> Dict[str, dict]:
+        """Accepted roles keyed by user id."""
+        if self._roles_by_user is None:
+            self._roles_by_user = {
+                r["user_id"]: r for r in self.roles if r["user_id"] and r["status"] == "accepted"
+            }
+        return self._roles_by_user
+
+    @property
+    def is_owner(self) -> bool:
+        return self.estate["userId"] == self.user_id
+
+    @property
+    def role(self) -> Optional[str]:
+        """owner, admin, editor or viewer, or None without access."""
+        if self.is_owner:
+            return "owner"
+        user_role = self.roles_by_user.get(self.user_id)
+        return user_role["role"] if user_role else None
+
+    def has_role(self, minimum: str) -> bool:
+        return ROLE_RANKS.get(self.role, 0) >= ROLE_RANKS[minimum]
+
+
+def resolve_estate_access(estate_id: str, user_id: str, request: Optional[Request] = None) -> EstateAccess:
+    """Load the estate for a user, memoised on the request when one is given.
+
+    Raises 404 if the estate does not exist.
+    """
+    memo = None
+    if request is not None:
+        memo = getattr(request.state, "estate_access", None)
+        if memo is None:
+            memo = request.state.estate_access = {}
+        if (estate_id, user_id) in memo:
+            return memo[(estate_id, user_id)]
+
+    estate = json_storage.get(sanitize_storage_key(f"estates_{estate_id}"), default=None)
+    if not estate:
+        raise HTTPException(status_code=404, detail="Estate not found")
+
+    access = EstateAccess(estate_id, estate, user_id)
+    if memo is not None:
+        memo[(estate_id, user_id)] = access
+    return access
+
+
+def require_estate_role(minimum: str, detail: str):
+    """Create a dependency that requires at least `minimum` role on the path's estate."""
+
+    def dependency(estate_id: str, request: Request, user: AuthorizedUser) -> EstateAccess:
+        access = resolve_estate_access(estate_id, user.sub, request)
+        if not access.has_role(minimum):
+            raise HTTPException(status_code=403, detail=detail)
+        return access
+
+    return dependency
+
+
+EstateViewer = Annotated[EstateAccess, Depends(require_estate_role("viewer", "Unauthorized access to estate"))]
+EstateEditor = Annotated[EstateAccess, Depends(require_estate_role("editor", "Unauthorized to update estate"))]
+EstateAdmin = Annotated[EstateAccess, Depends(require_estate_role("admin", "Unauthorized to manage estate"))]
+
+__all__ = [
+    "ROLE_RANKS",
+    "EstateAccess",
+    "resolve_estate_access",
+    "require_estate_role",
+    "EstateViewer",
+    "EstateEditor",
+    "EstateAdmin",
+]
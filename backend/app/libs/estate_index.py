@@ -0,0 +1,163 @@
+"""Per-user index of the estates a user owns or collaborates on.
+
+Each user has one `estate_index_{user_id}` document:
+
+    {"owned": ["estate_..."], "collaborating": ["estate_..."]}
+
+The estate and collaboration APIs keep it up to date, so listing a user's
+estates only reads that user's estates instead of scanning all of storage.
+
+Rebuild or repair the index for all users from the existing estates and roles:
+
+    python -m app.libs.estate_index
+
+The rebuild writes the `estate_index.migrated` marker. Until it exists, a user
+without an index gets one built from a scan of all estates; after that a
+missing index means the user has no estates yet.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+from app.libs.storage import json_storage, sanitize_storage_key
+
+OWNED = "owned"
+COLLABORATING = "collaborating"
+
+MIGRATION_KEY = "estate_index.migrated"
+_migrated = False
+
+
+def _index_key(user_id: str) -> str:
+    return sanitize_storage_key(f"estate_index_{user_id}")
+
+
+def _empty_index() -> Dict[str, List[str]]:
+    return {OWNED: [], COLLABORATING: []}
+
+
+def get_user_estate_index(user_id: str, fresh: bool = False) -> Optional[Dict[str, List[str]]]:
+    """Return the index for a user, or None if it has never been built.
+
+    Pass fresh=True inside a transaction that writes the index back.
+    """
+    get = json_storage.get_fresh if fresh else json_storage.get
+    index = get(_index_key(user_id), default=None)
+    if index is None:
+        return None
+    return {OWNED: index.get(OWNED, []), COLLABORATING: index.get(COLLABORATING, [])}
+
+
+def _index_migrated() -> bool:
+    """Whether every user's index was built by rebuild_estate_index."""
+    global _migrated
+    if not _migrated:
+        _migrated = json_storage.get(MIGRATION_KEY, default=None) is not None
+    return _migrated
+
+
+def _load_or_build_index(user_id: str, fresh: bool = False) -> Dict[str, List[str]]:
+    index = get_user_estate_index(user_id, fresh=fresh)
+    if index is not None:
+        return index
+    if _index_migrated():
+        return _empty_index()
+    # Data from before the index existed, built from a scan until the migration has run
+    return rebuild_user_estate_index(user_id)
+
+
+def get_user_estate_ids(user_id: str) -> List[str]:
+    """Return ids of all estates the user owns or has accepted a role on."""
+    index = _load_or_build_index(user_id)
+    return index[OWNED] + [i for i in index[COLLABORATING] if i not in index[OWNED]]
+
+
+def add_estate_to_index(user_id: str, estate_id: str, relation: str) -> None:
+    """Record that a user owns (OWNED) or collaborates on (COLLABORATING) an estate."""
+    if not user_id:
+        return
+    # Read fresh and written in one transaction, so concurrent updates are not lost
+    with json_storage.transaction():
+        index = _load_or_build_index(user_id, fresh=True)
+        if estate_id in index[relation]:
+            return
+        index[relation].append(estate_id)
+        json_storage.put(_index_key(user_id), index)
+
+
+def remove_estate_from_index(user_id: str, estate_id: str) -> None:
+    """Remove an estate from a user's index, whatever the relation."""
+    if not user_id:
+        return
+    with json_storage.transaction():
+        index = get_user_estate_index(user_id, fresh=True)
+        if index is None:
+            return
+        if estate_id not in index[OWNED] and estate_id not in index[COLLABORATING]:
+            return
+        index[OWNED] = [i for i in index[OWNED] if i != estate_id]
+        index[COLLABORATING] = [i for i in index[COLLABORATING] if i != estate_id]
+        json_storage.put(_index_key(user_id), index)
+
+
+def _scan_estate_relations() -> Dict[str, Dict[str, List[str]]]:
+    """Build user_id -> index for all users by scanning every estate and its roles."""
+    indexes: Dict[str, Dict[str, List[str]]] = {}
+    estates = json_storage.get_many(file.name for file in json_storage.list_prefix("estates_"))
+    roles_by_key = json_storage.get_many(file.name for file in json_storage.list_prefix("roles_"))
+    for estate in estates.values():
+        if not estate:
+            continue
+        estate_id = estate["id"]
+        indexes.setdefault(estate["userId"], _empty_index())[OWNED].append(estate_id)
+
+        roles = roles_by_key.get(sanitize_storage_key(f"roles_{estate_id}")) or []
+        for role in roles:
+            if role["status"] != "accepted" or not role["user_id"]:
+                continue
+            index = indexes.setdefault(role["user_id"], _empty_index())
+            if estate_id not in index[OWNED] and estate_id not in index[COLLABORATING]:
+                index[COLLABORATING].append(estate_id)
+    return indexes
+
+
+def rebuild_user_estate_index(user_id: str) -> Dict[str, List[str]]:
+    """Rebuild and store the index for a single user."""
+    index = _scan_estate_relations().get(user_id, _empty_index())
+    json_storage.put(_index_key(user_id), index)
+    return index
+
+
+def rebuild_estate_index() -> int:
+    """Rebuild the index for every user and reset stale indexes.
+
+    Returns the number of index documents written.
+    """
+    indexes = _scan_estate_relations()
+
+    # Users that no longer own or collaborate on anything keep an empty index
+    for file in json_storage.list_prefix("estate_index_"):
+        user_id = file.name.removeprefix("estate_index_")
+        indexes.setdefault(user_id, _empty_index())
+
+    with json_storage.transaction():
+        json_storage.put_many({_index_key(user_id): index for user_id, index in indexes.items()})
+        json_storage.put(MIGRATION_KEY, {"migrated_at": datetime.now().isoformat()})
+
+    return len(indexes)
+
+
+__all__ = [
+    "OWNED",
+    "COLLABORATING",
+    "get_user_estate_index",
+    "get_user_estate_ids",
+    "add_estate_to_index",
+    "remove_estate_from_index",
+    "rebuild_user_estate_index",
+    "rebuild_estate_index",
+]
+
+
+if __name__ == "__main__":
+    count = rebuild_estate_index()
+    print(f"Rebuilt estate index for {count} users")
@@ -0,0 +1,101 @@
+"""Index of the estates with pending invitations for an email address.
+
+Each invited email has one `invitations_{hash}` document listing estate ids,
+where hash is the SHA-256 of the lowercased email (emails contain characters
+that are not allowed in storage keys). The roles documents stay the source of
+truth; the index only says which roles documents to look in.
+
+Rebuild the index for all emails from the existing roles:
+
+    python -m app.libs.invitation_index
+"""
+
+import hashlib
+from typing import Dict, List
+from app.libs.storage import json_storage, sanitize_storage_key
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def _index_key(email: str) -> str:
+    digest = hashlib.sha256(normalize_email(email).encode("utf-8")).hexdigest()
+    return sanitize_storage_key(f"invitations_{digest}")
+
+
+def get_invited_estate_ids(email: str) -> List[str]:
+    """Return ids of estates that may have a pending invitation for email."""
+    return json_storage.get(_index_key(email), default=[])
+
+
+def add_invitation_to_index(email: str, estate_id: str) -> None:
+    # Read fresh and written in one transaction, so concurrent updates are not lost
+    with json_storage.transaction():
+        estate_ids = json_storage.get_fresh(_index_key(email), default=[])
+        if estate_id in estate_ids:
+            return
+        json_storage.put(_index_key(email), estate_ids + [estate_id])
+
+
+def remove_invitation_from_index(email: str, estate_id: str) -> None:
+    with json_storage.transaction():
+        estate_ids = json_storage.get_fresh(_index_key(email), default=[])
+        if estate_id not in estate_ids:
+            return
+        json_storage.put(_index_key(email), [i for i in estate_ids if i != estate_id])
+
+
+def get_pending_invitations(email: str) -> List[dict]:
+    """Return all pending roles for email, loading only the indexed roles documents."""
+    estate_ids = get_invited_estate_ids(email)
+    if not estate_ids:
+        return []
+    email = normalize_email(email)
+    roles_by_key = json_storage.get_many(
+        [sanitize_storage_key(f"roles_{estate_id}") for estate_id in estate_ids], default=[]
+    )
+    return [
+        role
+        for roles in roles_by_key.values()
+        for role in roles
+        if role["status"] == "pending" and normalize_email(role["email"]) == email
+    ]
+
+
+def rebuild_invitation_index() -> int:
+    """Rebuild the index from all roles documents and reset stale entries.
+
+    Returns the number of index documents written.
+    """
+    indexes: Dict[str, List[str]] = {}
+    for file in json_storage.list_prefix("invitations_"):
+        indexes[file.name] = []
+
+    roles_by_key = json_storage.get_many(file.name for file in json_storage.list_prefix("roles_"))
+    for roles in roles_by_key.values():
+        for role in roles or []:
+            if role["status"] != "pending":
+                continue
+            estate_ids = indexes.setdefault(_index_key(role["email"]), [])
+            if role["estate_id"] not in estate_ids:
+                estate_ids.append(role["estate_id"])
+
+    with json_storage.transaction():
+        json_storage.put_many(indexes)
+    return len(indexes)
+
+
+__all__ = [
+    "normalize_email",
+    "get_invited_estate_ids",
+    "add_invitation_to_index",
+    "remove_invitation_from_index",
+    "get_pending_invitations",
+    "rebuild_invitation_index",
+]
+
+
+if __name__ == "__main__":
+    count = rebuild_invitation_index()
+    print(f"Rebuilt invitation index for {count} emails")
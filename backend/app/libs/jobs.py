@@ -0,0 +1,383 @@
+"""Background jobs processed by in-process asyncio workers.
+
+Handlers enqueue a job and return its id at once; a pool of workers runs the
+job's handler outside the request. Job status and progress are stored in
+`jobs_{job_id}`, so they can be polled from any process, and watchers in the
+same process are woken on every update for streaming.
+
+    JOB_QUEUE_BACKEND   queue the workers take job ids from, "memory" (default)
+    JOB_WORKERS         jobs processed at once per process (default 4)
+
+The memory queue lives in the process, so queued jobs are lost on restart
+and each process runs the jobs enqueued in it. Other backends implement
+`JobQueue` and are selected in `get_job_queue`.
+
+The workers are started on the first enqueue, in the running event loop.
+While they run, the process writes a heartbeat to `job_processes_{id}`, and
+every job records the process it was enqueued in. A queued or running job
+whose process has stopped its heartbeat, such as after a restart, is marked
+failed when it is next read, so clients polling it get an answer.
+
+    JOB_HEARTBEAT_SECONDS   interval of the heartbeat (default 30); a process
+                            is gone after three missed heartbeats
+    JOB_PROGRESS_SECONDS    least time between progress writes to storage (default 1)
+
+Storage is written from worker threads, so the event loop is not blocked by
+its round-trips. Jobs running in this process are read from memory, and their
+watchers are woken on every progress update. The progress is written to
+storage at most every JOB_PROGRESS_SECONDS for polling from other processes.
+
+Usage:
+
+    from app.libs.jobs import enqueue_job, get_job, register_job_handler
+
+    async def process(job: JobContext):
+        job.progress("reading", done=0, total=10)
+        return {"count": 10}
+
+    register_job_handler("statement", process)
+    job = await enqueue_job("statement", payload, user_id=user.sub)
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+from app.libs.storage import json_storage, sanitize_storage_key
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class JobQueue(ABC):
+    """Queue of job ids waiting for a worker."""
+
+    @abstractmethod
+    async def put(self, job_id: str) -> None: ...
+
+    @abstractmethod
+    async def get(self) -> str: ...
+
+
+class MemoryJobQueue(JobQueue):
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        # Created on first use, so it belongs to the running event loop
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def put(self, job_id: str) -> None:
+        await self.queue.put(job_id)
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+
+def get_job_queue() -> JobQueue:
+    backend = os.environ.get("JOB_QUEUE_BACKEND", "memory")
+    if backend == "memory":
+        return MemoryJobQueue()
+    raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {backend}")
+
+
+HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", "30"))
+PROGRESS_SECONDS = float(os.environ.get("JOB_PROGRESS_SECONDS", "1"))
+
+
+def _job_key(job_id: str) -> str:
+    return sanitize_storage_key(f"jobs_{job_id}")
+
+
+def _process_key(process_id: str) -> str:
+    return sanitize_storage_key(f"job_processes_{process_id}")
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+# Identifies this process in the jobs it enqueues
+PROCESS_ID = new_job_id()
+
+
+def _process_alive(process_id: Optional[str]) -> bool:
+    if process_id == PROCESS_ID:
+        return True
+    if not process_id:
+        return False
+    heartbeat = json_storage.get(_process_key(process_id), default=None)
+    return heartbeat is not None and time.time() - heartbeat["alive_at"] < 3 * HEARTBEAT_SECONDS
+
+
+# Queued and running jobs of this process, by id
+_local_jobs: Dict[str, dict] = {}
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """Return the job, failing it first if the process that was to run it is gone.
+
+    Jobs of this process are returned from memory; others are read from
+    storage, which blocks, so coroutines use `read_job`.
+    """
+    if job_id in _local_jobs:
+        return dict(_local_jobs[job_id])
+    job = json_storage.get(_job_key(job_id), default=None)
+    if job is not None and job["status"] not in FINISHED and not _process_alive(job.get("process")):
+        print(f"Job {job_id} ({job['kind']}) was lost with process {job.get('process')}")
+        job["status"] = FAILED
+        job["error"] = "The job was interrupted by a restart, upload the file again"
+        job.pop("payload", None)
+        _store_job(job)
+    return job
+
+
+async def read_job(job_id: str) -> Optional[dict]:
+    """Return the job like get_job, reading storage in a worker thread."""
+    if job_id in _local_jobs:
+        return get_job(job_id)
+    return await asyncio.to_thread(get_job, job_id)
+
+
+# Events of the watchers of each job in this process
+_watchers: Dict[str, Set[asyncio.Event]] = {}
+
+
+def _wake_watchers(job_id: str) -> None:
+    for event in _watchers.get(job_id, ()):
+        event.set()
+
+
+def _store_job(job: dict) -> None:
+    job["updated_at"] = datetime.now().isoformat()
+    json_storage.put(_job_key(job["id"]), job)
+
+
+async def _save_job(job: dict) -> None:
+    """Store the job, then wake its watchers, so a change they see is stored."""
+    job["updated_at"] = datetime.now().isoformat()
+    # A copy, as the job may change while the thread serialises it
+    await asyncio.to_thread(json_storage.put, _job_key(job["id"]), dict(job))
+    _wake_watchers(job["id"])
+
+
+class JobContext:
+    """A running job, given to its handler to read the payload and report progress."""
+
+    def __init__(self, job: dict):
+        self.job = job
+        self._writer: Optional[asyncio.Task] = None
+
+    @property
+    def id(self) -> str:
+        return self.job["id"]
+
+    @property
+    def payload(self) -> dict:
+        return self.job["payload"]
+
+    @property
+    def info(self) -> dict:
+        return self.job["info"]
+
+    def progress(self, stage: str, done: int = 0, total: Optional[int] = None) -> None:
+        """Record the progress and wake the watchers. Storage is written later in the background."""
+        self.job.update(stage=stage, done=done, total=total, updated_at=datetime.now().isoformat())
+        _wake_watchers(self.id)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_progress())
+
+    async def _write_progress(self) -> None:
+        await asyncio.sleep(PROGRESS_SECONDS)
+        write = asyncio.ensure_future(asyncio.to_thread(json_storage.put, _job_key(self.id), dict(self.job)))
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            # Let a write in progress finish, so it cannot land after a later save
+            await write
+            raise
+        except Exception as e:
+            print(f"Error writing progress of job {self.id}: {e}")
+
+    async def flush(self) -> None:
+        """Drop a pending progress write, waiting for one in progress."""
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+
+
+JobHandler = Callable[[JobContext], Awaitable[Any]]
+_handlers: Dict[str, JobHandler] = {}
+
+
+def register_job_handler(kind: str, handler: JobHandler) -> None:
+    _handlers[kind] = handler
+
+
+async def _run_job(job_id: str) -> None:
+    job = _local_jobs.get(job_id)
+    if job is None or job["status"] != QUEUED:
+        return
+    context = JobContext(job)
+    job["status"] = RUNNING
+    try:
+        await _save_job(job)
+        outcome = {"result": await _handlers[job["kind"]](context), "status": SUCCEEDED, "stage": "done"}
+    except Exception as e:
+        print(f"Job {job_id} ({job['kind']}) failed: {e}")
+        outcome = {"status": FAILED, "error": getattr(e, "detail", None) or str(e)}
+    # The job only shows as finished once no progress write can follow
+    await context.flush()
+    job.update(outcome)
+    job.pop("payload", None)
+    try:
+        await _save_job(job)
+    finally:
+        del _local_jobs[job_id]
+
+
+class JobWorkers:
+    """A pool of asyncio tasks taking jobs from a queue."""
+
+    def __init__(self, queue: JobQueue, concurrency: int):
+        self.queue = queue
+        self.concurrency = concurrency
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        print(f"Started {self.concurrency} job workers")
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(_beat)
+            except Exception as e:
+                print(f"Error writing job heartbeat: {e}")
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+
+    async def _work(self) -> None:
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await _run_job(job_id)
+            except Exception as e:
+                print(f"Error running job {job_id}: {e}")
+
+
+def _beat() -> None:
+    json_storage.put(_process_key(PROCESS_ID), {"alive_at": time.time()})
+
+
+workers = JobWorkers(get_job_queue(), concurrency=int(os.environ.get("JOB_WORKERS", "4")))
+
+
+async def enqueue_job(
+    kind: str,
+    payload: dict,
+    user_id: str,
+    job_id: Optional[str] = None,
+    info: Optional[dict] = None,
+) -> dict:
+    """Store a queued job and hand it to the workers. Returns the job without its payload.
+
+    The payload is removed once the job is finished, while `info` is kept
+    with the job's status for clients.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"No handler registered for job kind {kind}")
+    now = datetime.now().isoformat()
+    job = {
+        "id": job_id or new_job_id(),
+        "kind": kind,
+        "user_id": user_id,
+        "info": info or {},
+        "status": QUEUED,
+        "stage": QUEUED,
+        "done": 0,
+        "total": None,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "process": PROCESS_ID,
+        "payload": payload,
+    }
+    await _save_job(job)
+    _local_jobs[job["id"]] = job
+    workers.start()
+    await workers.queue.put(job["id"])
+    return {k: v for k, v in job.items() if k != "payload"}
+
+
+async def watch_job(job_id: str, heartbeat: float = 15.0) -> AsyncIterator[Optional[dict]]:
+    """Yield the job each time it changes until it is finished.
+
+    Yields None after `heartbeat` seconds without changes, so streams can
+    send keep-alives. Updates from other processes are picked up then too.
+    """
+    event = asyncio.Event()
+    _watchers.setdefault(job_id, set()).add(event)
+    try:
+        last = None
+        while True:
+            event.clear()
+            job = await read_job(job_id)
+            if job is None:
+                return
+            job.pop("payload", None)
+            if job != last:
+                yield job
+                last = job
+            if job["status"] in FINISHED:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+    finally:
+        _watchers[job_id].discard(event)
+        if not _watchers[job_id]:
+            del _watchers[job_id]
+
+
+async def stop_job_workers() -> None:
+    await workers.stop()
+
+
+__all__ = [
+    "QUEUED",
+    "RUNNING",
+    "SUCCEEDED",
+    "FAILED",
+    "FINISHED",
+    "JobQueue",
+    "MemoryJobQueue",
+    "get_job_queue",
+    "JobContext",
+    "register_job_handler",
+    "new_job_id",
+    "get_job",
+    "read_job",
+    "enqueue_job",
+    "watch_job",
+    "stop_job_workers",
+]
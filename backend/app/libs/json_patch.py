@@ -0,0 +1,178 @@
+"""Apply RFC 6902 JSON Patch operations and id-keyed item operations to documents.
+
+Usage:
+
+    from app.libs.json_patch import JsonPatchError, apply_json_patch, apply_item_operation
+
+    apply_json_patch(doc, [{"op": "replace", "path": "/assets/0/estimatedValue", "value": 1000}])
+    apply_item_operation(doc, "assets", "update", item_id="asset_1", value={"estimatedValue": 1000})
+
+Both functions modify `doc` in place. Apply them to a copy if the whole batch
+must succeed or fail together.
+"""
+
+import copy
+from typing import Any, List, Optional, Tuple
+
+
+class JsonPatchError(ValueError):
+    """Raised when an operation is invalid or cannot be applied."""
+
+
+class JsonPatchTestFailed(JsonPatchError):
+    """Raised when a `test` operation does not match the document."""
+
+
+def parse_pointer(pointer: str) -> List[str]:
+    """Split a JSON pointer ("/assets/0/id") into unescaped reference tokens."""
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise JsonPatchError(f"Invalid JSON pointer: {pointer}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _list_index(container: list, token: str, allow_end: bool) -> int:
+    if token == "-" and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise JsonPatchError(f"Invalid array index: {token}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise JsonPatchError(f"Array index out of range: {token}")
+    return index
+
+
+def _resolve_parent(doc: Any, tokens: List[str]) -> Tuple[Any, str]:
+    if not tokens:
+        raise JsonPatchError("Operations on the document root are not supported")
+    target = doc
+    for token in tokens[:-1]:
+        if isinstance(target, dict):
+            if token not in target:
+                raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+            target = target[token]
+        elif isinstance(target, list):
+            target = target[_list_index(target, token, allow_end=False)]
+        else:
+            raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+    return target, tokens[-1]
+
+
+def _get(doc: Any, tokens: List[str]) -> Any:
+    parent, last = _resolve_parent(doc, tokens)
+    if isinstance(parent, dict):
+        if last not in parent:
+            raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+        return parent[last]
+    if isinstance(parent, list):
+        return parent[_list_index(parent, last, allow_end=False)]
+    raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+
+
+def _add(doc: Any, tokens: List[str], value: Any) -> None:
+    parent, last = _resolve_parent(doc, tokens)
+    if isinstance(parent, dict):
+        parent[last] = value
+    elif isinstance(parent, list):
+        parent.insert(_list_index(parent, last, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+
+
+def _remove(doc: Any, tokens: List[str]) -> Any:
+    parent, last = _resolve_parent(doc, tokens)
+    if isinstance(parent, dict):
+        if last not in parent:
+            raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+        return parent.pop(last)
+    if isinstance(parent, list):
+        return parent.pop(_list_index(parent, last, allow_end=False))
+    raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+
+
+def apply_json_patch(doc: Any, operations: List[dict]) -> Any:
+    """Apply a list of RFC 6902 operations to doc in place and return it."""
+    for operation in operations:
+        op = operation.get("op")
+        tokens = parse_pointer(operation.get("path", ""))
+
+        if op == "add":
+            _add(doc, tokens, copy.deepcopy(operation.get("value")))
+        elif op == "remove":
+            _remove(doc, tokens)
+        elif op == "replace":
+            _remove(doc, tokens)
+            _add(doc, tokens, copy.deepcopy(operation.get("value")))
+        elif op == "move":
+            from_tokens = parse_pointer(operation.get("from", ""))
+            if tokens[:len(from_tokens)] == from_tokens and tokens != from_tokens:
+                raise JsonPatchError("Cannot move a value into one of its children")
+            _add(doc, tokens, _remove(doc, from_tokens))
+        elif op == "copy":
+            from_tokens = parse_pointer(operation.get("from", ""))
+            _add(doc, tokens, copy.deepcopy(_get(doc, from_tokens)))
+        elif op == "test":
+            if _get(doc, tokens) != operation.get("value"):
+                raise JsonPatchTestFailed(f"Test failed at {operation.get('path')}")
+        else:
+            raise JsonPatchError(f"Unsupported operation: {op}")
+    return doc
+
+
+def apply_item_operation(
+    doc: dict,
+    collection: str,
+    action: str,
+    item_id: Optional[str] = None,
+    index: Optional[int] = None,
+    value: Optional[dict] = None,
+) -> Optional[dict]:
+    """Add, update or remove a single item in a list field of doc.
+
+    Items are found by their "id" field, or by position with `index` for
+    lists whose items have no id. "update" merges `value` into the existing
+    item. Returns the added or updated item, or None for "remove".
+    """
+    items = doc.setdefault(collection, [])
+
+    if action == "add":
+        if value is None:
+            raise JsonPatchError("Missing value for add")
+        if index is None:
+            items.append(copy.deepcopy(value))
+            return items[-1]
+        if not 0 <= index <= len(items):
+            raise JsonPatchError(f"Index out of range: {index}")
+        items.insert(index, copy.deepcopy(value))
+        return items[index]
+
+    if item_id is not None:
+        position = next((i for i, item in enumerate(items) if item.get("id") == item_id), None)
+        if position is None:
+            raise JsonPatchError(f"No item with id {item_id} in {collection}")
+    elif index is not None:
+        if not 0 <= index < len(items):
+            raise JsonPatchError(f"Index out of range: {index}")
+        position = index
+    else:
+        raise JsonPatchError("Either id or index is required")
+
+    if action == "update":
+        if value is None:
+            raise JsonPatchError("Missing value for update")
+        items[position] = {**items[position], **copy.deepcopy(value)}
+        return items[position]
+    if action == "remove":
+        items.pop(position)
+        return None
+    raise JsonPatchError(f"Unsupported action: {action}")
+
+
+__all__ = [
+    "JsonPatchError",
+    "JsonPatchTestFailed",
+    "parse_pointer",
+    "apply_json_patch",
+    "apply_item_operation",
+]
@@ -0,0 +1,177 @@
+"""Persistent cache of merchant classifications keyed by normalised recipient.
+
+Recipients on bank statements vary per store and city ("KIWI 123 MAJORSTUEN
+OSLO", "Kiwi Grünerløkka"), so they are normalised to a merchant key before
+lookup: the merchant dictionary's keyword when it knows the recipient, else
+the brand words before the store number. Each merchant is stored once in `merchants_{hash}` with its category, subscription
+flag, frequency and contact info, a confidence and an expiry time. An
+in-process LRU keeps hot merchants in memory.
+
+    MERCHANT_CACHE_TTL_DAYS          days before a stored classification expires (default 90)
+    MERCHANT_CACHE_MIN_CONFIDENCE    lowest confidence used for classification (default 0.5)
+    MERCHANT_CACHE_MAX_ENTRIES       merchants kept in memory (default 5000)
+
+Usage:
+
+    from app.libs.merchant_cache import lookup_merchants, remember_merchants
+
+    cached = lookup_merchants(transactions)  # {index: classification}
+    remember_merchants(classified_transactions, confidence=0.8)
+"""
+
+import copy
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional
+from app.libs.cache import LRUCache
+from app.libs.merchant_dictionary import match_merchant
+from app.libs.storage import json_storage, sanitize_storage_key
+
+TTL_SECONDS = float(os.environ.get("MERCHANT_CACHE_TTL_DAYS", "90")) * 24 * 3600
+MIN_CONFIDENCE = float(os.environ.get("MERCHANT_CACHE_MIN_CONFIDENCE", "0.5"))
+
+# Fields copied between transactions and cached classifications
+CLASSIFICATION_FIELDS = ("category", "is_subscription", "subscription_frequency", "contact_info")
+
+# Payment terminal and card prefixes that are not part of the merchant name
+_PREFIXES = re.compile(r"^(?:varekjøp|kjøp|visa vare|visa|vipps|sumup|izettle|zettle|nets|bankaxept|avtalegiro|efaktura|giro)\b[\s*:]*")
+_CITIES = {
+    "oslo", "bergen", "trondheim", "stavanger", "kristiansand", "tromsø", "tromso",
+    "drammen", "fredrikstad", "sandnes", "sarpsborg", "skien", "ålesund", "alesund",
+    "sandefjord", "haugesund", "tønsberg", "tonsberg", "moss", "porsgrunn", "bodø",
+    "bodo", "arendal", "hamar", "larvik", "halden", "lillehammer", "molde", "harstad",
+    "gjøvik", "kongsberg", "horten", "mo", "narvik", "steinkjer", "asker", "bærum",
+    "baerum", "lillestrøm", "lillestrom", "ski", "jessheim", "gardermoen", "norge", "no",
+}
+_LEGAL_SUFFIXES = {"as", "asa", "ab", "ltd", "inc", "gmbh", "aps", "oy", "sa", "bv", "llc", "da", "ans"}
+
+_memory = LRUCache(
+    max_entries=int(os.environ.get("MERCHANT_CACHE_MAX_ENTRIES", "5000")),
+    max_bytes=64 * 1024 * 1024,
+    ttl_seconds=TTL_SECONDS,
+)
+hits = 0
+misses = 0
+
+
+def normalize_recipient(recipient: str) -> str:
+    """Normalise a statement recipient to a merchant key, the same for all its stores.
+
+    A recipient the merchant dictionary knows gets the matched keyword:
+    "KIWI 505 MAJORSTUEN" -> "kiwi". Otherwise payment prefixes and
+    punctuation are dropped and the words before the first store number are
+    kept: "BUNNPRIS 7012 LADE TRONDHEIM" -> "bunnpris". Without a store
+    number, numbers, legal suffixes and trailing city names are dropped:
+    "Fjellheim Treningssenter AS Ski" -> "fjellheim treningssenter".
+    """
+    merchant = match_merchant(recipient)
+    if merchant is not None and merchant.keyword:
+        return merchant.keyword
+
+    name = recipient.lower().strip()
+    name = _PREFIXES.sub("", name)
+    name = re.sub(r"[^\w\s&]", " ", name)
+    words = name.split()
+    number = next((i for i, w in enumerate(words) if any(c.isdigit() for c in w)), None)
+    if number:
+        # The brand is before the store number, the location after it
+        words = words[:number]
+    words = [w for w in words if not any(c.isdigit() for c in w)]
+    while len(words) > 1 and (words[-1] in _CITIES or words[-1] in _LEGAL_SUFFIXES):
+        words.pop()
+    return " ".join(words)
+
+
+def _storage_key(merchant: str) -> str:
+    digest = hashlib.sha256(merchant.encode("utf-8")).hexdigest()[:32]
+    return sanitize_storage_key(f"merchants_{digest}")
+
+
+def _usable(entry: Optional[dict], now: float) -> bool:
+    return entry is not None and entry["expires_at"] > now and entry["confidence"] >= MIN_CONFIDENCE
+
+
+def lookup_merchants(transactions: List[dict]) -> Dict[int, dict]:
+    """Find cached classifications for transactions, returned by index in the list."""
+    global hits, misses
+    now = time.time()
+    keys = {i: normalize_recipient(t["recipient"]) for i, t in enumerate(transactions)}
+
+    entries: Dict[str, Optional[dict]] = {}
+    to_load = []
+    for merchant in set(keys.values()):
+        if not merchant:
+            continue
+        hit, entry = _memory.get(merchant)
+        if hit:
+            entries[merchant] = entry
+        else:
+            to_load.append(merchant)
+
+    if to_load:
+        stored = json_storage.get_many([_storage_key(m) for m in to_load], default=None)
+        for merchant in to_load:
+            entry = stored[_storage_key(merchant)]
+            if entry is not None and entry.get("merchant") != merchant:
+                # Hash collision, treat as unknown
+                entry = None
+            entries[merchant] = entry
+            if _usable(entry, now):
+                _memory.set(merchant, entry, size=len(json.dumps(entry)))
+
+    found = {}
+    for i, merchant in keys.items():
+        entry = entries.get(merchant)
+        if _usable(entry, now):
+            hits += 1
+            found[i] = copy.deepcopy({field: entry[field] for field in CLASSIFICATION_FIELDS})
+        else:
+            misses += 1
+    return found
+
+
+def remember_merchants(transactions: List[dict], confidence: float) -> None:
+    """Store the classifications of transactions for their merchants."""
+    now = time.time()
+    entries = {}
+    for transaction in transactions:
+        merchant = normalize_recipient(transaction["recipient"])
+        if not merchant:
+            continue
+        entries[merchant] = {
+            "merchant": merchant,
+            **{field: transaction.get(field) for field in CLASSIFICATION_FIELDS},
+            "confidence": confidence,
+            "updated_at": now,
+            "expires_at": now + TTL_SECONDS,
+        }
+    if not entries:
+        return
+
+    json_storage.put_many({_storage_key(merchant): entry for merchant, entry in entries.items()})
+    for merchant, entry in entries.items():
+        _memory.invalidate(merchant)
+        if _usable(entry, now):
+            _memory.set(merchant, entry, size=len(json.dumps(entry)))
+
+
+def stats() -> Dict[str, float]:
+    """Hit-rate metrics, for transactions looked up since process start."""
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+        **{f"memory_{k}": v for k, v in _memory.stats().items()},
+    }
+
+
+__all__ = [
+    "normalize_recipient",
+    "lookup_merchants",
+    "remember_merchants",
+    "stats",
+]
@@ -0,0 +1,141 @@
+"""Keyword dictionary of known merchants, matched against recipients in one pass.
+
+The dictionary is a JSON data file listing merchants in priority order, each
+with its keywords, category, subscription flag and subscription frequency:
+
+    {"merchants": [
+        {"keywords": ["netflix"], "category": "streaming", "subscription": true},
+        {"keywords": ["kiwi"], "category": "groceries"}
+    ]}
+
+`frequency` defaults to "monthly" for subscriptions. All keywords are compiled
+into one regex shaped like a trie of the keywords, so a recipient is scanned
+once however large the dictionary is. Keywords match at the start of a word
+and may be followed by digits ("KIWI551"), but not by letters, so "spar" does
+not match "Sparebank" and "ice" does not match "service". When several
+merchants match, the one listed first wins.
+
+    MERCHANT_DICTIONARY_FILE   path of the data file (default merchants.json next to this module)
+
+Usage:
+
+    from app.libs.merchant_dictionary import match_merchant
+
+    merchant = match_merchant("VISA VARE 4925 NETFLIX.COM")
+    if merchant:
+        transaction["category"] = merchant.category
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_FREQUENCY = "monthly"
+DICTIONARY_FILE = os.environ.get(
+    "MERCHANT_DICTIONARY_FILE",
+    os.path.join(os.path.dirname(__file__), "merchants.json"),
+)
+
+
+@dataclass(frozen=True)
+class MerchantMatch:
+    keyword: str
+    category: str
+    is_subscription: bool
+    subscription_frequency: Optional[str]
+
+
+def _trie_pattern(keywords: Iterable[str]) -> str:
+    """Build a regex matching any of the keywords, sharing their common prefixes."""
+    trie: dict = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if "" in node:
+            # A keyword ends here; the longer ones are tried first
+            return "(?:" + "|".join(branches) + ")?"
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+
+class MerchantMatcher:
+    """Matcher for a list of merchant entries, compiled once."""
+
+    def __init__(self, merchants: List[dict]):
+        self._entries: Dict[str, tuple] = {}
+        for priority, merchant in enumerate(merchants):
+            is_subscription = bool(merchant.get("subscription", False))
+            match = MerchantMatch(
+                keyword="",
+                category=merchant["category"],
+                is_subscription=is_subscription,
+                subscription_frequency=merchant.get("frequency", DEFAULT_FREQUENCY) if is_subscription else None,
+            )
+            for keyword in merchant["keywords"]:
+                keyword = " ".join(keyword.lower().split())
+                # A keyword listed twice keeps its first merchant
+                if keyword and keyword not in self._entries:
+                    self._entries[keyword] = (priority, match)
+
+        if self._entries:
+            self._pattern = re.compile(rf"(?<!\w)(?:{_trie_pattern(self._entries)})(?![^\W\d_])")
+        else:
+            self._pattern = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def match(self, text: str) -> Optional[MerchantMatch]:
+        """Return the highest-priority merchant whose keyword occurs in the text, or None."""
+        if self._pattern is None:
+            return None
+        best = None
+        for found in self._pattern.finditer(" ".join(text.lower().split())):
+            priority, match = self._entries[found.group(0)]
+            if best is None or priority < best[0]:
+                best = (priority, found.group(0), match)
+        if best is None:
+            return None
+        _, keyword, match = best
+        return replace(match, keyword=keyword)
+
+
+def load_merchant_matcher(path: str = DICTIONARY_FILE) -> MerchantMatcher:
+    with open(path, encoding="utf-8") as f:
+        return MerchantMatcher(json.load(f)["merchants"])
+
+
+_matcher: Optional[MerchantMatcher] = None
+
+
+def get_merchant_matcher() -> MerchantMatcher:
+    """Return the matcher for the dictionary file, loaded on first use."""
+    global _matcher
+    if _matcher is None:
+        _matcher = load_merchant_matcher()
+    return _matcher
+
+
+def match_merchant(text: str) -> Optional[MerchantMatch]:
+    return get_merchant_matcher().match(text)
+
+
+__all__ = [
+    "MerchantMatch",
+    "MerchantMatcher",
+    "load_merchant_matcher",
+    "get_merchant_matcher",
+    "match_merchant",
+]
@@ -0,0 +1,97 @@
+"""Content-addressed cache of OCR results and of processed uploads.
+
+Uploads are identified by the SHA-256 of their decoded bytes. Documents:
+
+    ocr_{sha256}                   {"text": ..., "created_at": ...}
+    ocr_{sha256}.p{page}           the same for one page of a PDF
+    uploads_{estate_id}_{sha256}   {"storage_key": ..., "uploaded_at": ...}
+
+The OCR text of an image does not depend on the estate, so it is shared,
+while the upload record points at the estate's stored transactions so a
+re-uploaded statement can return the earlier result without OCR, parsing or
+classification.
+
+Usage:
+
+    from app.libs.ocr_cache import content_hash, get_cached_text, store_text
+
+    digest = content_hash(content)
+    text = get_cached_text(digest)
+    if text is None:
+        text = await extract_text_from_image(content)
+        store_text(digest, text)
+"""
+
+import hashlib
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+from app.libs.storage import json_storage, sanitize_storage_key
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _ocr_key(digest: str) -> str:
+    return sanitize_storage_key(f"ocr_{digest}")
+
+
+def _upload_key(estate_id: str, digest: str) -> str:
+    return sanitize_storage_key(f"uploads_{estate_id}_{digest}")
+
+
+def get_cached_text(digest: str) -> Optional[str]:
+    """Return the stored OCR text for the content hash, or None."""
+    entry = json_storage.get(_ocr_key(digest), default=None)
+    return entry["text"] if entry else None
+
+
+def store_text(digest: str, text: str) -> None:
+    json_storage.put(_ocr_key(digest), {
+        "text": text,
+        "created_at": datetime.now().isoformat(),
+    })
+
+
+def get_cached_texts(keys: Iterable[str]) -> Dict[str, str]:
+    """Return the stored OCR texts found for several content hashes or page keys."""
+    keys = list(keys)
+    entries = json_storage.get_many([_ocr_key(key) for key in keys], default=None)
+    return {key: entries[_ocr_key(key)]["text"] for key in keys if entries[_ocr_key(key)]}
+
+
+def store_texts(texts: Dict[str, str]) -> None:
+    created_at = datetime.now().isoformat()
+    json_storage.put_many({
+        _ocr_key(key): {"text": text, "created_at": created_at}
+        for key, text in texts.items()
+    })
+
+
+def get_previous_upload(estate_id: str, digest: str) -> Optional[str]:
+    """Return the storage key of the transactions of an earlier upload of the same content, or None.
+
+    Upload records whose transactions have since been deleted are ignored.
+    """
+    record = json_storage.get(_upload_key(estate_id, digest), default=None)
+    if not record or json_storage.get(record["storage_key"], default=None) is None:
+        return None
+    return record["storage_key"]
+
+
+def record_upload(estate_id: str, digest: str, storage_key: str) -> None:
+    json_storage.put(_upload_key(estate_id, digest), {
+        "storage_key": storage_key,
+        "uploaded_at": datetime.now().isoformat(),
+    })
+
+
+__all__ = [
+    "content_hash",
+    "get_cached_text",
+    "store_text",
+    "get_cached_texts",
+    "store_texts",
+    "get_previous_upload",
+    "record_upload",
+]
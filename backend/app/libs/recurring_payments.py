@@ -0,0 +1,195 @@
+"""Detection of recurring payments from an estate's transaction history.
+
+Charges are grouped by recipient, and the intervals between each group's
+charges are compared with the monthly, quarterly and yearly periods. This is
+done for all groups at once with NumPy. An interval fits a period when it is
+within the period's tolerance. An interval of about two periods, such as a
+month missing from the uploaded statements, counts half. A group's confidence
+that it recurs is
+
+    fit * (0.5 + 0.5 * amount stability) * (1 - 0.5 ** intervals)
+
+where fit is the share of intervals that fit the group's best period. Amount
+stability falls from 1 to 0 as the coefficient of variation of the charges
+grows to 0.5. A price change or a varying electricity bill therefore weighs
+less than an irregular schedule, and a group with few charges never gets a
+confident verdict.
+
+A group is recurring at or above RECURRING_MIN_CONFIDENCE. It is not
+recurring below NOT_RECURRING_MAX_CONFIDENCE if it has at least
+NOT_RECURRING_MIN_CHARGES charges. Anything else is ambiguous and is left to
+the AI classification.
+
+    RECURRING_MIN_CONFIDENCE       default 0.75
+    NOT_RECURRING_MAX_CONFIDENCE   default 0.2
+    NOT_RECURRING_MIN_CHARGES      default 4
+
+Usage:
+
+    from app.libs.recurring_payments import detect_estate_recurring
+    from app.libs.transaction_analytics import recipient_key
+
+    patterns = detect_estate_recurring(estate_id, new_transactions)
+    pattern = patterns.get(recipient_key(transaction["recipient"]))
+    if pattern and pattern.is_recurring:
+        transaction["subscription_frequency"] = pattern.frequency
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from app.libs.transaction_analytics import get_columns, recipient_key
+
+# Length in days and tolerance in days of each period, shortest first
+PERIODS = {
+    "monthly": (30.44, 5.0),
+    "quarterly": (91.31, 10.0),
+    "yearly": (365.25, 20.0),
+}
+
+# Coefficient of variation of the amounts at which they count as unstable
+MAX_AMOUNT_VARIATION = 0.5
+
+RECURRING_MIN_CONFIDENCE = float(os.environ.get("RECURRING_MIN_CONFIDENCE", "0.75"))
+NOT_RECURRING_MAX_CONFIDENCE = float(os.environ.get("NOT_RECURRING_MAX_CONFIDENCE", "0.2"))
+NOT_RECURRING_MIN_CHARGES = int(os.environ.get("NOT_RECURRING_MIN_CHARGES", "4"))
+
+
+@dataclass(frozen=True)
+class RecurringPattern:
+    recipient: str
+    # True or False when the detector is confident, None when ambiguous
+    is_recurring: Optional[bool]
+    frequency: Optional[str]
+    confidence: float
+    charges: int
+    interval_days: Optional[float]
+    amount: float
+
+
+def _detect(
+    keys: List[str],
+    codes: np.ndarray,
+    dates: np.ndarray,
+    amounts: np.ndarray,
+    wanted: Optional[np.ndarray] = None,
+) -> Dict[str, RecurringPattern]:
+    """Patterns of the recipients coded into keys, for the wanted codes or all of them."""
+    size = len(keys)
+    charged = amounts < 0
+    codes, days, spent = codes[charged], dates[charged].astype(np.int64), -amounts[charged]
+    if not len(codes):
+        return {}
+
+    # Sorted by recipient, then date, so each group's charges are consecutive and in order
+    order = np.lexsort((days, codes))
+    codes, days, spent = codes[order], days[order], spent[order]
+
+    charges = np.bincount(codes, minlength=size)
+    counted = np.maximum(charges, 1)
+    mean = np.bincount(codes, weights=spent, minlength=size) / counted
+    square = np.bincount(codes, weights=spent ** 2, minlength=size) / counted
+    variation = np.sqrt(np.maximum(square - mean ** 2, 0.0)) / np.maximum(mean, 0.01)
+    stability = np.clip(1 - variation / MAX_AMOUNT_VARIATION, 0.0, 1.0)
+
+    # Intervals between consecutive charges to the same recipient, same-day charges ignored
+    gaps = np.diff(days)
+    within = (codes[1:] == codes[:-1]) & (gaps > 0)
+    gaps, owners = gaps[within].astype(np.float64), codes[1:][within]
+    intervals = np.bincount(owners, minlength=size)
+    measured = np.maximum(intervals, 1)
+    mean_interval = np.bincount(owners, weights=gaps, minlength=size) / measured
+
+    fits = np.empty((len(PERIODS), size))
+    for row, (length, tolerance) in enumerate(PERIODS.values()):
+        periods = np.rint(gaps / length)
+        close = np.abs(gaps - periods * length) <= tolerance * np.maximum(periods, 1)
+        weights = np.where(close & (periods == 1), 1.0, np.where(close & (periods == 2), 0.5, 0.0))
+        fits[row] = np.bincount(owners, weights=weights, minlength=size) / measured
+    best = fits.argmax(axis=0)
+    fit = fits[best, np.arange(size)]
+    confidence = fit * (0.5 + 0.5 * stability) * (1 - 0.5 ** intervals)
+
+    names = list(PERIODS)
+    candidates = np.flatnonzero(charges) if wanted is None else wanted[charges[wanted] > 0]
+    patterns = {}
+    for code in candidates:
+        score = float(confidence[code])
+        if score >= RECURRING_MIN_CONFIDENCE:
+            is_recurring = True
+        elif score < NOT_RECURRING_MAX_CONFIDENCE and charges[code] >= NOT_RECURRING_MIN_CHARGES:
+            is_recurring = False
+        else:
+            is_recurring = None
+        patterns[keys[code]] = RecurringPattern(
+            recipient=keys[code],
+            is_recurring=is_recurring,
+            frequency=names[best[code]] if fit[code] > 0 else None,
+            confidence=round(score, 3),
+            charges=int(charges[code]),
+            interval_days=round(float(mean_interval[code]), 1) if intervals[code] else None,
+            amount=round(float(mean[code]), 2),
+        )
+    return patterns
+
+
+def detect_recurring(recipients: Sequence[str], dates: Sequence[str], amounts: Sequence[float]) -> Dict[str, RecurringPattern]:
+    """Detect recurring payments among transactions given as recipients, ISO dates and amounts.
+
+    Returns the pattern of every recipient that was charged, keyed by recipient_key.
+    Raises ValueError for invalid dates.
+    """
+    keys: List[str] = []
+    codes_by_key: Dict[str, int] = {}
+    codes = []
+    for recipient in recipients:
+        key = recipient_key(recipient)
+        if key not in codes_by_key:
+            codes_by_key[key] = len(keys)
+            keys.append(key)
+        codes.append(codes_by_key[key])
+    return _detect(
+        keys,
+        np.array(codes, dtype=np.int32),
+        np.array(dates, dtype="datetime64[D]"),
+        np.array(amounts, dtype=np.float64),
+    )
+
+
+def detect_estate_recurring(estate_id: str, transactions: List[dict]) -> Dict[str, RecurringPattern]:
+    """Detect recurring payments to the recipients of transactions not yet in the estate's ledger.
+
+    The ledger's earlier charges to the same recipients are part of each
+    group's history. Returns patterns keyed by recipient_key. Raises
+    ValueError for invalid dates.
+    """
+    if not transactions:
+        return {}
+    columns = get_columns(estate_id)
+    keys = list(columns.recipient_keys)
+    codes_by_key = {key: code for code, key in enumerate(keys)}
+    codes = []
+    for transaction in transactions:
+        key = recipient_key(transaction["recipient"])
+        if key not in codes_by_key:
+            codes_by_key[key] = len(keys)
+            keys.append(key)
+        codes.append(codes_by_key[key])
+
+    codes = np.array(codes, dtype=np.int32)
+    return _detect(
+        keys,
+        np.concatenate([columns.recipients, codes]),
+        np.concatenate([columns.dates, np.array([t["date"] for t in transactions], dtype="datetime64[D]")]),
+        np.concatenate([columns.amounts, np.array([t["amount"] for t in transactions], dtype=np.float64)]),
+        wanted=np.unique(codes),
+    )
+
+
+__all__ = [
+    "PERIODS",
+    "RecurringPattern",
+    "detect_recurring",
+    "detect_estate_recurring",
+]
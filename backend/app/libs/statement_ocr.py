@@ -0,0 +1,195 @@
+"""Batched OCR of bank statements uploaded as PDFs or as several images.
+
+Pages are read with as few Vision round trips as possible, in parallel:
+
+- PDFs are split into documents of at most 5 pages, the most Vision reads
+  from one file per request, each sent with `batch_annotate_files`.
+- Images are sent up to 16 per `batch_annotate_images` request.
+
+Pages are yielded as their request completes, so callers can parse them
+while the rest are still being read. Page texts are cached by content hash
+in `app.libs.ocr_cache`, and cached pages are not sent to Vision again.
+
+    STATEMENT_MAX_PAGES   most pages read from one upload (default 100)
+
+Usage:
+
+    from app.libs.statement_ocr import ocr_statement
+
+    async for page, text in ocr_statement(files):
+        transactions[page] = parse_transaction_text(text)
+"""
+
+import asyncio
+import io
+import os
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+from fastapi import HTTPException
+from google.api_core import exceptions as google_exceptions
+from google.cloud import vision
+from app.libs.ai_clients import vision_client
+from app.libs.concurrency import get_provider
+from app.libs.ocr_cache import get_cached_texts, store_texts
+from app.libs.uploads import ReceivedFile
+
+PDF_PAGES_PER_REQUEST = 5
+IMAGES_PER_REQUEST = 16
+MAX_PAGES = int(os.environ.get("STATEMENT_MAX_PAGES", "100"))
+
+VISION_RETRY_ON = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
+vision_provider = get_provider("vision", retry_on=VISION_RETRY_ON)
+
+_FEATURES = [vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)]
+
+
+def is_pdf(file: ReceivedFile) -> bool:
+    if file.content_type == "application/pdf" or (file.filename or "").lower().endswith(".pdf"):
+        return True
+    file.file.seek(0)
+    return file.file.read(5) == b"%PDF-"
+
+
+def _split_pdf(file: ReceivedFile) -> List[Tuple[bytes, int]]:
+    """Split a PDF into documents of at most PDF_PAGES_PER_REQUEST pages, with their page counts."""
+    from PyPDF2 import PdfReader, PdfWriter
+
+    file.file.seek(0)
+    reader = PdfReader(file.file)
+    if reader.is_encrypted:
+        reader.decrypt("")
+    page_count = len(reader.pages)
+    if page_count > MAX_PAGES:
+        raise HTTPException(status_code=413, detail=f"Too many pages, the maximum is {MAX_PAGES}")
+
+    chunks = []
+    for start in range(0, page_count, PDF_PAGES_PER_REQUEST):
+        writer = PdfWriter()
+        pages = reader.pages[start:start + PDF_PAGES_PER_REQUEST]
+        for page in pages:
+            writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        chunks.append((buffer.getvalue(), len(pages)))
+    return chunks
+
+
+def _page_text(response: vision.AnnotateImageResponse, page: int) -> str:
+    if response.error.message:
+        raise ValueError(f"Page {page + 1}: {response.error.message}")
+    return response.full_text_annotation.text if response.full_text_annotation else ""
+
+
+async def _annotate_pdf(content: bytes, pages: List[Tuple[int, int]]) -> List[Tuple[int, str]]:
+    """OCR pages of a small PDF, given as (page in the PDF, page in the statement)."""
+    response = await vision_provider.call(
+        vision_client.get().batch_annotate_files,
+        requests=[vision.AnnotateFileRequest(
+            input_config=vision.InputConfig(content=content, mime_type="application/pdf"),
+            features=_FEATURES,
+            pages=[pdf_page + 1 for pdf_page, _ in pages],
+        )],
+    )
+    file_response = response.responses[0]
+    if file_response.error.message:
+        raise ValueError(file_response.error.message)
+    return [
+        (page, _page_text(page_response, page))
+        for (_, page), page_response in zip(pages, file_response.responses)
+    ]
+
+
+async def _annotate_images(images: List[Tuple[int, ReceivedFile]]) -> List[Tuple[int, str]]:
+    response = await vision_provider.call(
+        vision_client.get().batch_annotate_images,
+        requests=[
+            vision.AnnotateImageRequest(image=vision.Image(content=file.read()), features=_FEATURES)
+            for _, file in images
+        ],
+    )
+    return [
+        (page, _page_text(image_response, page))
+        for (page, _), image_response in zip(images, response.responses)
+    ]
+
+
+async def ocr_statement(
+    files: List[ReceivedFile],
+    on_page_count: Optional[Callable[[int], None]] = None,
+) -> AsyncIterator[Tuple[int, str]]:
+    """Read the text of every page of the uploaded files, yielding (page, text).
+
+    Pages are numbered from 0 across the files in upload order, and yielded
+    in the order they complete. `on_page_count` is called with the number of
+    pages once the files are split, for progress reporting.
+    """
+    # Cache key of every page, and the Vision request each page would be read in
+    keys: List[str] = []
+    pdf_chunks: List[Tuple[bytes, List[Tuple[int, int]]]] = []
+    images: List[Tuple[int, ReceivedFile]] = []
+    for file in files:
+        if is_pdf(file):
+            chunks = await asyncio.to_thread(_split_pdf, file)
+            for chunk_index, (chunk, page_count) in enumerate(chunks):
+                first = chunk_index * PDF_PAGES_PER_REQUEST
+                pages = []
+                for pdf_page in range(page_count):
+                    pages.append((pdf_page, len(keys)))
+                    keys.append(f"{file.sha256}.p{first + pdf_page}")
+                pdf_chunks.append((chunk, pages))
+        else:
+            images.append((len(keys), file))
+            keys.append(file.sha256)
+        if len(keys) > MAX_PAGES:
+            raise HTTPException(status_code=413, detail=f"Too many pages, the maximum is {MAX_PAGES}")
+
+    if on_page_count is not None:
+        on_page_count(len(keys))
+
+    cached = get_cached_texts(keys)
+    for page, key in enumerate(keys):
+        if key in cached:
+            yield page, cached[key]
+
+    requests = []
+    for chunk, pages in pdf_chunks:
+        pages = [(pdf_page, page) for pdf_page, page in pages if keys[page] not in cached]
+        if pages:
+            requests.append(_annotate_pdf(chunk, pages))
+    images = [(page, file) for page, file in images if keys[page] not in cached]
+    for start in range(0, len(images), IMAGES_PER_REQUEST):
+        requests.append(_annotate_images(images[start:start + IMAGES_PER_REQUEST]))
+
+    tasks = [asyncio.ensure_future(request) for request in requests]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            try:
+                results = await completed
+            except (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied):
+                # The credentials may have been rotated, the next call reads them again
+                vision_client.rotate()
+                raise
+            store_texts({keys[page]: text for page, text in results})
+            for page, text in results:
+                yield page, text
+    finally:
+        # Stop the other requests and wait for them, so their Vision calls end
+        # here and their exceptions are retrieved rather than logged as lost
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+__all__ = [
+    "PDF_PAGES_PER_REQUEST",
+    "IMAGES_PER_REQUEST",
+    "MAX_PAGES",
+    "VISION_RETRY_ON",
+    "vision_provider",
+    "is_pdf",
+    "ocr_statement",
+]
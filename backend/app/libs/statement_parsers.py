@@ -0,0 +1,348 @@
+"""Parsers for the text of bank statements, one per bank layout.
+
+Each parser has precompiled patterns for the entry lines of one layout and
+the markers that identify it (bank name, column headers). The parser is
+picked by scoring the first lines of the text, falling back to a generic
+`date text amount` layout. Lines are consumed from a streaming iterator, so
+large statements are not split into a list first.
+
+Handled in all layouts:
+
+- amounts with thousands separators, "1 234,50", "1.234,50" and "1234.50"
+- signs as "-123,45", "−123,45" and "123,45-"
+- dates as dd.mm.yyyy, dd.mm.yy and dd.mm (year taken from the statement)
+- entries split over several lines by OCR, where the date line has no amount
+
+Usage:
+
+    from app.libs.statement_parsers import parse_statement
+
+    transactions = parse_statement(text)  # [{"date", "recipient", "amount"}]
+"""
+
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+# Number of lines looked at to detect the layout
+DETECT_LINES = 40
+
+_AMOUNT = r"[-−]?\s?(?:\d{1,3}(?:[ \u00a0.]\d{3})+,\d{2}|\d+,\d{2}|\d+\.\d{2})-?"
+_DATE = r"\d{2}\.\d{2}(?:\.\d{4}|\.\d{2})?"
+_DATE_START = re.compile(rf"^\s*{_DATE}\b")
+_DATE_ANYWHERE = re.compile(rf"(?:^|\s){_DATE}(?:\s|$)")
+# Used with match: the greedy prefix backtracks from the end of the line, which
+# is much faster than searching for the amount from the start
+_AMOUNT_END = re.compile(rf"(?:.*\s)?{_AMOUNT}\s*(?:NOK|kr)?\s*$", re.IGNORECASE)
+# The date and amount columns of an entry whose text is on the line before
+_DATE_AMOUNT = re.compile(rf"^{_DATE}\s+{_AMOUNT}\s*(?:NOK|kr)?$", re.IGNORECASE)
+_YEAR = re.compile(r"\b\d{2}\.\d{2}\.(\d{4})\b")
+# The text column of entries, lazy by word rather than by character so the
+# columns after it are tried once per word
+_TEXT = r"(?P<text>\S++(?:\s++\S++)*?)"
+
+# Words that mark money coming in, for layouts without signed amounts
+_CREDIT_WORDS = re.compile(r"^(?:innbetaling|innskudd|lønn|overføring fra|fra:|renter|refusjon|tilbakeføring)", re.IGNORECASE)
+
+
+def iter_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    """Yield the non-empty, stripped lines of a text or of chunks of text."""
+    if isinstance(source, str):
+        source = (source,)
+    rest = ""
+    for chunk in source:
+        rest += chunk
+        start = 0
+        while True:
+            end = rest.find("\n", start)
+            if end < 0:
+                break
+            line = rest[start:end].strip()
+            if line:
+                yield line
+            start = end + 1
+        rest = rest[start:]
+    line = rest.strip()
+    if line:
+        yield line
+
+
+def parse_amount(value: str) -> float:
+    """Parse a statement amount: "1 234,50", "-1.234,50", "123,45-", "1234.50"."""
+    value = value.strip().replace("−", "-").replace(" ", "").replace("\u00a0", "")
+    negative = value.startswith("-") or value.endswith("-")
+    value = value.strip("-")
+    if "," in value:
+        value = value.replace(".", "").replace(",", ".")
+    amount = float(value)
+    return -amount if negative else amount
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value: str, default_year: int) -> str:
+    """Parse dd.mm.yyyy, dd.mm.yy or dd.mm into an ISO date."""
+    parts = value.split(".")
+    day, month = int(parts[0]), int(parts[1])
+    if len(parts) < 3:
+        year = default_year
+    elif len(parts[2]) == 2:
+        year = 2000 + int(parts[2])
+    else:
+        year = int(parts[2])
+    return date(year, month, day).isoformat()
+
+
+class StatementParser:
+    """Parser for one statement layout.
+
+    `entry` matches a complete entry line with the named groups date, text
+    and amount, and optionally balance. Matches that are not `plausible` are
+    skipped when scoring and parsing. `markers` are lowercase strings that
+    only appear in statements with this layout.
+    """
+
+    name = "generic"
+    markers: tuple = ()
+    entry = re.compile(
+        rf"^(?P<date>{_DATE})\s+{_TEXT}\s+(?P<amount>{_AMOUNT})(?:\s+(?P<balance>{_AMOUNT}))?\s*(?:NOK|kr)?$",
+        re.IGNORECASE,
+    )
+    # True when amounts are unsigned and credits are recognised by their text
+    unsigned_amounts = False
+
+    def detect(self, head: List[str]) -> int:
+        """Score how well the first lines of a statement fit this layout."""
+        return self.marker_score("\n".join(head).lower()) + self.entry_score(head)
+
+    def marker_score(self, text: str) -> int:
+        """Score of the markers found in the lowercased text, 5 for each."""
+        return sum(5 for marker in self.markers if marker in text)
+
+    def entry_score(self, head: List[str]) -> int:
+        """Score of the lines that are plausible entries of this layout, 1 for each."""
+        score = 0
+        for line in head:
+            match = self.entry.match(line)
+            if match and self.plausible(match):
+                score += 1
+        return score
+
+    def plausible(self, match: re.Match) -> bool:
+        """Whether a matched line looks like this layout rather than another one.
+
+        Dates or amounts left in the text mean the line has columns this
+        layout does not know, and unsigned layouts have no negative amounts.
+        """
+        if self.unsigned_amounts and match.group("amount").strip().startswith(("-", "−")):
+            return False
+        text = match.group("text")
+        # Cheap checks first, as this runs for every entry: a date has dots and
+        # an amount ends in a digit, a minus or a currency
+        if "." in text and _DATE_ANYWHERE.search(text):
+            return False
+        if text[-1] in "0123456789-" or text[-3:].lower().endswith(("nok", "kr")):
+            return not _AMOUNT_END.match(text)
+        return True
+
+    def clean_text(self, text: str) -> str:
+        return " ".join(text.split()).strip(" .:-")
+
+    def make_transaction(self, match: re.Match, default_year: int) -> Optional[Dict]:
+        recipient = self.clean_text(match.group("text"))
+        if not recipient:
+            return None
+        try:
+            transaction_date = parse_date(match.group("date"), default_year)
+            amount = parse_amount(match.group("amount"))
+        except ValueError:
+            return None
+        if self.unsigned_amounts and amount > 0 and not _CREDIT_WORDS.match(recipient):
+            amount = -amount
+        return {"date": transaction_date, "recipient": recipient, "amount": amount}
+
+    def parse(self, lines: Iterable[str], default_year: Optional[int] = None) -> Iterator[Dict]:
+        """Yield the transactions in lines, joining entries split over several lines."""
+        year = default_year or datetime.now().year
+        pending = None
+        for line in lines:
+            if _DATE_START.match(line) and (pending is None or not _DATE_AMOUNT.match(line)):
+                pending = None
+                match = self.entry.match(line)
+                if match:
+                    # A line with columns this layout does not know is no entry of it
+                    transaction = self.make_transaction(match, year) if self.plausible(match) else None
+                    if transaction:
+                        yield transaction
+                elif not _AMOUNT_END.match(line):
+                    # Date and text, with the rest of the entry on the next lines
+                    pending = line
+                continue
+            if pending is None:
+                continue
+            pending = f"{pending} {line}"
+            match = self.entry.match(pending)
+            if match:
+                pending = None
+                transaction = self.make_transaction(match, year) if self.plausible(match) else None
+                if transaction:
+                    yield transaction
+            elif _AMOUNT_END.match(line):
+                pending = None
+
+
+class DnbParser(StatementParser):
+    """DNB: Forklaring, Rentedato, Ut fra konto, Inn på konto, amounts unsigned.
+
+        01.02 Varekjøp KIWI 123 MAJORSTUEN OSLO Dato 30.01 01.02 123,45
+    """
+
+    name = "dnb"
+    markers = ("dnb", "ut fra konto", "inn på konto")
+    entry = re.compile(
+        rf"^(?P<date>{_DATE})\s+{_TEXT}(?:\s+Dato\s+{_DATE})?\s+(?:{_DATE}\s+)?(?P<amount>{_AMOUNT})$",
+        re.IGNORECASE,
+    )
+    unsigned_amounts = True
+    prefix = re.compile(r"^(?:varekjøp|visa vare|kjøp)\s+", re.IGNORECASE)
+
+    def clean_text(self, text: str) -> str:
+        return super().clean_text(self.prefix.sub("", text))
+
+
+class NordeaParser(StatementParser):
+    """Nordea: booking date, text, value date and signed amount.
+
+        01.02.2024 KIWI MAJORSTUEN 01.02.2024 -123,45
+    """
+
+    name = "nordea"
+    markers = ("nordea", "bokføringsdato", "valuteringsdato")
+    entry = re.compile(
+        rf"^(?P<date>{_DATE})\s+{_TEXT}\s+{_DATE}\s+(?P<amount>{_AMOUNT})$",
+        re.IGNORECASE,
+    )
+
+
+class SpareBank1Parser(StatementParser):
+    """SpareBank 1: date, text, interest date and amount, out of account unsigned.
+
+        01.02.2024 VISA VARE 4925 KIWI MAJORSTUEN 01.02.2024 123,45
+    """
+
+    name = "sparebank1"
+    markers = ("sparebank 1", "sparebank1", "ut av konto")
+    entry = re.compile(
+        rf"^(?P<date>{_DATE})\s+{_TEXT}\s+(?:{_DATE}\s+)?(?P<amount>{_AMOUNT})$",
+        re.IGNORECASE,
+    )
+    unsigned_amounts = True
+    prefix = re.compile(r"^(?:visa vare|varekjøp)\s+(?:\d{4}\s+)?", re.IGNORECASE)
+
+    def clean_text(self, text: str) -> str:
+        return super().clean_text(self.prefix.sub("", text))
+
+
+class HandelsbankenParser(StatementParser):
+    """Handelsbanken: ledger date, transaction date, text, signed amount and balance.
+
+        01.02.2024 31.01.2024 KIWI MAJORSTUEN -123,45 10 234,56
+    """
+
+    name = "handelsbanken"
+    markers = ("handelsbanken", "reskontrodato", "transaksjonsdato")
+    entry = re.compile(
+        rf"^{_DATE}\s+(?P<date>{_DATE})\s+{_TEXT}\s+(?P<amount>{_AMOUNT})\s+(?P<balance>{_AMOUNT})$",
+        re.IGNORECASE,
+    )
+
+
+_parsers: List[StatementParser] = []
+_generic = StatementParser()
+
+
+def register_parser(parser: StatementParser) -> None:
+    _parsers.append(parser)
+
+
+def get_parser(name: str) -> StatementParser:
+    for parser in _parsers:
+        if parser.name == name:
+            return parser
+    if name == _generic.name:
+        return _generic
+    raise KeyError(f"Unknown statement layout: {name}")
+
+
+def detect_parser(head: List[str]) -> StatementParser:
+    """Pick the parser scoring highest on the first lines, or the generic one.
+
+    Ties go to the generic parser, then to the parser registered first. Only
+    lines starting with a date are scored as entries, as they are the lines
+    `parse` reads. Parsers are scored in order of their markers, and the lines
+    are only matched for a parser whose markers plus a point per dated line
+    could still win, so a statement with markers is usually matched against
+    its own layout only.
+    """
+    parsers = [_generic] + _parsers
+    text = "\n".join(head).lower()
+    dated = [line for line in head if _DATE_START.match(line)]
+    markers = [parser.marker_score(text) for parser in parsers]
+    best, best_score = 0, -1
+    for index in sorted(range(len(parsers)), key=lambda i: -markers[i]):
+        highest = markers[index] + len(dated)
+        if highest < best_score or (highest == best_score and index > best):
+            continue
+        score = markers[index] + parsers[index].entry_score(dated)
+        if score > best_score or (score == best_score and index < best):
+            best, best_score = index, score
+    return parsers[best]
+
+
+def parse_statement(
+    source: Union[str, Iterable[str]],
+    bank: Optional[str] = None,
+    default_year: Optional[int] = None,
+) -> List[Dict]:
+    """Parse a statement's text, detecting its layout unless `bank` is given.
+
+    Dates without a year get the first full year found in the first lines,
+    or default_year, or the current year.
+    """
+    lines = iter_lines(source)
+    head = []
+    for line in lines:
+        head.append(line)
+        if len(head) >= DETECT_LINES:
+            break
+
+    parser = get_parser(bank) if bank else detect_parser(head)
+    if default_year is None:
+        years = (_YEAR.search(line) for line in head)
+        default_year = next((int(match.group(1)) for match in years if match), None)
+
+    def all_lines() -> Iterator[str]:
+        yield from head
+        yield from lines
+
+    return list(parser.parse(all_lines(), default_year))
+
+
+for _parser in (DnbParser(), NordeaParser(), SpareBank1Parser(), HandelsbankenParser()):
+    register_parser(_parser)
+
+
+__all__ = [
+    "iter_lines",
+    "parse_amount",
+    "parse_date",
+    "StatementParser",
+    "DnbParser",
+    "NordeaParser",
+    "SpareBank1Parser",
+    "HandelsbankenParser",
+    "register_parser",
+    "get_parser",
+    "detect_parser",
+    "parse_statement",
+]
@@ -0,0 +1,402 @@
+"""JSON document storage used by the API modules.
+
+The routers depend on the `JsonStorage` interface instead of calling
+`databutton.storage.json` directly, so the backend can be swapped per
+deployment:
+
+    STORAGE_BACKEND=databutton   Databutton hosted storage (default)
+    STORAGE_BACKEND=sqlite       Embedded SQLite database in WAL mode,
+                                 stored at STORAGE_SQLITE_PATH
+
+Reads of estate and roles documents go through an in-process cache, see
+`CachedJsonStorage`.
+
+Usage:
+
+    from app.libs.storage import json_storage, sanitize_storage_key
+
+    key = sanitize_storage_key(f"estates_{estate_id}")
+    estate = json_storage.get(key, default=None)
+    json_storage.put(key, estate)
+
+    with json_storage.transaction():
+        json_storage.put_many({key: estate, other_key: other})
+"""
+
+import contextlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, ContextManager, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.libs.cache import LRUCache
+
+
+def sanitize_storage_key(key: str) -> str:
+    """Sanitize storage key to only allow alphanumeric and ._- symbols"""
+    return re.sub(r'[^a-zA-Z0-9._-]', '', key)
+
+
+_MISSING = object()
+_ABSENT = object()
+
+# Cached marker for keys that do not exist in the backend
+_NOT_FOUND = "\x00not-found"
+
+
+@dataclass
+class StorageEntry:
+    name: str
+    size: Optional[int] = None
+    updated: Optional[float] = None
+
+
+class JsonStorage(ABC):
+    """Key/value store of JSON documents.
+
+    `get` raises FileNotFoundError for missing keys unless a default is given,
+    and `delete` raises FileNotFoundError for missing keys, like databutton.
+    """
+
+    @abstractmethod
+    def get(self, key: str, default: Any = _MISSING) -> Any: ...
+
+    @abstractmethod
+    def put(self, key: str, value: Any) -> None: ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    def list(self) -> List[StorageEntry]: ...
+
+    def get_fresh(self, key: str, default: Any = _MISSING) -> Any:
+        """Get a document bypassing any cache, e.g. for version checks before a write."""
+        return self.get(key, default=default)
+
+    def list_prefix(self, prefix: str) -> List[StorageEntry]:
+        """List entries whose key starts with prefix."""
+        return [entry for entry in self.list() if entry.name.startswith(prefix)]
+
+    def get_many(self, keys: Iterable[str], default: Any = None) -> Dict[str, Any]:
+        """Get several documents at once, using default for missing keys."""
+        return {key: self.get(key, default=default) for key in keys}
+
+    def put_many(self, items: Dict[str, Any]) -> None:
+        """Put several documents at once."""
+        for key, value in items.items():
+            self.put(key, value)
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Group writes so they are applied atomically where the backend supports it."""
+        yield
+
+
+class DatabuttonJsonStorage(JsonStorage):
+    """Adapter for the Databutton hosted `db.storage.json` API.
+
+    Databutton storage has no transactions, so `transaction()` only groups
+    the calls and writes are applied one by one.
+    """
+
+    def __init__(self):
+        import databutton as db
+
+        self._json = db.storage.json
+
+    def get(self, key: str, default: Any = _MISSING) -> Any:
+        if default is _MISSING:
+            return self._json.get(key)
+        return self._json.get(key, default=default)
+
+    def put(self, key: str, value: Any) -> None:
+        self._json.put(key, value)
+
+    def delete(self, key: str) -> None:
+        self._json.delete(key)
+
+    def list(self) -> List[StorageEntry]:
+        return [
+            StorageEntry(
+                name=file.name,
+                size=getattr(file, "size", None),
+                updated=getattr(file, "updated", None),
+            )
+            for file in self._json.list()
+        ]
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, default=_json_default, ensure_ascii=False)
+
+
+class SqliteJsonStorage(JsonStorage):
+    """Embedded SQLite storage in WAL mode for local runs, benchmarks and load tests.
+
+    Keys are the table's primary key, so prefix scans are index range scans.
+    Each thread gets its own connection. `transaction()` wraps the enclosed
+    reads and writes in a single `BEGIN IMMEDIATE` transaction and can be nested.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " updated REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    @contextlib.contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._local.depth = 0
+        yield conn
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._connection() as conn:
+            if self._local.depth == 0:
+                conn.execute("BEGIN IMMEDIATE")
+            self._local.depth += 1
+            try:
+                yield
+            except BaseException:
+                self._local.depth -= 1
+                if self._local.depth == 0:
+                    conn.execute("ROLLBACK")
+                raise
+            else:
+                self._local.depth -= 1
+                if self._local.depth == 0:
+                    conn.execute("COMMIT")
+
+    def get(self, key: str, default: Any = _MISSING) -> Any:
+        with self._connection() as conn:
+            row = conn.execute("SELECT value FROM documents WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            if default is _MISSING:
+                raise FileNotFoundError(key)
+            return default
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        self.put_many({key: value})
+
+    def delete(self, key: str) -> None:
+        with self._connection() as conn:
+            cursor = conn.execute("DELETE FROM documents WHERE key = ?", (key,))
+        if cursor.rowcount == 0:
+            raise FileNotFoundError(key)
+
+    def list(self) -> List[StorageEntry]:
+        with self._connection() as conn:
+            rows = conn.execute("SELECT key, size, updated FROM documents ORDER BY key").fetchall()
+        return [StorageEntry(name=key, size=size, updated=updated) for key, size, updated in rows]
+
+    def list_prefix(self, prefix: str) -> List[StorageEntry]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT key, size, updated FROM documents"
+                " WHERE key >= ? AND key < ? ORDER BY key",
+                (prefix, prefix + "\U0010ffff"),
+            ).fetchall()
+        return [StorageEntry(name=key, size=size, updated=updated) for key, size, updated in rows]
+
+    def get_many(self, keys: Iterable[str], default: Any = None) -> Dict[str, Any]:
+        keys = list(keys)
+        found: Dict[str, Any] = {}
+        with self._connection() as conn:
+            # Stay below SQLite's bound parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, value FROM documents WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+        return {key: found.get(key, default) for key in keys}
+
+    def put_many(self, items: Dict[str, Any]) -> None:
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            encoded = _dumps(value)
+            rows.append((key, encoded, len(encoded.encode("utf-8")), now))
+        with self.transaction(), self._connection() as conn:
+            conn.executemany(
+                "INSERT INTO documents (key, value, size, updated) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET"
+                " value = excluded.value, size = excluded.size, updated = excluded.updated",
+                rows,
+            )
+
+
+class CachedJsonStorage(JsonStorage):
+    """Read-through cache in front of another storage backend.
+
+    Only keys starting with one of `prefixes` are cached. Values are kept
+    JSON-encoded, so callers that mutate the documents they get never change
+    the cached copy. Missing keys are cached too. Every put and delete
+    through this object invalidates the key.
+
+    The cache is per process, so with several workers a write in one worker is
+    seen by the others once their entry expires after `ttl_seconds`.
+    """
+
+    def __init__(self, backend: JsonStorage, cache: LRUCache, prefixes: Tuple[str, ...]):
+        self.backend = backend
+        self.cache = cache
+        self.prefixes = prefixes
+
+    def _cached(self, key: str) -> bool:
+        return key.startswith(self.prefixes)
+
+    def _store(self, key: str, value: Any, version: int) -> None:
+        encoded = _NOT_FOUND if value is _ABSENT else _dumps(value)
+        self.cache.set(key, encoded, size=len(encoded), version=version)
+
+    def get(self, key: str, default: Any = _MISSING) -> Any:
+        if not self._cached(key):
+            return self.backend.get(key, default=default)
+
+        hit, encoded = self.cache.get(key)
+        if hit:
+            value = _ABSENT if encoded == _NOT_FOUND else json.loads(encoded)
+        else:
+            version = self.cache.version
+            value = self.backend.get(key, default=_ABSENT)
+            self._store(key, value, version)
+
+        if value is _ABSENT:
+            if default is _MISSING:
+                raise FileNotFoundError(key)
+            return default
+        return value
+
+    def get_fresh(self, key: str, default: Any = _MISSING) -> Any:
+        version = self.cache.version
+        value = self.backend.get(key, default=_ABSENT)
+        if self._cached(key):
+            self._store(key, value, version)
+        if value is _ABSENT:
+            if default is _MISSING:
+                raise FileNotFoundError(key)
+            return default
+        return value
+
+    def get_many(self, keys: Iterable[str], default: Any = None) -> Dict[str, Any]:
+        keys = list(keys)
+        result: Dict[str, Any] = {}
+        to_load = []
+        for key in keys:
+            if not self._cached(key):
+                to_load.append(key)
+                continue
+            hit, encoded = self.cache.get(key)
+            if not hit:
+                to_load.append(key)
+            elif encoded == _NOT_FOUND:
+                result[key] = default
+            else:
+                result[key] = json.loads(encoded)
+
+        if to_load:
+            version = self.cache.version
+            loaded = self.backend.get_many(to_load, default=_ABSENT)
+            for key, value in loaded.items():
+                if self._cached(key):
+                    self._store(key, value, version)
+                result[key] = default if value is _ABSENT else value
+
+        return {key: result[key] for key in keys}
+
+    def put(self, key: str, value: Any) -> None:
+        try:
+            self.backend.put(key, value)
+        finally:
+            self.cache.invalidate(key)
+
+    def put_many(self, items: Dict[str, Any]) -> None:
+        try:
+            self.backend.put_many(items)
+        finally:
+            for key in items:
+                self.cache.invalidate(key)
+
+    def delete(self, key: str) -> None:
+        try:
+            self.backend.delete(key)
+        finally:
+            self.cache.invalidate(key)
+
+    def list(self) -> List[StorageEntry]:
+        return self.backend.list()
+
+    def list_prefix(self, prefix: str) -> List[StorageEntry]:
+        return self.backend.list_prefix(prefix)
+
+    def transaction(self) -> ContextManager[None]:
+        return self.backend.transaction()
+
+
+def get_json_storage() -> JsonStorage:
+    """Create the storage backend selected by the STORAGE_BACKEND environment variable."""
+    backend = os.environ.get("STORAGE_BACKEND", "databutton")
+    if backend == "databutton":
+        return DatabuttonJsonStorage()
+    if backend == "sqlite":
+        return SqliteJsonStorage(os.environ.get("STORAGE_SQLITE_PATH", "storage.sqlite3"))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def get_cached_json_storage(backend: JsonStorage) -> CachedJsonStorage:
+    """Wrap a backend in the estate/roles document cache.
+
+    Limits are read from STORAGE_CACHE_MAX_ENTRIES, STORAGE_CACHE_MAX_BYTES
+    and STORAGE_CACHE_TTL_SECONDS. Setting max entries to 0 disables caching.
+    """
+    cache = LRUCache(
+        max_entries=int(os.environ.get("STORAGE_CACHE_MAX_ENTRIES", "1000")),
+        max_bytes=int(os.environ.get("STORAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+        ttl_seconds=float(os.environ.get("STORAGE_CACHE_TTL_SECONDS", "30")),
+    )
+    return CachedJsonStorage(backend, cache, prefixes=("estates_", "roles_"))
+
+
+json_storage = get_cached_json_storage(get_json_storage())
+
+__all__ = [
+    "JsonStorage",
+    "StorageEntry",
+    "DatabuttonJsonStorage",
+    "SqliteJsonStorage",
+    "CachedJsonStorage",
+    "get_json_storage",
+    "get_cached_json_storage",
+    "json_storage",
+    "sanitize_storage_key",
+]
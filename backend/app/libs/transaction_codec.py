@@ -0,0 +1,182 @@
+"""Compact storage encoding for lists of transactions.
+
+Ledger months and upload snapshots are lists of transaction dicts that repeat
+every key and mostly the same few recipients, categories and dates. They are
+stored as a JSON document wrapping the transactions as compressed columns:
+
+    {"encoding": "transaction-columns-1", "compression": "zstd", "count": n, "data": "<base64>"}
+
+The compressed payload is a JSON header followed by packed integer arrays.
+Every field present in all transactions is one column:
+
+    amounts          integers in øre when that is exact, packed
+    repeated values  a dictionary of distinct values in the header, packed codes
+    other            the values in the header
+
+Fields only some transactions have are kept per transaction in the header. Decoding
+gives back equal dicts, and plain JSON lists stored before this encoding are
+returned as they are, so readers call `decode_transactions` on either.
+Compression is zstd when the zstandard package is installed, otherwise gzip.
+
+    TRANSACTION_ENCODING   "columns" (default) or "json" to store plain lists
+
+Usage:
+
+    from app.libs.transaction_codec import decode_transactions, encode_transactions
+
+    json_storage.put(key, encode_transactions(transactions))
+    transactions = decode_transactions(json_storage.get(key, default=[]))
+"""
+
+import base64
+import gzip
+import json
+import operator
+import os
+import struct
+import sys
+from array import array
+from itertools import repeat
+from typing import Any, Dict, List, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODING = "transaction-columns-1"
+STORAGE_ENCODING = os.environ.get("TRANSACTION_ENCODING", "columns")
+
+_SCALARS = (str, bool, int, float, type(None))
+_HEADER = struct.Struct("<I")
+
+
+def _compress(payload: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(payload)
+    return "gzip", gzip.compress(payload, compresslevel=6, mtime=0)
+
+
+def _decompress(compression: str, data: bytes) -> bytes:
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("Transactions are zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown transaction compression: {compression}")
+
+
+def _pack(typecode: str, values: List[int]) -> bytes:
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(typecode: str, data: bytes) -> List[int]:
+    packed = array(typecode)
+    packed.frombytes(data)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tolist()
+
+
+def _encode_column(field: str, values: List[Any]) -> Tuple[Dict, bytes]:
+    """Return the column's description for the header and its packed integers, if any."""
+    if field == "amount" and all(type(v) in (int, float) for v in values):
+        ore = [round(v * 100) for v in values]
+        if all(o / 100 == v for o, v in zip(ore, values)):
+            return {"ore": "q"}, _pack("q", ore)
+
+    if all(isinstance(v, _SCALARS) for v in values):
+        # Keyed by type as well, so True and 1 are different values
+        codes: Dict[tuple, int] = {}
+        for value in values:
+            codes.setdefault((type(value), value), len(codes))
+        if len(codes) <= len(values) // 2:
+            typecode = "B" if len(codes) <= 0xFF else "H" if len(codes) <= 0xFFFF else "I"
+            column = {"dictionary": [value for _, value in codes], "codes": typecode}
+            return column, _pack(typecode, [codes[(type(value), value)] for value in values])
+    return {"values": values}, b""
+
+
+def _decode_column(column: Dict, data: bytes) -> List[Any]:
+    if "ore" in column:
+        return list(map(operator.truediv, _unpack(column["ore"], data), repeat(100)))
+    if "values" in column:
+        return column["values"]
+    return list(map(column["dictionary"].__getitem__, _unpack(column["codes"], data)))
+
+
+def encode_transactions(transactions: List[Dict], encoding: str = STORAGE_ENCODING) -> Any:
+    """Return the value to store for a list of transactions.
+
+    That is the compact document, or the list itself when `encoding` is "json"
+    or there are no transactions.
+    """
+    if encoding == "json" or not transactions:
+        return transactions
+
+    fields = [field for field in transactions[0] if all(field in t for t in transactions)]
+    columns, blobs = {}, []
+    for field in fields:
+        column, data = _encode_column(field, [t[field] for t in transactions])
+        if data:
+            column["bytes"] = len(data)
+            blobs.append(data)
+        columns[field] = column
+    header = {"fields": fields, "columns": columns}
+    rest = [{k: v for k, v in t.items() if k not in columns} for t in transactions]
+    if any(rest):
+        header["rest"] = rest
+
+    header_bytes = json.dumps(header, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    compression, data = _compress(_HEADER.pack(len(header_bytes)) + header_bytes + b"".join(blobs))
+    return {
+        "encoding": ENCODING,
+        "compression": compression,
+        "count": len(transactions),
+        "data": base64.b64encode(data).decode("ascii"),
+    }
+
+
+def decode_transactions(value: Any) -> List[Dict]:
+    """Return the transactions of a stored value, compact or a plain list.
+
+    None decodes as no transactions. Raises ValueError for an unknown encoding.
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    if value.get("encoding") != ENCODING:
+        raise ValueError(f"Unknown transaction encoding: {value.get('encoding')}")
+
+    payload = _decompress(value["compression"], base64.b64decode(value["data"]))
+    (size,) = _HEADER.unpack_from(payload)
+    offset = _HEADER.size + size
+    header = json.loads(payload[_HEADER.size:offset])
+
+    fields = header["fields"]
+    columns = []
+    for field in fields:
+        column = header["columns"][field]
+        length = column.get("bytes", 0)
+        columns.append(_decode_column(column, payload[offset:offset + length]))
+        offset += length
+
+    if fields:
+        transactions = list(map(dict, map(zip, repeat(fields), zip(*columns))))
+    else:
+        transactions = [{} for _ in range(value["count"])]
+    for transaction, rest in zip(transactions, header.get("rest", ())):
+        transaction.update(rest)
+    return transactions
+
+
+__all__ = [
+    "ENCODING",
+    "encode_transactions",
+    "decode_transactions",
+]
@@ -0,0 +1,475 @@
+"""Per-estate ledger of uploaded transactions, merged and deduplicated.
+
+Documents for an estate:
+
+    ledger_{estate_id}.head                    {"months": {"2024-02": n}, "id_shards": ["3f"], "version": n}
+    ledger_{estate_id}.month.{yyyy-mm}          the month's transactions, newest first, see transaction_codec
+    ledger_{estate_id}.fingerprints.{yyyy-mm}   {fingerprint: transaction id} of the month's transactions
+    ledger_{estate_id}.ids.{shard}              {transaction id: "2024-02"} of the ids in the shard
+
+The id index is sharded on the first ID_SHARD_CHARS hex digits of a hash of
+the id, and the head lists the shards that exist.
+
+Every upload is merged into the ledger. Transactions are fingerprinted on
+date, recipient (case and punctuation aside), amount and occurrence index,
+the number of identical transactions before it in the upload. A transaction
+whose fingerprint is in the estate's set is already stored, so overlapping
+statements do not double the rows while two identical purchases on one day
+are kept. Uploads check the set before classification, so known
+transactions are not sent to OpenAI again. Stored transactions keep their
+ids; new ones get ids derived from the fingerprint, so rebuilding the ledger
+gives the same ids.
+
+Merging rewrites the head and the months and id shards the upload touches,
+so its cost follows the size of the upload rather than of the ledger.
+Reading a page only loads the head and the months that page falls in. The
+head's version goes up on every change, for caches of derived data.
+
+New estates get an empty ledger when they are created. Estates with upload
+snapshots from before the ledger (`transactions/{estate_id}/{timestamp}`)
+are migrated by the rebuild command below, which writes the
+`ledger.migrated` marker. Until the marker exists, an estate without a head
+gets its ledger built from its snapshots on first access. After that, a
+missing head means an empty ledger and storage is not scanned. Ledgers
+stored with a single `ledger_{estate_id}.index` document get it split into
+shards on first access.
+
+Usage:
+
+    from app.libs.transaction_ledger import get_ledger_transaction, merge_transactions, read_transactions
+
+    fingerprints = fingerprint_transactions(transactions)
+    known = find_known_transactions(estate_id, transactions, fingerprints)  # {index: stored transaction}
+    stored = merge_transactions(estate_id, new_transactions, new_fingerprints)
+    page, next_cursor = read_transactions(estate_id, limit=100, category="streaming")
+    transaction = get_ledger_transaction(estate_id, transaction_id)
+    create_ledger(estate_id)  # when the estate is created
+
+Rebuild the ledgers of all estates from their upload snapshots:
+
+    python -m app.libs.transaction_ledger
+"""
+
+import base64
+import hashlib
+import re
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from app.libs.storage import json_storage, sanitize_storage_key
+from app.libs.transaction_codec import decode_transactions, encode_transactions
+
+MIGRATION_KEY = "ledger.migrated"
+_migrated = False
+
+# Hex digits of the id hash naming an id shard, 256 shards
+ID_SHARD_CHARS = 2
+
+
+def _head_key(estate_id: str) -> str:
+    return sanitize_storage_key(f"ledger_{estate_id}.head")
+
+
+def _month_key(estate_id: str, month: str) -> str:
+    return sanitize_storage_key(f"ledger_{estate_id}.month.{month}")
+
+
+def _fingerprints_key(estate_id: str, month: str) -> str:
+    return sanitize_storage_key(f"ledger_{estate_id}.fingerprints.{month}")
+
+
+def _ids_key(estate_id: str, shard: str) -> str:
+    return sanitize_storage_key(f"ledger_{estate_id}.ids.{shard}")
+
+
+def _legacy_index_key(estate_id: str) -> str:
+    return sanitize_storage_key(f"ledger_{estate_id}.index")
+
+
+def _id_shard(transaction_id: str) -> str:
+    return hashlib.sha256(transaction_id.encode("utf-8")).hexdigest()[:ID_SHARD_CHARS]
+
+
+def _snapshot_prefix(estate_id: str) -> str:
+    return f"transactions/{estate_id}/"
+
+
+def _month(transaction: Dict) -> str:
+    return transaction["date"][:7]
+
+
+def _sort_key(transaction: Dict) -> Tuple[str, str]:
+    return transaction["date"], transaction["id"]
+
+
+def _fingerprint_fields(transaction: Dict) -> Tuple[str, str, str]:
+    """Date, normalised recipient and amount, the fields that identify a transaction."""
+    recipient = " ".join(re.sub(r"[^\w]", " ", transaction["recipient"].lower()).split())
+    return transaction["date"], recipient, f"{float(transaction['amount']):.2f}"
+
+
+def fingerprint_transactions(transactions: List[Dict]) -> List[str]:
+    """Fingerprint the transactions of one upload, in order.
+
+    The nth identical transaction in the list gets occurrence index n, so
+    repeated identical purchases get different fingerprints.
+    """
+    seen: Counter = Counter()
+    fingerprints = []
+    for transaction in transactions:
+        key = _fingerprint_fields(transaction)
+        value = "|".join((*key, str(seen[key])))
+        seen[key] += 1
+        fingerprints.append(hashlib.sha256(value.encode("utf-8")).hexdigest()[:16])
+    return fingerprints
+
+
+def _stable_id(estate_id: str, fingerprint: str) -> str:
+    digest = hashlib.sha256(f"{estate_id}|{fingerprint}".encode("utf-8")).hexdigest()
+    return f"tx_{digest[:20]}"
+
+
+def _empty_head() -> Dict:
+    return {"months": {}, "id_shards": [], "version": 0}
+
+
+def _ledgers_migrated() -> bool:
+    """Whether every estate's ledger was built by rebuild_all_ledgers."""
+    global _migrated
+    if not _migrated:
+        _migrated = json_storage.get(MIGRATION_KEY, default=None) is not None
+    return _migrated
+
+
+def get_ledger_head(estate_id: str) -> Dict:
+    """Return the head of the estate's ledger.
+
+    Before the migration has run, an estate without a current head gets its
+    ledger built from its upload snapshots.
+    """
+    head = json_storage.get(_head_key(estate_id), default=None)
+    if head is None and _ledgers_migrated():
+        return _empty_head()
+    if head is None or "version" not in head:
+        head = rebuild_ledger(estate_id)
+    elif "id_shards" not in head:
+        head = _shard_legacy_index(estate_id)
+    return head
+
+
+def _shard_legacy_index(estate_id: str) -> Dict:
+    """Split the single index document of a ledger into fingerprint and id shards."""
+    with json_storage.transaction():
+        head = json_storage.get_fresh(_head_key(estate_id), default=None) or _empty_head()
+        if "id_shards" in head:
+            return head
+        index = json_storage.get_fresh(_legacy_index_key(estate_id), default=None) or {"ids": {}, "fingerprints": {}}
+        fingerprints: Dict[str, Dict[str, str]] = {month: {} for month in head["months"]}
+        for fingerprint, transaction_id in index["fingerprints"].items():
+            month = index["ids"].get(transaction_id)
+            if month is not None:
+                fingerprints.setdefault(month, {})[fingerprint] = transaction_id
+        ids: Dict[str, Dict[str, str]] = {}
+        for transaction_id, month in index["ids"].items():
+            ids.setdefault(_id_shard(transaction_id), {})[transaction_id] = month
+        head["id_shards"] = sorted(ids)
+
+        documents = {_fingerprints_key(estate_id, month): shard for month, shard in fingerprints.items()}
+        documents.update({_ids_key(estate_id, shard): shard_ids for shard, shard_ids in ids.items()})
+        documents[_head_key(estate_id)] = head
+        json_storage.put_many(documents)
+        try:
+            json_storage.delete(_legacy_index_key(estate_id))
+        except FileNotFoundError:
+            pass
+    print(f"Split the ledger index of estate {estate_id} into {len(ids)} id shards")
+    return head
+
+
+def create_ledger(estate_id: str) -> None:
+    """Store an empty ledger for a new estate, so reading it never looks for snapshots."""
+    json_storage.put(_head_key(estate_id), _empty_head())
+
+
+def _load_fingerprints(estate_id: str, months: Iterable[str]) -> Dict[str, Dict[str, str]]:
+    keys = {month: _fingerprints_key(estate_id, month) for month in months}
+    stored = json_storage.get_many(keys.values(), default=None)
+    return {month: stored[key] or {} for month, key in keys.items()}
+
+
+def _load_ids(estate_id: str, head: Dict, transaction_ids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+    """Load the id shards of transaction_ids, with shards not stored yet as empty."""
+    shards = {_id_shard(transaction_id) for transaction_id in transaction_ids}
+    existing = set(head.get("id_shards", ()))
+    keys = {shard: _ids_key(estate_id, shard) for shard in shards if shard in existing}
+    stored = json_storage.get_many(keys.values(), default=None)
+    return {shard: (stored[keys[shard]] or {}) if shard in keys else {} for shard in shards}
+
+
+def _load_rows(estate_id: str, months: Iterable[str]) -> Dict[str, List[Dict]]:
+    keys = {month: _month_key(estate_id, month) for month in months}
+    stored = json_storage.get_many(keys.values(), default=None)
+    return {month: decode_transactions(stored[key]) for month, key in keys.items()}
+
+
+def _candidate_ids(estate_id: str, transactions: List[Dict], fingerprints: List[str]) -> set:
+    """Ids the transactions may be stored under, whose id shards _merge needs."""
+    ids = {transaction["id"] for transaction in transactions if transaction.get("id")}
+    ids.update(_stable_id(estate_id, fingerprint) for fingerprint in fingerprints)
+    return ids
+
+
+def _merge(
+    estate_id: str,
+    head: Dict,
+    fingerprints_by_month: Dict[str, Dict[str, str]],
+    ids_by_shard: Dict[str, Dict[str, str]],
+    rows: Dict[str, List[Dict]],
+    transactions: List[Dict],
+    fingerprints: List[str],
+) -> Tuple[List[Dict], set, set]:
+    """Merge fingerprinted transactions into the head, the index shards and the rows of their months.
+
+    `rows` and `fingerprints_by_month` must hold every month of the
+    transactions, and `ids_by_shard` the shards of their candidate ids; other
+    shards are added as new. Returns the transactions as stored and the
+    months and id shards that changed.
+    """
+    by_id = {row["id"]: row for month in {_month(t) for t in transactions} for row in rows[month]}
+    merged = []
+    changed, changed_shards = set(), set()
+    for transaction, fingerprint in zip(transactions, fingerprints):
+        month = _month(transaction)
+        known = fingerprints_by_month.setdefault(month, {})
+        row = by_id.get(known.get(fingerprint))
+        if row is not None:
+            merged.append(row)
+            continue
+
+        row = dict(transaction)
+        if not row.get("id") or row["id"] in ids_by_shard.get(_id_shard(row["id"]), {}):
+            row["id"] = _stable_id(estate_id, fingerprint)
+        shard = _id_shard(row["id"])
+        rows[month].append(row)
+        by_id[row["id"]] = row
+        known[fingerprint] = row["id"]
+        ids_by_shard.setdefault(shard, {})[row["id"]] = month
+        merged.append(row)
+        changed.add(month)
+        changed_shards.add(shard)
+
+    for month in changed:
+        rows[month].sort(key=_sort_key, reverse=True)
+        head["months"][month] = len(rows[month])
+    if changed:
+        head["id_shards"] = sorted(set(head.get("id_shards", ())) | changed_shards)
+        head["version"] = head.get("version", 0) + 1
+    return merged, changed, changed_shards
+
+
+def find_known_transactions(estate_id: str, transactions: List[Dict], fingerprints: List[str]) -> Dict[int, Dict]:
+    """Return the stored transactions for fingerprints already in the ledger, by position.
+
+    Only the fingerprints and rows of the transactions' months are read.
+    """
+    head = get_ledger_head(estate_id)
+    months = {_month(t) for t in transactions} & set(head["months"])
+    if not months:
+        return {}
+    known = _load_fingerprints(estate_id, months)
+    ids = {}
+    for i, (transaction, fingerprint) in enumerate(zip(transactions, fingerprints)):
+        transaction_id = known.get(_month(transaction), {}).get(fingerprint)
+        if transaction_id is not None:
+            ids[i] = (_month(transaction), transaction_id)
+    if not ids:
+        return {}
+    rows = _load_rows(estate_id, {month for month, _ in ids.values()})
+    by_id = {row["id"]: row for month_rows in rows.values() for row in month_rows}
+    return {i: by_id[transaction_id] for i, (_, transaction_id) in ids.items() if transaction_id in by_id}
+
+
+def merge_transactions(
+    estate_id: str,
+    transactions: List[Dict],
+    fingerprints: Optional[List[str]] = None,
+) -> List[Dict]:
+    """Add the transactions of one upload to the estate's ledger.
+
+    Pass the fingerprints from `fingerprint_transactions` over the whole
+    upload when only part of it is merged, so occurrence indexes stay right.
+    Returns the transactions as stored, in the given order: new ones with
+    their assigned id and known ones as the row already in the ledger.
+    """
+    if fingerprints is None:
+        fingerprints = fingerprint_transactions(transactions)
+    months = {_month(t) for t in transactions}
+    with json_storage.transaction():
+        head = get_ledger_head(estate_id)
+        rows = _load_rows(estate_id, months)
+        known = _load_fingerprints(estate_id, months)
+        ids = _load_ids(estate_id, head, _candidate_ids(estate_id, transactions, fingerprints))
+
+        merged, changed, changed_shards = _merge(estate_id, head, known, ids, rows, transactions, fingerprints)
+        if changed:
+            documents = {_month_key(estate_id, month): encode_transactions(rows[month]) for month in changed}
+            documents.update({_fingerprints_key(estate_id, month): known[month] for month in changed})
+            documents.update({_ids_key(estate_id, shard): ids[shard] for shard in changed_shards})
+            documents[_head_key(estate_id)] = head
+            json_storage.put_many(documents)
+    return merged
+
+
+def get_ledger_transaction(estate_id: str, transaction_id: str) -> Optional[Dict]:
+    """Look a transaction up by id through its id shard, or return None."""
+    head = get_ledger_head(estate_id)
+    month = _load_ids(estate_id, head, [transaction_id])[_id_shard(transaction_id)].get(transaction_id)
+    if month is None:
+        return None
+    rows = decode_transactions(json_storage.get(_month_key(estate_id, month), default=None))
+    return next((row for row in rows if row["id"] == transaction_id), None)
+
+
+def _encode_cursor(transaction: Dict) -> str:
+    value = f"{transaction['date']}|{transaction['id']}"
+    return base64.urlsafe_b64encode(value.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Raises ValueError for cursors not made by _encode_cursor."""
+    try:
+        date, transaction_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    return date, transaction_id
+
+
+def read_transactions(
+    estate_id: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    category: Optional[str] = None,
+    is_subscription: Optional[bool] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """Read a page of transactions, newest first, with optional filters.
+
+    Dates are ISO dates and inclusive. Pass the returned cursor to get the
+    next page; it is None on the last page. Raises ValueError for a bad cursor.
+    """
+    after = _decode_cursor(cursor) if cursor else None
+    head = get_ledger_head(estate_id)
+
+    months = sorted(head["months"], reverse=True)
+    if after:
+        months = [m for m in months if m <= after[0][:7]]
+    if date_from:
+        months = [m for m in months if m >= date_from[:7]]
+    if date_to:
+        months = [m for m in months if m <= date_to[:7]]
+
+    page: List[Dict] = []
+    for month in months:
+        for row in decode_transactions(json_storage.get(_month_key(estate_id, month), default=None)):
+            if after and _sort_key(row) >= after:
+                continue
+            if date_from and row["date"] < date_from:
+                continue
+            if date_to and row["date"] > date_to:
+                continue
+            if category is not None and row.get("category") != category:
+                continue
+            if is_subscription is not None and bool(row.get("is_subscription")) != is_subscription:
+                continue
+            page.append(row)
+            if len(page) > limit:
+                return page[:limit], _encode_cursor(page[limit - 1])
+    return page, None
+
+
+def iter_ledger_months(estate_id: str, months: Iterable[str], batch: int = 12) -> Iterator[Tuple[str, List[Dict]]]:
+    """Yield (month, transactions) for the given months, loading `batch` months per read."""
+    months = list(months)
+    for start in range(0, len(months), batch):
+        rows = _load_rows(estate_id, months[start:start + batch])
+        yield from rows.items()
+
+
+def rebuild_ledger(estate_id: str) -> Dict:
+    """Rebuild an estate's ledger from its upload snapshots, oldest first, and return the head."""
+    previous = json_storage.get(_head_key(estate_id), default=None) or {}
+    head: Dict = {"months": {}, "id_shards": [], "version": previous.get("version", 0) + 1}
+    fingerprints: Dict[str, Dict[str, str]] = {}
+    ids: Dict[str, Dict[str, str]] = {}
+    rows: Dict[str, List[Dict]] = {}
+    keys = sorted(entry.name for entry in json_storage.list_prefix(_snapshot_prefix(estate_id)))
+    snapshots = json_storage.get_many(keys, default=None)
+    for key in keys:
+        transactions = decode_transactions((snapshots[key] or {}).get("transactions"))
+        for month in {_month(t) for t in transactions}:
+            rows.setdefault(month, [])
+        _merge(estate_id, head, fingerprints, ids, rows, transactions, fingerprint_transactions(transactions))
+
+    with json_storage.transaction():
+        # Months and id shards the old ledger had that are not in the snapshots
+        stale = [_month_key(estate_id, m) for m in previous.get("months", {}) if m not in rows]
+        stale += [_fingerprints_key(estate_id, m) for m in previous.get("months", {}) if m not in rows]
+        stale += [_ids_key(estate_id, shard) for shard in previous.get("id_shards", ()) if shard not in ids]
+        stale.append(_legacy_index_key(estate_id))
+        for key in stale:
+            try:
+                json_storage.delete(key)
+            except FileNotFoundError:
+                pass
+        documents = {_month_key(estate_id, month): encode_transactions(month_rows) for month, month_rows in rows.items()}
+        documents.update({_fingerprints_key(estate_id, month): shard for month, shard in fingerprints.items()})
+        documents.update({_ids_key(estate_id, shard): shard_ids for shard, shard_ids in ids.items()})
+        documents[_head_key(estate_id)] = head
+        json_storage.put_many(documents)
+    return head
+
+
+def delete_ledger(estate_id: str) -> None:
+    """Delete all ledger documents of an estate."""
+    head = json_storage.get(_head_key(estate_id), default=None)
+    if head is None:
+        return
+    keys = [_month_key(estate_id, month) for month in head["months"]]
+    keys += [_fingerprints_key(estate_id, month) for month in head["months"]]
+    keys += [_ids_key(estate_id, shard) for shard in head.get("id_shards", ())]
+    keys += [_legacy_index_key(estate_id), _head_key(estate_id)]
+    for key in keys:
+        try:
+            json_storage.delete(key)
+        except FileNotFoundError:
+            pass
+
+
+def rebuild_all_ledgers() -> int:
+    """Rebuild the ledger of every estate with upload snapshots, returning the number of estates."""
+    estate_ids = {entry.name.split("/")[1] for entry in json_storage.list_prefix("transactions/")}
+    for estate_id in sorted(estate_ids):
+        rebuild_ledger(estate_id)
+    json_storage.put(MIGRATION_KEY, {"migrated_at": datetime.now().isoformat()})
+    return len(estate_ids)
+
+
+__all__ = [
+    "fingerprint_transactions",
+    "find_known_transactions",
+    "merge_transactions",
+    "create_ledger",
+    "get_ledger_head",
+    "get_ledger_transaction",
+    "read_transactions",
+    "iter_ledger_months",
+    "rebuild_ledger",
+    "delete_ledger",
+    "rebuild_all_ledgers",
+]
+
+
+if __name__ == "__main__":
+    count = rebuild_all_ledgers()
+    print(f"Rebuilt transaction ledgers for {count} estates")
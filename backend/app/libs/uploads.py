@@ -0,0 +1,274 @@
+"""Streaming receipt of files uploaded as multipart/form-data.
+
+The request body is parsed as it arrives: file data is hashed incrementally
+and written to a spooled temporary file, which stays in memory up to
+UPLOAD_SPOOL_BYTES and moves to disk beyond that. Uploads larger than
+UPLOAD_MAX_BYTES are rejected with 413 as soon as the limit is passed, so
+the memory used per upload stays bounded whatever the size of the scan.
+
+    UPLOAD_MAX_BYTES         largest accepted file (default 20 MB)
+    UPLOAD_MAX_FILES         files accepted in one request (default 50)
+    UPLOAD_MAX_TOTAL_BYTES   largest accepted request with several files (default 100 MB)
+    UPLOAD_SPOOL_BYTES       file size kept in memory before spilling to disk (default 1 MB)
+
+Usage:
+
+    from app.libs.uploads import file_upload_openapi, receive_file
+
+    @router.post("/upload/{estate_id}", openapi_extra=file_upload_openapi("file"))
+    async def upload(estate_id: str, request: Request):
+        upload = await receive_file(request, "file")
+        with upload:
+            digest = upload.sha256
+            content = upload.read()
+"""
+
+import hashlib
+import os
+import shutil
+from tempfile import SpooledTemporaryFile
+from typing import List, Optional
+from fastapi import HTTPException, Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart before 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MAX_UPLOAD_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+MAX_UPLOAD_FILES = int(os.environ.get("UPLOAD_MAX_FILES", "50"))
+MAX_UPLOAD_TOTAL_BYTES = int(os.environ.get("UPLOAD_MAX_TOTAL_BYTES", str(100 * 1024 * 1024)))
+SPOOL_MAX_BYTES = int(os.environ.get("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+
+# Allowance for part headers and boundaries when checking Content-Length
+_MULTIPART_OVERHEAD = 64 * 1024
+
+
+def _too_large(max_bytes: int, what: str = "File") -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"{what} is larger than the maximum of {max_bytes / (1024 * 1024):.1f} MB",
+    )
+
+
+class ReceivedFile:
+    """An uploaded file in a spooled temporary file, with its size and SHA-256."""
+
+    def __init__(self, filename: Optional[str], content_type: Optional[str]):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.file = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self._hash = hashlib.sha256()
+        self._digest: Optional[str] = None
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._digest or self._hash.hexdigest()
+
+    def read(self) -> bytes:
+        """Read the whole file, for APIs that need the content in memory."""
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def save(self, directory: str) -> dict:
+        """Copy the file into directory, returning what `load` needs to open it again."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.sha256)
+        self.file.seek(0)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(self.file, out)
+        return {
+            "path": path,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "size": self.size,
+            "sha256": self.sha256,
+        }
+
+    @classmethod
+    def load(cls, saved: dict) -> "ReceivedFile":
+        """Open a file stored with `save`."""
+        received = cls(saved["filename"], saved["content_type"])
+        received.file.close()
+        received.file = open(saved["path"], "rb")
+        received.size = saved["size"]
+        received._digest = saved["sha256"]
+        return received
+
+    def __enter__(self) -> "ReceivedFile":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class _FilePartCollector:
+    """python-multipart callbacks that keep the files of one field."""
+
+    def __init__(self, field: str, max_bytes: int, max_files: int, max_total_bytes: int):
+        self.field = field
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_total_bytes = max_total_bytes
+        self.received: List[ReceivedFile] = []
+        self.total_size = 0
+        self._current: Optional[ReceivedFile] = None
+        self._headers = {}
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_part_begin(self) -> None:
+        self._current = None
+        self._headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if name != self.field or b"filename" not in options:
+            # Other fields and parts are skipped without storing them
+            return
+        if len(self.received) >= self.max_files:
+            raise HTTPException(status_code=413, detail=f"Too many files, the maximum is {self.max_files}")
+        content_type = self._headers.get(b"content-type")
+        self._current = ReceivedFile(
+            filename=options[b"filename"].decode("utf-8", "replace"),
+            content_type=content_type.decode("latin-1") if content_type else None,
+        )
+        self.received.append(self._current)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._current is None:
+            return
+        size = end - start
+        if self._current.size + size > self.max_bytes:
+            raise _too_large(self.max_bytes)
+        if self.total_size + size > self.max_total_bytes:
+            raise _too_large(self.max_total_bytes, "Upload")
+        self._current.write(data[start:end])
+        self.total_size += size
+
+    def on_part_end(self) -> None:
+        self._current = None
+
+    def close(self) -> None:
+        for received in self.received:
+            received.close()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+
+async def receive_files(
+    request: Request,
+    field: str = "files",
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    max_files: int = MAX_UPLOAD_FILES,
+    max_total_bytes: int = MAX_UPLOAD_TOTAL_BYTES,
+) -> List[ReceivedFile]:
+    """Stream all files in `field` of a multipart/form-data request into temporary files.
+
+    Raises 400 for requests that are not multipart or have no files in the
+    field, and 413 for a file over max_bytes, more than max_files files or
+    more than max_total_bytes in total. The caller closes the returned files.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_total_bytes + _MULTIPART_OVERHEAD:
+        raise _too_large(max_total_bytes, "File" if max_files == 1 else "Upload")
+
+    collector = _FilePartCollector(field, max_bytes, max_files, max_total_bytes)
+    parser = MultipartParser(params[b"boundary"], collector.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except HTTPException:
+        collector.close()
+        raise
+    except Exception as e:
+        collector.close()
+        raise HTTPException(status_code=400, detail=f"Invalid multipart upload: {e}") from e
+
+    files = []
+    for received in collector.received:
+        if received.size > 0:
+            files.append(received)
+        else:
+            # Empty parts, such as a file input left empty
+            received.close()
+    if not files:
+        raise HTTPException(status_code=400, detail=f"No file uploaded in field '{field}'")
+    return files
+
+
+async def receive_file(request: Request, field: str = "file", max_bytes: int = MAX_UPLOAD_BYTES) -> ReceivedFile:
+    """Stream the file in `field` of a multipart/form-data request into a temporary file.
+
+    Raises 400 for requests that are not multipart or lack the file, and 413
+    for files over max_bytes. The caller closes the returned file.
+    """
+    files = await receive_files(request, field, max_bytes=max_bytes, max_files=1, max_total_bytes=max_bytes)
+    return files[0]
+
+
+def file_upload_openapi(field: str = "file", multiple: bool = False) -> dict:
+    """OpenAPI request body for endpoints that read the upload with `receive_file(s)`."""
+    schema = {"type": "string", "format": "binary"}
+    if multiple:
+        schema = {"type": "array", "items": schema}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {field: schema},
+                        "required": [field],
+                    }
+                }
+            },
+        }
+    }
+
+
+__all__ = [
+    "MAX_UPLOAD_BYTES",
+    "MAX_UPLOAD_FILES",
+    "ReceivedFile",
+    "receive_files",
+    "receive_file",
+    "file_upload_openapi",
+]
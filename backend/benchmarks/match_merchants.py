@@ -0,0 +1,95 @@
+"""Benchmark of the merchant dictionary matcher against the keyword loop it replaced.
+
+The loop checks every keyword of every category with a substring test, so its
+cost grows with the dictionary. Both are run on the shipped dictionary and on
+dictionaries padded with generated merchants, reporting recipients per second.
+
+Run from the backend directory:
+
+    python -m benchmarks.match_merchants [--recipients 20000] [--sizes 100,1000,5000]
+"""
+
+import argparse
+import json
+import random
+import string
+import time
+from typing import Dict, List
+
+from app.libs.merchant_dictionary import DICTIONARY_FILE, MerchantMatcher
+
+RECIPIENTS = [
+    "VISA VARE 4925 NETFLIX.COM", "KIWI 551 MAJORSTUEN OSLO", "REMA 1000 GRÜNERLØKKA",
+    "TELENOR NORGE AS", "Fjordkraft AS", "Overføring fra SPAREKONTO", "VIPPS *OLA NORDMANN",
+    "Ruter Billett", "NARVESEN OSLO S", "SATS NORGE AS", "ELKJØP STORO", "Spotify AB",
+]
+
+
+def loop_categorize(recipient: str, categories: Dict[str, List[str]], subscription_keywords: List[str]) -> tuple:
+    """The per-category, per-keyword loop used before the matcher."""
+    recipient_lower = recipient.lower()
+    for category, keywords in categories.items():
+        if any(keyword in recipient_lower for keyword in keywords):
+            break
+    else:
+        category = "other"
+    return category, any(keyword in recipient_lower for keyword in subscription_keywords)
+
+
+def padded_merchants(merchants: List[dict], size: int, rng: random.Random) -> List[dict]:
+    merchants = list(merchants)
+    while sum(len(m["keywords"]) for m in merchants) < size:
+        name = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 12)))
+        merchants.append({"keywords": [name], "category": rng.choice(["groceries", "transport", "other"])})
+    return merchants
+
+
+def as_loop_dictionary(merchants: List[dict]) -> tuple:
+    categories: Dict[str, List[str]] = {}
+    subscription_keywords = []
+    for merchant in merchants:
+        categories.setdefault(merchant["category"], []).extend(merchant["keywords"])
+        if merchant.get("subscription"):
+            subscription_keywords.extend(merchant["keywords"])
+    return categories, subscription_keywords
+
+
+def rate(count: int, elapsed: float) -> str:
+    return f"{count / elapsed:>12,.0f}/s"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=20000)
+    parser.add_argument("--sizes", default="100,1000,5000")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with open(DICTIONARY_FILE, encoding="utf-8") as f:
+        shipped = json.load(f)["merchants"]
+    recipients = [rng.choice(RECIPIENTS) for _ in range(args.recipients)]
+
+    print(f"{'keywords':>8} {'loop':>14} {'matcher':>14} {'compile':>9}")
+    for size in [0] + [int(s) for s in args.sizes.split(",")]:
+        merchants = padded_merchants(shipped, size, rng)
+        categories, subscription_keywords = as_loop_dictionary(merchants)
+
+        started = time.perf_counter()
+        matcher = MerchantMatcher(merchants)
+        compiled = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for recipient in recipients:
+            loop_categorize(recipient, categories, subscription_keywords)
+        loop = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for recipient in recipients:
+            matcher.match(recipient)
+        matched = time.perf_counter() - started
+
+        print(f"{len(matcher):>8} {rate(len(recipients), loop)} {rate(len(recipients), matched)} {compiled * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
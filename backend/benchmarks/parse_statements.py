@@ -0,0 +1,195 @@
+"""Benchmark of the statement parsers on a synthetic corpus with known entries.
+
+Generates statements in every supported layout, including entries split over
+two lines by OCR and amounts with thousands separators, and reports lines per
+second and recall (entries found with the right date, amount and recipient)
+for the parser engine and the single regex it replaced.
+
+Run from the backend directory:
+
+    python -m benchmarks.parse_statements [--statements 200] [--entries 60]
+"""
+
+import argparse
+import random
+import re
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from app.libs.statement_parsers import parse_statement
+
+MERCHANTS = [
+    "KIWI MAJORSTUEN", "REMA 1000 GRÜNERLØKKA", "COOP EXTRA SANDVIKA", "VINMONOPOLET",
+    "NETFLIX.COM", "SPOTIFY AB", "TELENOR NORGE AS", "FJORDKRAFT AS", "SATS NORGE",
+    "APOTEK 1 STORO", "NARVESEN OSLO S", "CIRCLE K RING 3", "IF SKADEFORSIKRING",
+    "OSLO KOMMUNE EIENDOMSSKATT", "VIPPS *OLA NORDMANN", "ELKJØP STORO",
+]
+CREDITS = ["Innbetaling NAV PENSJON", "Overføring fra SPAREKONTO", "Renter"]
+
+LEGACY_PATTERN = re.compile(r'(\d{2}\.\d{2}\.\d{4})\s+([^\d-]+)\s+(-?\d+[,.]\d{2})\s*(?:NOK)?')
+
+
+def legacy_parse(text: str) -> List[dict]:
+    """The single regex used before the parser engine."""
+    transactions = []
+    for match in LEGACY_PATTERN.finditer(text):
+        day, month, year = match.group(1).split(".")
+        transactions.append({
+            "date": f"{year}-{month}-{day}",
+            "recipient": match.group(2).strip(),
+            "amount": float(match.group(3).replace(",", ".")),
+        })
+    return transactions
+
+
+def format_amount(amount: float, thousands: str = " ") -> str:
+    whole, cents = f"{abs(amount):.2f}".split(".")
+    groups = []
+    while len(whole) > 3:
+        groups.insert(0, whole[-3:])
+        whole = whole[:-3]
+    groups.insert(0, whole)
+    return f"{thousands.join(groups)},{cents}"
+
+
+def _entries(rng: random.Random, count: int, start: date) -> List[Tuple[date, str, float]]:
+    entries = []
+    day = start
+    for _ in range(count):
+        day += timedelta(days=rng.randint(0, 2))
+        if rng.random() < 0.1:
+            entries.append((day, rng.choice(CREDITS), round(rng.uniform(500, 25000), 2)))
+        else:
+            amount = rng.uniform(1000, 15000) if rng.random() < 0.15 else rng.uniform(19, 999)
+            entries.append((day, rng.choice(MERCHANTS), -round(amount, 2)))
+    return entries
+
+
+def _dnb(rng, entries, year):
+    lines = ["DNB Bank ASA", "Kontoutskrift", "Dato Forklaring Rentedato Ut fra konto Inn på konto"]
+    for day, text, amount in entries:
+        prefix = "" if amount > 0 else "Varekjøp "
+        value = f"{day:%d.%m}"
+        amount_text = format_amount(amount)
+        if rng.random() < 0.1:
+            lines += [f"{day:%d.%m} {prefix}{text}", f"Dato {day:%d.%m} {value} {amount_text}"]
+        else:
+            lines.append(f"{day:%d.%m} {prefix}{text} Dato {day:%d.%m} {value} {amount_text}")
+    return lines
+
+
+def _nordea(rng, entries, year):
+    lines = ["Nordea", "Kontoutskrift", "Bokføringsdato Beskrivelse Valuteringsdato Beløp"]
+    for day, text, amount in entries:
+        sign = "-" if amount < 0 else ""
+        lines.append(f"{day:%d.%m.%Y} {text} {day:%d.%m.%Y} {sign}{format_amount(amount, '.')}")
+    return lines
+
+
+def _sparebank1(rng, entries, year):
+    lines = ["SpareBank 1 Østlandet", "Dato Beskrivelse Rentedato Inn på konto Ut av konto"]
+    for day, text, amount in entries:
+        prefix = "" if amount > 0 else f"VISA VARE {rng.randint(1000, 9999)} "
+        line = f"{day:%d.%m.%Y} {prefix}{text} {day:%d.%m.%Y} {format_amount(amount)}"
+        if rng.random() < 0.1:
+            head, _, tail = line.rpartition(f" {day:%d.%m.%Y} ")
+            lines += [head, f"{day:%d.%m.%Y} {tail}"]
+        else:
+            lines.append(line)
+    return lines
+
+
+def _handelsbanken(rng, entries, year):
+    lines = ["Handelsbanken", "Reskontrodato Transaksjonsdato Tekst Beløp Saldo"]
+    balance = 50000.0
+    for day, text, amount in entries:
+        balance += amount
+        sign = "-" if amount < 0 else ""
+        booked = day + timedelta(days=1)
+        lines.append(f"{booked:%d.%m.%Y} {day:%d.%m.%Y} {text} {sign}{format_amount(amount)} {format_amount(balance)}")
+    return lines
+
+
+def _generic(rng, entries, year):
+    lines = ["Kontoutskrift", "Side 1 av 1"]
+    for day, text, amount in entries:
+        sign = "-" if amount < 0 else ""
+        lines.append(f"{day:%d.%m.%Y} {text} {sign}{format_amount(amount)} NOK")
+    return lines
+
+
+LAYOUTS: Dict[str, Callable] = {
+    "dnb": _dnb,
+    "nordea": _nordea,
+    "sparebank1": _sparebank1,
+    "handelsbanken": _handelsbanken,
+    "generic": _generic,
+}
+
+
+def build_corpus(statements: int, entries: int, seed: int = 1) -> List[Tuple[str, str, List[Tuple[str, float]]]]:
+    """Return (layout, text, expected (date, amount) pairs) for each statement."""
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(statements):
+        layout = list(LAYOUTS)[index % len(LAYOUTS)]
+        year = rng.choice([2022, 2023, 2024])
+        truth = _entries(rng, entries, date(year, rng.randint(1, 6), 1))
+        lines = LAYOUTS[layout](rng, truth, year)
+        lines.insert(1, f"Periode 01.01.{year} - 31.12.{year}")
+        corpus.append((layout, "\n".join(lines), truth))
+    return corpus
+
+
+def recall(found: List[dict], truth: List[Tuple[date, str, float]]) -> Tuple[int, int]:
+    """Count the expected entries found with the right date, amount and recipient."""
+    remaining = {}
+    for transaction in found:
+        key = (transaction["date"], round(transaction["amount"], 2))
+        remaining.setdefault(key, []).append(transaction["recipient"].upper())
+    hits = 0
+    for day, text, amount in truth:
+        recipients = remaining.get((day.isoformat(), amount), [])
+        for i, recipient in enumerate(recipients):
+            if recipient.endswith(text.upper()) or text.upper().endswith(recipient):
+                del recipients[i]
+                hits += 1
+                break
+    return hits, len(truth)
+
+
+def run(name: str, parse: Callable[[str], List[dict]], corpus) -> None:
+    lines = sum(text.count("\n") + 1 for _, text, _ in corpus)
+    started = time.perf_counter()
+    results = [parse(text) for _, text, _ in corpus]
+    elapsed = time.perf_counter() - started
+
+    by_layout: Dict[str, List[int]] = {}
+    for (layout, _, truth), found in zip(corpus, results):
+        hits, total = recall(found, truth)
+        counts = by_layout.setdefault(layout, [0, 0])
+        counts[0] += hits
+        counts[1] += total
+    hits = sum(h for h, _ in by_layout.values())
+    total = sum(t for _, t in by_layout.values())
+
+    print(f"{name}: {lines / elapsed:,.0f} lines/s, recall {hits / total:.1%}")
+    for layout, (layout_hits, layout_total) in by_layout.items():
+        print(f"  {layout:<14} {layout_hits / layout_total:.1%}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--statements", type=int, default=200)
+    parser.add_argument("--entries", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.statements, args.entries, args.seed)
+    run("legacy regex", legacy_parse, corpus)
+    run("parser engine", parse_statement, corpus)
+
+
+if __name__ == "__main__":
+    main()
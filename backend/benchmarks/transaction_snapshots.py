@@ -0,0 +1,81 @@
+"""Benchmark of the compact transaction encoding against plain JSON lists.
+
+Generates ledger months of transactions shaped like classified uploads and
+reports the stored size, the time to load a month (parsing the stored JSON
+and decoding it) and the memory of the loaded transactions for both.
+
+Run from the backend directory:
+
+    python -m benchmarks.transaction_snapshots [--sizes 100,1000,5000]
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from typing import Dict, List
+
+from app.libs.transaction_codec import decode_transactions, encode_transactions
+
+RECIPIENTS = [
+    ("VISA VARE 4925 NETFLIX.COM", "streaming", "monthly"), ("KIWI 551 MAJORSTUEN OSLO", "groceries", None),
+    ("REMA 1000 GRÜNERLØKKA", "groceries", None), ("TELENOR NORGE AS", "telecom", "monthly"),
+    ("Fjordkraft AS", "utilities", "monthly"), ("Ruter Billett", "transport", None),
+    ("VIPPS *OLA NORDMANN", "other", None), ("NARVESEN OSLO S", "other", None),
+]
+
+
+def month_of_transactions(size: int, rng: random.Random) -> List[Dict]:
+    transactions = []
+    for _ in range(size):
+        recipient, category, frequency = rng.choice(RECIPIENTS)
+        transactions.append({
+            "id": f"tx_{rng.getrandbits(80):020x}",
+            "date": f"2024-03-{rng.randint(1, 31):02d}",
+            "recipient": recipient,
+            "amount": -round(rng.uniform(10, 2000), 2),
+            "category": category,
+            "is_subscription": frequency is not None,
+            "subscription_frequency": frequency,
+            "contact_info": {"email": None, "phone": None, "website": None} if frequency else None,
+        })
+    return transactions
+
+
+def load_time(stored: str, repeat: int = 20) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        decode_transactions(json.loads(stored))
+    return (time.perf_counter() - started) / repeat
+
+
+def loaded_bytes(stored: str) -> int:
+    tracemalloc.start()
+    transactions = decode_transactions(json.loads(stored))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del transactions
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,5000")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    print(f"{'rows':>6} {'format':>8} {'stored':>10} {'load':>9} {'memory':>10}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        transactions = month_of_transactions(size, rng)
+        for name, encoding in (("json", "json"), ("compact", "columns")):
+            stored = json.dumps(encode_transactions(transactions, encoding=encoding))
+            assert decode_transactions(json.loads(stored)) == transactions
+            print(
+                f"{size:>6} {name:>8} {len(stored):>10,} {load_time(stored) * 1000:>7.2f}ms"
+                f" {loaded_bytes(stored):>10,}"
+            )
+
+
+if __name__ == "__main__":
+    main()
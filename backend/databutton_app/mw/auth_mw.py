@@ -1,4 +1,14 @@
+import asyncio
 import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
 from http import HTTPStatus
 from typing import Annotated, Callable
 import jwt
@@ -8,6 +18,7 @@ from jwt import PyJWKClient
 from pydantic import BaseModel
 from starlette.requests import Request
 
+logger = logging.getLogger(__name__)
 
 class AuthConfig(BaseModel):
     jwks_url: str
@@ -49,6 +60,11 @@ AuditLogDep = Annotated[Callable[[str], None] | None, Depends(get_audit_log)]
 def get_authorized_user(
     request: HTTPConnection,
 ) -> User:
+    # The same request may ask for the user from several dependencies
+    user = getattr(request.state, "authorized_user", None)
+    if user is not None:
+        return user
+
     auth_config = get_auth_config(request)
 
     try:
@@ -60,6 +76,7 @@ def get_authorized_user(
             raise ValueError("Unexpected request type")
 
         if user is not None:
+            request.state.authorized_user = user
             return user
         print("Request authentication returned no user")
     except Exception as e:
@@ -81,9 +98,145 @@ def get_jwks_client(url: str):
     return PyJWKClient(url, cache_keys=True)
 
 
+class JwksKeyStore:
+    """Signing keys from a JWKS url or local file, kept in memory.
+
+    `start()` loads the keys and keeps refreshing them in a background task
+    before the source's Cache-Control max-age runs out, so verifying a token
+    never fetches keys on the request path. A token with an unknown key id
+    wakes the refresh task instead of fetching inline. The task is started
+    even when the first load fails, and retries with a backoff from
+    retry_seconds up to the refresh interval.
+    """
+
+    # Refresh interval when the source gives no max-age, and bounds for it
+    default_refresh_seconds = 3600
+    min_refresh_seconds = 60
+    retry_seconds = 30
+
+    def __init__(self, url: str):
+        self.url = url
+        self.keys: dict[str, jwt.PyJWK] = {}
+        self.refresh_in = self.default_refresh_seconds
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._last_refresh = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.keys)
+
+    def _read_source(self) -> tuple[dict, int | None]:
+        path = self.url.removeprefix("file://")
+        if self.url.startswith("file://") or os.path.exists(path):
+            with open(path) as f:
+                return json.load(f), None
+
+        with urllib.request.urlopen(self.url, timeout=10) as response:
+            data = json.load(response)
+            cache_control = response.headers.get("Cache-Control", "")
+        match = re.search(r"max-age=(\d+)", cache_control)
+        return data, int(match.group(1)) if match else None
+
+    def refresh(self) -> None:
+        """Fetch the keys (blocking) and replace the current ones."""
+        data, max_age = self._read_source()
+        keys = {k.key_id: k for k in jwt.PyJWKSet.from_dict(data).keys if k.key_id}
+        self.keys = keys
+        self._last_refresh = time.monotonic()
+        if max_age is None:
+            self.refresh_in = self.default_refresh_seconds
+        else:
+            # Refresh well before the keys are due to change
+            self.refresh_in = max(self.min_refresh_seconds, int(max_age * 0.8))
+        print(f"Loaded {len(keys)} signing keys from {self.url}")
+
+    async def start(self) -> bool:
+        """Load the keys and start the refresh task. Returns whether the keys were loaded."""
+        self._loop = asyncio.get_running_loop()
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+        try:
+            await asyncio.to_thread(self.refresh)
+            delay = self.refresh_in
+        except Exception as e:
+            # Requests fall back to fetching the keys lazily until the task loads them
+            logger.warning("Failed to load signing keys from %s: %s", self.url, e)
+            delay = self.retry_seconds
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop(delay))
+        return self.loaded
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self, delay: float) -> None:
+        failures = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.refresh)
+                delay = self.refresh_in
+                failures = 0
+            except Exception as e:
+                # Keep serving the current keys and try again soon, backing off
+                failures += 1
+                delay = min(self.retry_seconds * 2 ** (failures - 1), self.default_refresh_seconds)
+                logger.warning("Failed to refresh signing keys from %s, retrying in %ss: %s", self.url, delay, e)
+
+    def request_refresh(self) -> None:
+        """Ask the background task to refresh now, at most once per min_refresh_seconds."""
+        if self._loop is None or self._wakeup is None:
+            return
+        if time.monotonic() - self._last_refresh < self.min_refresh_seconds:
+            return
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def get_signing_key(self, token: str) -> jwt.PyJWK:
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.keys.get(kid)
+        if key is None:
+            self.request_refresh()
+            raise ValueError(f"Unknown signing key id: {kid}")
+        return key
+
+
+jwks_stores: dict[str, JwksKeyStore] = {}
+
+
+async def start_jwks_refresh(url: str) -> JwksKeyStore:
+    """Load the keys for url and keep them refreshed until stop_jwks_refresh is called."""
+    store = jwks_stores.get(url)
+    if store is None:
+        store = jwks_stores[url] = JwksKeyStore(url)
+    await store.start()
+    return store
+
+
+async def stop_jwks_refresh() -> None:
+    for store in jwks_stores.values():
+        await store.stop()
+
+
 def get_signing_key(url: str, token: str) -> tuple[str, str]:
-    client = get_jwks_client(url)
-    signing_key = client.get_signing_key_from_jwt(token)
+    store = jwks_stores.get(url)
+    if store is not None and store.loaded:
+        signing_key = store.get_signing_key(token)
+    else:
+        # Keys were not preloaded at startup, fetch them lazily
+        client = get_jwks_client(url)
+        signing_key = client.get_signing_key_from_jwt(token)
     key = signing_key.key
     alg = signing_key.algorithm_name
     if alg != "RS256":
@@ -134,10 +287,70 @@ def authorize_request(
     return authorize_token(token, auth_config)
 
 
+class VerifiedTokenCache:
+    """Bounded LRU cache of verified tokens, keyed by a hash of the token.
+
+    Entries are dropped when the token expires, so a cached user is never
+    returned for a token that would fail verification because of its age.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[User, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str, auth_config: AuthConfig) -> str:
+        material = f"{auth_config.audience}\n{auth_config.jwks_url}\n{token}"
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> User | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, key: str, user: User, expires_at: float) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+verified_token_cache = VerifiedTokenCache(
+    max_entries=int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000"))
+)
+
+
 def authorize_token(
     token: str,
     auth_config: AuthConfig,
 ) -> User | None:
+    cache_key = VerifiedTokenCache.key(token, auth_config)
+    user = verified_token_cache.get(cache_key)
+    if user is not None:
+        return user
+
+    user, expires_at = verify_token(token, auth_config)
+    if user is not None and expires_at is not None:
+        verified_token_cache.set(cache_key, user, expires_at)
+    return user
+
+
+def verify_token(
+    token: str,
+    auth_config: AuthConfig,
+) -> tuple[User | None, float | None]:
+    """Verify the token signature and claims, returning the user and token expiry."""
     # Audience and jwks url to get signing key from based on the users config
     jwks_urls = [(auth_config.audience, auth_config.jwks_url)]
 
@@ -163,7 +376,7 @@ def authorize_token(
     try:
         user = User.model_validate(payload)
         print(f"User {user.sub} authenticated")
-        return user
+        return user, payload.get("exp")
     except Exception as e:
         print(f"Failed to parse token payload {e}")
-        return None
+        return None, None
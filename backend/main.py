@@ -1,12 +1,18 @@
 import os
 import pathlib
 import json
+import contextlib
+import logging
 import dotenv
 from fastapi import FastAPI, APIRouter, Depends
 
 dotenv.load_dotenv()
 
-from databutton_app.mw.auth_mw import AuthConfig, get_authorized_user
+from databutton_app.mw.auth_mw import AuthConfig, get_authorized_user, start_jwks_refresh, stop_jwks_refresh
+from app.libs.ai_clients import close_clients
+from app.libs.jobs import stop_job_workers
+
+logger = logging.getLogger(__name__)
 
 
 def get_router_config() -> dict:
@@ -74,9 +80,24 @@ def get_firebase_config() -> dict | None:
     return None
 
 
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the token signing keys before serving requests and keep them refreshed."""
+    auth_config = app.state.auth_config
+    if auth_config is not None:
+        # Keeps retrying in the background if the keys cannot be loaded now
+        store = await start_jwks_refresh(auth_config.jwks_url)
+        if not store.loaded:
+            logger.warning("Signing keys not loaded at startup, requests fetch them lazily until they are")
+    yield
+    await stop_jwks_refresh()
+    await stop_job_workers()
+    await close_clients()
+
+
 def create_app() -> FastAPI:
     """Create the app. This is called by uvicorn with the factory option to construct the app object."""
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
     app.include_router(import_api_routers())
 
     for route in app.routes:
@@ -92,7 +113,11 @@ def create_app() -> FastAPI:
     else:
         print("Firebase config found")
         auth_config = {
-            "jwks_url": "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com",
+            # AUTH_JWKS_URL may point to a local JWKS file or url, e.g. for offline testing
+            "jwks_url": os.environ.get(
+                "AUTH_JWKS_URL",
+                "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com",
+            ),
             "audience": firebase_config["projectId"],
             "header": "authorization",
         }
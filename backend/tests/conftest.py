@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# The app's storage is chosen when app.libs.storage is imported, so tests use
+# a throwaway SQLite database instead of Databutton storage
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("STORAGE_SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "storage.db"))
@@ -0,0 +1,59 @@
+import uuid
+
+from app.libs import comment_log
+from app.libs.comment_log import SEGMENT_SIZE, append_comment, read_comments
+from app.libs.storage import json_storage
+
+
+def _estate_with_comments(count: int) -> str:
+    estate_id = f"estate-{uuid.uuid4().hex[:8]}"
+    for i in range(count):
+        append_comment(estate_id, {"id": str(i), "task_id": "t1" if i % 3 == 0 else None})
+    return estate_id
+
+
+def _read_all(estate_id: str, task_id: str, limit: int) -> list:
+    pages, cursor = [], None
+    while True:
+        page, cursor = read_comments(estate_id, task_id=task_id, limit=limit, cursor=cursor)
+        pages[:0] = page
+        if cursor is None:
+            return pages
+
+
+def test_task_pages_follow_the_task_comments():
+    estate_id = _estate_with_comments(2 * SEGMENT_SIZE + 50)
+    expected = [str(i) for i in range(2 * SEGMENT_SIZE + 50) if i % 3 == 0]
+
+    latest, cursor = read_comments(estate_id, task_id="t1", limit=10)
+    assert [c["id"] for c in latest] == expected[-10:]
+    assert cursor is not None
+    assert [c["id"] for c in _read_all(estate_id, "t1", limit=7)] == expected
+
+
+def test_append_only_touches_the_last_task_index_segment(monkeypatch):
+    estate_id = _estate_with_comments(3 * SEGMENT_SIZE)
+    written = []
+    put_many = json_storage.put_many
+    monkeypatch.setattr(json_storage, "put_many", lambda items: (written.extend(items), put_many(items))[1])
+
+    append_comment(estate_id, {"id": "new", "task_id": "t1"})
+
+    assert len(written) == 3
+    assert read_comments(estate_id, task_id="t1", limit=1)[0][0]["id"] == "new"
+
+
+def test_single_task_index_is_split_into_segments():
+    estate_id = _estate_with_comments(SEGMENT_SIZE + 10)
+    head = json_storage.get(f"comments_{estate_id}.head")
+    seqs = [i for i in range(SEGMENT_SIZE + 10) if i % 3 == 0]
+    # The layout before the task index was segmented
+    for segment in head["tasks"]["t1"]:
+        json_storage.delete(f"comments_{estate_id}.task.t1.{segment}")
+    json_storage.put(f"comments_{estate_id}.task.t1", seqs)
+    json_storage.put(f"comments_{estate_id}.head", {**head, "tasks": ["t1"]})
+
+    assert [c["id"] for c in read_comments(estate_id, task_id="t1")[0]] == [str(seq) for seq in seqs]
+    assert json_storage.get(f"comments_{estate_id}.task.t1", default=None) is None
+    comment_log.delete_comment_log(estate_id)
+    assert json_storage.get(f"comments_{estate_id}.head", default=None) is None
@@ -0,0 +1,32 @@
+import asyncio
+
+from app.libs import jobs
+from app.libs.storage import json_storage
+
+
+def test_job_progress_is_watched_in_memory_and_stored_when_finished(monkeypatch):
+    monkeypatch.setattr(jobs, "PROGRESS_SECONDS", 0.01)
+
+    async def handler(job: jobs.JobContext):
+        for done in range(3):
+            job.progress("working", done=done, total=3)
+            await asyncio.sleep(0)
+        return {"count": 3}
+
+    jobs.register_job_handler("test-progress", handler)
+
+    async def scenario():
+        job = await jobs.enqueue_job("test-progress", {"secret": 1}, user_id="u1")
+        seen = [update async for update in jobs.watch_job(job["id"], heartbeat=1.0) if update]
+        await jobs.stop_job_workers()
+        return job["id"], seen
+
+    job_id, seen = asyncio.run(scenario())
+
+    assert seen[-1]["status"] == jobs.SUCCEEDED
+    assert any(update["stage"] == "working" for update in seen)
+    stored = json_storage.get(f"jobs_{job_id}")
+    assert stored["status"] == jobs.SUCCEEDED
+    assert stored["result"] == {"count": 3}
+    assert "payload" not in stored
+    assert jobs.get_job(job_id)["status"] == jobs.SUCCEEDED
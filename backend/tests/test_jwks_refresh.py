@@ -0,0 +1,29 @@
+import asyncio
+import json
+
+from databutton_app.mw.auth_mw import JwksKeyStore
+
+JWKS = {"keys": [{"kty": "oct", "kid": "key-1", "k": "c2VjcmV0LWtleS1mb3ItdGVzdHM"}]}
+
+
+def test_refresh_loop_recovers_when_first_load_fails(tmp_path):
+    path = tmp_path / "jwks.json"
+
+    async def scenario():
+        store = JwksKeyStore(f"file://{path}")
+        store.retry_seconds = 0.05
+        # The file does not exist yet, so the first load fails
+        assert await store.start() is False
+        assert store._task is not None
+        path.write_text(json.dumps(JWKS))
+        try:
+            for _ in range(100):
+                if store.loaded:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            await store.stop()
+        return store
+
+    store = asyncio.run(scenario())
+    assert set(store.keys) == {"key-1"}
@@ -0,0 +1,14 @@
+from app.libs.merchant_cache import normalize_recipient
+
+
+def test_stores_of_a_dictionary_merchant_share_a_key():
+    keys = {normalize_recipient(r) for r in ("KIWI 505 MAJORSTUEN", "KIWI 123 GRÜNERLØKKA OSLO", "Kiwi Storo")}
+
+    assert keys == {"kiwi"}
+
+
+def test_unknown_merchant_keeps_the_brand_before_the_store_number():
+    keys = {normalize_recipient(r) for r in ("BUNNPRIS 7012 LADE TRONDHEIM", "Varekjøp BUNNPRIS 7020 MOHOLT")}
+
+    assert keys == {"bunnpris"}
+    assert normalize_recipient("Fjellheim Treningssenter AS Ski") == "fjellheim treningssenter"
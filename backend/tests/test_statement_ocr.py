@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from app.libs import statement_ocr
+from app.libs.uploads import ReceivedFile
+
+
+def _image(content: bytes) -> ReceivedFile:
+    file = ReceivedFile("page.png", "image/png")
+    file.write(content)
+    return file
+
+
+def test_failed_page_request_cancels_and_awaits_the_others(monkeypatch):
+    cancelled = []
+
+    async def annotate(images):
+        if images[0][0] == 0:
+            raise ValueError("Page 1: bad image")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(images[0][0])
+            raise
+        return [(page, "text") for page, _ in images]
+
+    monkeypatch.setattr(statement_ocr, "_annotate_images", annotate)
+    files = [_image(f"ocr-cancel-{i}".encode()) for i in range(statement_ocr.IMAGES_PER_REQUEST + 1)]
+
+    async def scenario():
+        pages = statement_ocr.ocr_statement(files)
+        with pytest.raises(ValueError):
+            async for _ in pages:
+                pass
+        return cancelled[:]
+
+    assert asyncio.run(scenario()) == [statement_ocr.IMAGES_PER_REQUEST]
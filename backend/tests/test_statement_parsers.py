@@ -0,0 +1,28 @@
+from app.libs.statement_parsers import get_parser, parse_statement
+
+
+def test_generic_layout_with_balance_column():
+    transactions = parse_statement("01.02.2024 Kiwi 505 -99,90 5 000,00", bank="generic")
+
+    assert transactions == [{"date": "2024-02-01", "recipient": "Kiwi 505", "amount": -99.9}]
+
+
+def test_generic_layout_without_balance_column():
+    transactions = parse_statement("02.02.2024 Rema 1000 -1 234,50 NOK", bank="generic")
+
+    assert transactions == [{"date": "2024-02-02", "recipient": "Rema 1000", "amount": -1234.5}]
+
+
+def test_parse_skips_entries_with_unknown_columns():
+    # A value date left in the text is a column the generic layout does not know
+    lines = ["01.02.2024 Kiwi 01.02.2024 -99,90 NOK", "02.02.2024 Rema 1000 -20,00"]
+
+    transactions = list(get_parser("generic").parse(lines, default_year=2024))
+
+    assert [t["recipient"] for t in transactions] == ["Rema 1000"]
+
+
+def test_entry_split_over_two_lines():
+    text = "SpareBank 1\nUt av konto\n01.02.2024 VISA VARE 4925 KIWI MAJORSTUEN\n01.02.2024 123,45"
+
+    assert parse_statement(text) == [{"date": "2024-02-01", "recipient": "KIWI MAJORSTUEN", "amount": -123.45}]
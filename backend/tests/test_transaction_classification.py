@@ -0,0 +1,66 @@
+import asyncio
+
+import app.apis.transaction as transaction_api
+from app.libs.recurring_payments import RecurringPattern
+from app.libs.transaction_analytics import recipient_key
+
+
+def _pattern(recipient: str) -> RecurringPattern:
+    return RecurringPattern(
+        recipient=recipient_key(recipient),
+        is_recurring=True,
+        frequency="monthly",
+        confidence=0.9,
+        charges=6,
+        interval_days=30.4,
+        amount=12500.0,
+    )
+
+
+def test_recurring_merchant_outside_dictionary_is_categorized_by_ai(monkeypatch):
+    recipient = "Utleie Hansen Eiendom AS"
+    sent = []
+
+    async def analyze_batch(transactions):
+        sent.extend(transactions)
+        for transaction in transactions:
+            transaction.update(
+                is_subscription=False,
+                category="housing",
+                subscription_frequency=None,
+                contact_info={"email": "post@hansen-eiendom.no", "phone": None, "website": None},
+            )
+        return transactions
+
+    monkeypatch.setattr(transaction_api, "analyze_transaction_batch", analyze_batch)
+    transactions = [
+        {"date": "2024-03-01", "recipient": recipient, "amount": -12500.0},
+        {"date": "2024-04-01", "recipient": recipient, "amount": -12500.0},
+    ]
+
+    classified = asyncio.run(transaction_api.analyze_transactions_with_ai(
+        transactions, recurring={recipient_key(recipient): _pattern(recipient)},
+    ))
+
+    assert len(sent) == 1
+    for transaction in classified:
+        assert transaction["category"] == "housing"
+        assert transaction["contact_info"]["email"] == "post@hansen-eiendom.no"
+        # The payment history decides the subscription, not the AI
+        assert transaction["is_subscription"] is True
+        assert transaction["subscription_frequency"] == "monthly"
+
+
+def test_recurring_dictionary_merchant_skips_ai(monkeypatch):
+    async def analyze_batch(transactions):
+        raise AssertionError("OpenAI should not be called")
+
+    monkeypatch.setattr(transaction_api, "analyze_transaction_batch", analyze_batch)
+    transactions = [{"date": "2024-03-01", "recipient": "VISA VARE 4925 NETFLIX.COM", "amount": -129.0}]
+
+    classified = asyncio.run(transaction_api.analyze_transactions_with_ai(
+        transactions, recurring={recipient_key(t["recipient"]): _pattern(t["recipient"]) for t in transactions},
+    ))
+
+    assert classified[0]["category"] == "streaming"
+    assert classified[0]["is_subscription"] is True
@@ -0,0 +1,55 @@
+import uuid
+
+from app.libs import transaction_ledger as ledger
+from app.libs.storage import json_storage
+
+
+def _estate() -> str:
+    estate_id = f"estate-{uuid.uuid4().hex[:8]}"
+    ledger.create_ledger(estate_id)
+    return estate_id
+
+
+def _tx(date: str, recipient: str, amount: float) -> dict:
+    return {"date": date, "recipient": recipient, "amount": amount, "category": "other"}
+
+
+def test_merge_deduplicates_and_looks_up_by_id():
+    estate_id = _estate()
+    first = ledger.merge_transactions(estate_id, [_tx("2024-01-05", "Kiwi", -50), _tx("2024-02-05", "Spotify AB", -129)])
+    again = ledger.merge_transactions(estate_id, [_tx("2024-02-05", "SPOTIFY AB.", -129), _tx("2024-03-01", "Netflix", -99)])
+
+    assert again[0]["id"] == first[1]["id"]
+    assert ledger.get_ledger_head(estate_id)["months"] == {"2024-01": 1, "2024-02": 1, "2024-03": 1}
+    assert ledger.get_ledger_transaction(estate_id, again[1]["id"])["recipient"] == "Netflix"
+    assert ledger.get_ledger_transaction(estate_id, "tx_missing") is None
+
+
+def test_find_known_reads_only_the_uploads_months(monkeypatch):
+    estate_id = _estate()
+    ledger.merge_transactions(estate_id, [_tx("2023-06-01", "Kiwi", -10), _tx("2024-01-05", "Kiwi", -50)])
+    upload = [_tx("2024-01-05", "kiwi", -50), _tx("2024-01-06", "Rema", -20)]
+
+    read = []
+    get_many = json_storage.get_many
+    monkeypatch.setattr(json_storage, "get_many", lambda keys, **kw: (read.extend(keys), get_many(keys, **kw))[1])
+    known = ledger.find_known_transactions(estate_id, upload, ledger.fingerprint_transactions(upload))
+
+    assert list(known) == [0]
+    assert not [key for key in read if "2023-06" in key]
+
+
+def test_single_index_document_is_split_into_shards():
+    estate_id = _estate()
+    stored = ledger.merge_transactions(estate_id, [_tx("2024-01-05", "Kiwi", -50)])
+    fingerprint = ledger.fingerprint_transactions([_tx("2024-01-05", "Kiwi", -50)])[0]
+    # The layout before the index was sharded
+    json_storage.put(f"ledger_{estate_id}.head", {"months": {"2024-01": 1}, "version": 1})
+    json_storage.put(f"ledger_{estate_id}.index", {
+        "ids": {stored[0]["id"]: "2024-01"},
+        "fingerprints": {fingerprint: stored[0]["id"]},
+    })
+
+    assert ledger.get_ledger_transaction(estate_id, stored[0]["id"])["recipient"] == "Kiwi"
+    assert json_storage.get(f"ledger_{estate_id}.index", default=None) is None
+    assert ledger.merge_transactions(estate_id, [_tx("2024-01-05", "Kiwi", -50)])[0]["id"] == stored[0]["id"]
@@ -30,8 +30,14 @@ import {
   GetPaymentStatusError,
   GetPaymentStatusParams,
   GetRolesData,
+  GetStatementJobData,
+  GetStatementJobError,
+  GetStatementJobParams,
   GetRolesError,
   GetRolesParams,
+  GetTransactionAnalyticsData,
+  GetTransactionAnalyticsError,
+  GetTransactionAnalyticsParams,
   GetTransactionsData,
   GetTransactionsError,
   GetTransactionsParams,
@@ -39,6 +45,10 @@ import {
   InviteCollaboratorError,
   InviteRequest,
   ListEstatesData,
+  ListMyInvitationsData,
+  StreamStatementJobData,
+  StreamStatementJobError,
+  StreamStatementJobParams,
   StripeWebhookData,
   SubscriptionCancellation,
   UpdateCancellationStatusData,
@@ -48,10 +58,12 @@ import {
   UpdateEstateError,
   UpdateEstateParams,
   UpdateEstateRequest,
+  UploadStatementData,
+  UploadStatementError,
+  UploadStatementParams,
   UploadTransactionsData,
   UploadTransactionsError,
   UploadTransactionsParams,
-  UploadTransactionsRequest,
 } from "./data-contracts";
 import { ContentType, HttpClient, RequestParams } from "./http-client";
 
@@ -103,6 +115,21 @@ export class Brain<SecurityDataType = unknown> extends HttpClient<SecurityDataTy
       ...params,
     });
 
+  /**
+   * @description List pending invitations for the authenticated user's email across all estates.
+   *
+   * @tags dbtn/module:collaboration, dbtn/hasAuth
+   * @name list_my_invitations
+   * @summary List My Invitations
+   * @request GET:/routes/invitations
+   */
+  list_my_invitations = (params: RequestParams = {}) =>
+    this.request<ListMyInvitationsData, any>({
+      path: `/routes/invitations`,
+      method: "GET",
+      ...params,
+    });
+
   /**
    * No description
    *
@@ -229,7 +256,7 @@ export class Brain<SecurityDataType = unknown> extends HttpClient<SecurityDataTy
     });
 
   /**
-   * No description
+   * @description Upload a bank statement image as multipart/form-data in the `file` field. Returns a job at once; poll it or stream its events for the transactions.
    *
    * @tags dbtn/module:transaction, dbtn/hasAuth
    * @name upload_transactions
@@ -238,14 +265,70 @@ export class Brain<SecurityDataType = unknown> extends HttpClient<SecurityDataTy
    */
   upload_transactions = (
     { estateId, ...query }: UploadTransactionsParams,
-    data: UploadTransactionsRequest,
+    data: {
+      /** @format binary */
+      file: File;
+    },
     params: RequestParams = {},
   ) =>
     this.request<UploadTransactionsData, UploadTransactionsError>({
       path: `/routes/upload/${estateId}`,
       method: "POST",
       body: data,
-      type: ContentType.Json,
+      type: ContentType.FormData,
+      ...params,
+    });
+
+  /**
+   * @description Upload a bank statement as PDFs or several images in the `files` field. All pages are read with batched Vision requests in parallel, and the transactions of all pages are stored as one list in page order. Returns a job at once; poll it or stream its events for the transactions.
+   *
+   * @tags dbtn/module:transaction, dbtn/hasAuth
+   * @name upload_statement
+   * @summary Upload Statement
+   * @request POST:/routes/upload-statement/{estate_id}
+   */
+  upload_statement = (
+    { estateId, ...query }: UploadStatementParams,
+    data: {
+      files: File[];
+    },
+    params: RequestParams = {},
+  ) =>
+    this.request<UploadStatementData, UploadStatementError>({
+      path: `/routes/upload-statement/${estateId}`,
+      method: "POST",
+      body: data,
+      type: ContentType.FormData,
+      ...params,
+    });
+
+  /**
+   * @description Get the status and progress of an upload, with its transactions once done.
+   *
+   * @tags dbtn/module:transaction, dbtn/hasAuth
+   * @name get_statement_job
+   * @summary Get Statement Job
+   * @request GET:/routes/statement-jobs/{job_id}
+   */
+  get_statement_job = ({ jobId, ...query }: GetStatementJobParams, params: RequestParams = {}) =>
+    this.request<GetStatementJobData, GetStatementJobError>({
+      path: `/routes/statement-jobs/${jobId}`,
+      method: "GET",
+      ...params,
+    });
+
+  /**
+   * @description Stream the job as server-sent events on every change until it is finished.
+   *
+   * @tags dbtn/module:transaction, dbtn/hasAuth
+   * @name stream_statement_job
+   * @summary Stream Statement Job
+   * @request GET:/routes/statement-jobs/{job_id}/events
+   */
+  stream_statement_job = ({ jobId, ...query }: StreamStatementJobParams, params: RequestParams = {}) =>
+    this.request<StreamStatementJobData, StreamStatementJobError>({
+      path: `/routes/statement-jobs/${jobId}/events`,
+      method: "GET",
       ...params,
     });
 
@@ -261,6 +344,26 @@ export class Brain<SecurityDataType = unknown> extends HttpClient<SecurityDataTy
     this.request<GetTransactionsData, GetTransactionsError>({
       path: `/routes/transaction/${estateId}`,
       method: "GET",
+      query: query,
+      ...params,
+    });
+
+  /**
+   * @description Totals over the estate's transactions: per category, per month, subscriptions and top recipients. Spending is reported as positive amounts. Dates are inclusive ISO dates.
+   *
+   * @tags dbtn/module:transaction, dbtn/hasAuth
+   * @name get_transaction_analytics
+   * @summary Get Transaction Analytics
+   * @request GET:/routes/transaction/{estate_id}/analytics
+   */
+  get_transaction_analytics = (
+    { estateId, ...query }: GetTransactionAnalyticsParams,
+    params: RequestParams = {},
+  ) =>
+    this.request<GetTransactionAnalyticsData, GetTransactionAnalyticsError>({
+      path: `/routes/transaction/${estateId}/analytics`,
+      method: "GET",
+      query: query,
       ...params,
     });
 
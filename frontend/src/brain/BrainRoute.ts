@@ -14,17 +14,21 @@ import {
   GetEstateData,
   GetPaymentStatusData,
   GetRolesData,
+  GetStatementJobData,
+  GetTransactionAnalyticsData,
   GetTransactionsData,
   InviteCollaboratorData,
   InviteRequest,
   ListEstatesData,
+  ListMyInvitationsData,
+  StreamStatementJobData,
   StripeWebhookData,
   SubscriptionCancellation,
   UpdateCancellationStatusData,
   UpdateEstateData,
   UpdateEstateRequest,
+  UploadStatementData,
   UploadTransactionsData,
-  UploadTransactionsRequest,
 } from "./data-contracts";
 
 export namespace Brain {
@@ -78,6 +82,21 @@ export namespace Brain {
     export type ResponseBody = InviteCollaboratorData;
   }
 
+  /**
+   * @description List pending invitations for the authenticated user's email across all estates.
+   * @tags dbtn/module:collaboration, dbtn/hasAuth
+   * @name list_my_invitations
+   * @summary List My Invitations
+   * @request GET:/routes/invitations
+   */
+  export namespace list_my_invitations {
+    export type RequestParams = {};
+    export type RequestQuery = {};
+    export type RequestBody = never;
+    export type RequestHeaders = {};
+    export type ResponseBody = ListMyInvitationsData;
+  }
+
   /**
    * No description
    * @tags dbtn/module:collaboration, dbtn/hasAuth
@@ -220,7 +239,7 @@ export namespace Brain {
   }
 
   /**
-   * No description
+   * @description Upload a bank statement image as multipart/form-data in the `file` field. Returns a job at once; poll it or stream its events for the transactions.
    * @tags dbtn/module:transaction, dbtn/hasAuth
    * @name upload_transactions
    * @summary Upload Transactions
@@ -232,11 +251,70 @@ export namespace Brain {
       estateId: string;
     };
     export type RequestQuery = {};
-    export type RequestBody = UploadTransactionsRequest;
+    export type RequestBody = {
+      /** @format binary */
+      file: File;
+    };
     export type RequestHeaders = {};
     export type ResponseBody = UploadTransactionsData;
   }
 
+  /**
+   * @description Upload a bank statement as PDFs or several images in the `files` field. All pages are read with batched Vision requests in parallel, and the transactions of all pages are stored as one list in page order. Returns a job at once; poll it or stream its events for the transactions.
+   * @tags dbtn/module:transaction, dbtn/hasAuth
+   * @name upload_statement
+   * @summary Upload Statement
+   * @request POST:/routes/upload-statement/{estate_id}
+   */
+  export namespace upload_statement {
+    export type RequestParams = {
+      /** Estate Id */
+      estateId: string;
+    };
+    export type RequestQuery = {};
+    export type RequestBody = {
+      files: File[];
+    };
+    export type RequestHeaders = {};
+    export type ResponseBody = UploadStatementData;
+  }
+
+  /**
+   * @description Get the status and progress of an upload, with its transactions once done.
+   * @tags dbtn/module:transaction, dbtn/hasAuth
+   * @name get_statement_job
+   * @summary Get Statement Job
+   * @request GET:/routes/statement-jobs/{job_id}
+   */
+  export namespace get_statement_job {
+    export type RequestParams = {
+      /** Job Id */
+      jobId: string;
+    };
+    export type RequestQuery = {};
+    export type RequestBody = never;
+    export type RequestHeaders = {};
+    export type ResponseBody = GetStatementJobData;
+  }
+
+  /**
+   * @description Stream the job as server-sent events on every change until it is finished.
+   * @tags dbtn/module:transaction, dbtn/hasAuth
+   * @name stream_statement_job
+   * @summary Stream Statement Job
+   * @request GET:/routes/statement-jobs/{job_id}/events
+   */
+  export namespace stream_statement_job {
+    export type RequestParams = {
+      /** Job Id */
+      jobId: string;
+    };
+    export type RequestQuery = {};
+    export type RequestBody = never;
+    export type RequestHeaders = {};
+    export type ResponseBody = StreamStatementJobData;
+  }
+
   /**
    * No description
    * @tags dbtn/module:transaction, dbtn/hasAuth
@@ -249,12 +327,60 @@ export namespace Brain {
       /** Estate Id */
       estateId: string;
     };
-    export type RequestQuery = {};
+    export type RequestQuery = {
+      /**
+       * Limit
+       * @min 1
+       * @max 500
+       * @default 100
+       */
+      limit?: number;
+      /** Cursor */
+      cursor?: string | null;
+      /** Date From */
+      date_from?: string | null;
+      /** Date To */
+      date_to?: string | null;
+      /** Category */
+      category?: string | null;
+      /** Is Subscription */
+      is_subscription?: boolean | null;
+    };
     export type RequestBody = never;
     export type RequestHeaders = {};
     export type ResponseBody = GetTransactionsData;
   }
 
+  /**
+   * @description Totals over the estate's transactions: per category, per month, subscriptions and top recipients. Spending is reported as positive amounts. Dates are inclusive ISO dates.
+   * @tags dbtn/module:transaction, dbtn/hasAuth
+   * @name get_transaction_analytics
+   * @summary Get Transaction Analytics
+   * @request GET:/routes/transaction/{estate_id}/analytics
+   */
+  export namespace get_transaction_analytics {
+    export type RequestParams = {
+      /** Estate Id */
+      estateId: string;
+    };
+    export type RequestQuery = {
+      /** Date From */
+      date_from?: string | null;
+      /** Date To */
+      date_to?: string | null;
+      /**
+       * Top
+       * @min 1
+       * @max 100
+       * @default 10
+       */
+      top?: number;
+    };
+    export type RequestBody = never;
+    export type RequestHeaders = {};
+    export type ResponseBody = GetTransactionAnalyticsData;
+  }
+
   /**
    * No description
    * @tags dbtn/module:transaction, dbtn/hasAuth
@@ -60,6 +60,18 @@ export interface CancellationStatusUpdate {
   comment: string;
 }
 
+/** CategoryTotal */
+export interface CategoryTotal {
+  /** Category */
+  category: string;
+  /** Spent */
+  spent: number;
+  /** Income */
+  income: number;
+  /** Count */
+  count: number;
+}
+
 /** Comment */
 export interface Comment {
   /** Id */
@@ -240,6 +252,18 @@ export interface InviteResponse {
   invitation: Role;
 }
 
+/** MonthlySpend */
+export interface MonthlySpend {
+  /** Month */
+  month: string;
+  /** Spent */
+  spent: number;
+  /** Income */
+  income: number;
+  /** Count */
+  count: number;
+}
+
 /** PaymentStatusResponse */
 export interface PaymentStatusResponse {
   /** Status */
@@ -257,6 +281,28 @@ export interface Person {
   address: Address;
 }
 
+/** RecipientTotal */
+export interface RecipientTotal {
+  /** Recipient */
+  recipient: string;
+  /** Spent */
+  spent: number;
+  /** Count */
+  count: number;
+}
+
+/** RecurringTotals */
+export interface RecurringTotals {
+  /** Transactions */
+  transactions: number;
+  /** Subscriptions */
+  subscriptions: number;
+  /** Total */
+  total: number;
+  /** Monthly Cost */
+  monthly_cost: number;
+}
+
 /** Role */
 export interface Role {
   /** Estate Id */
@@ -283,6 +329,32 @@ export interface Role {
   accepted_at?: string | null;
 }
 
+/** StatementJob */
+export interface StatementJob {
+  /** Job Id */
+  job_id: string;
+  /** Estate Id */
+  estate_id: string;
+  /** Status */
+  status: string;
+  /** Stage */
+  stage: string;
+  /**
+   * Done
+   * @default 0
+   */
+  done?: number;
+  /** Total */
+  total?: number | null;
+  /** Error */
+  error?: string | null;
+  result?: TransactionList | null;
+  /** Created At */
+  created_at: string;
+  /** Updated At */
+  updated_at: string;
+}
+
 /** SubscriptionCancellation */
 export interface SubscriptionCancellation {
   /** Transaction Id */
@@ -334,12 +406,37 @@ export interface Transaction {
   contact_info?: object | null;
 }
 
+/** TransactionAnalytics */
+export interface TransactionAnalytics {
+  /** Estate Id */
+  estate_id: string;
+  /** Transactions */
+  transactions: number;
+  /** Spent */
+  spent: number;
+  /** Income */
+  income: number;
+  /** First Date */
+  first_date?: string | null;
+  /** Last Date */
+  last_date?: string | null;
+  /** Categories */
+  categories: CategoryTotal[];
+  /** Months */
+  months: MonthlySpend[];
+  recurring: RecurringTotals;
+  /** Top Recipients */
+  top_recipients: RecipientTotal[];
+}
+
 /** TransactionList */
 export interface TransactionList {
   /** Transactions */
   transactions: Transaction[];
   /** Estate Id */
   estate_id: string;
+  /** Next Cursor */
+  next_cursor?: string | null;
 }
 
 /** UpdateEstateRequest */
@@ -365,12 +462,6 @@ export interface UpdateEstateRequest {
   tasks?: Task[] | null;
 }
 
-/** UploadTransactionsRequest */
-export interface UploadTransactionsRequest {
-  /** File */
-  file: string;
-}
-
 /** ValidationError */
 export interface ValidationError {
   /** Location */
@@ -398,6 +489,9 @@ export type InviteCollaboratorData = InviteResponse;
 
 export type InviteCollaboratorError = HTTPValidationError;
 
+/** Response List My Invitations */
+export type ListMyInvitationsData = Role[];
+
 export interface GetRolesParams {
   /** Estate Id */
   estateId: string;
@@ -466,11 +560,55 @@ export interface UploadTransactionsParams {
   estateId: string;
 }
 
-export type UploadTransactionsData = TransactionList;
+export type UploadTransactionsData = StatementJob;
 
 export type UploadTransactionsError = HTTPValidationError;
 
+export interface UploadStatementParams {
+  /** Estate Id */
+  estateId: string;
+}
+
+export type UploadStatementData = StatementJob;
+
+export type UploadStatementError = HTTPValidationError;
+
+export interface GetStatementJobParams {
+  /** Job Id */
+  jobId: string;
+}
+
+export type GetStatementJobData = StatementJob;
+
+export type GetStatementJobError = HTTPValidationError;
+
+export interface StreamStatementJobParams {
+  /** Job Id */
+  jobId: string;
+}
+
+export type StreamStatementJobData = any;
+
+export type StreamStatementJobError = HTTPValidationError;
+
 export interface GetTransactionsParams {
+  /**
+   * Limit
+   * @min 1
+   * @max 500
+   * @default 100
+   */
+  limit?: number;
+  /** Cursor */
+  cursor?: string | null;
+  /** Date From */
+  date_from?: string | null;
+  /** Date To */
+  date_to?: string | null;
+  /** Category */
+  category?: string | null;
+  /** Is Subscription */
+  is_subscription?: boolean | null;
   /** Estate Id */
   estateId: string;
 }
@@ -479,6 +617,26 @@ export type GetTransactionsData = TransactionList;
 
 export type GetTransactionsError = HTTPValidationError;
 
+export interface GetTransactionAnalyticsParams {
+  /** Date From */
+  date_from?: string | null;
+  /** Date To */
+  date_to?: string | null;
+  /**
+   * Top
+   * @min 1
+   * @max 100
+   * @default 10
+   */
+  top?: number;
+  /** Estate Id */
+  estateId: string;
+}
+
+export type GetTransactionAnalyticsData = TransactionAnalytics;
+
+export type GetTransactionAnalyticsError = HTTPValidationError;
+
 export interface GetCancellationStatusParams {
   /** Estate Id */
   estateId: string;
@@ -358,7 +358,7 @@ function CancellationDialog({
 }
 
 export function TransactionList({ estateId }: Props) {
-  const { transactions, loading, loadTransactions } = useTransactionStore();
+  const { transactions, nextCursor, analytics, loading, loadingMore, loadTransactions, loadMoreTransactions } = useTransactionStore();
 
   useEffect(() => {
     loadTransactions(estateId);
@@ -377,6 +377,45 @@ export function TransactionList({ estateId }: Props) {
 
   return (
     <div className="space-y-8">
+      {/* Summary */}
+      {analytics && analytics.transactions > 0 && (
+        <Card>
+          <CardHeader>
+            <CardTitle>Oversikt</CardTitle>
+            <CardDescription>
+              {analytics.transactions} transaksjoner
+              {analytics.first_date && analytics.last_date &&
+                ` fra ${formatDate(analytics.first_date)} til ${formatDate(analytics.last_date)}`}
+            </CardDescription>
+          </CardHeader>
+          <CardContent className="space-y-4">
+            <div className="grid gap-4 sm:grid-cols-3">
+              <div>
+                <p className="text-sm text-muted-foreground">Utgifter</p>
+                <p className="text-lg font-semibold">{formatAmount(analytics.spent)}</p>
+              </div>
+              <div>
+                <p className="text-sm text-muted-foreground">Inntekter</p>
+                <p className="text-lg font-semibold">{formatAmount(analytics.income)}</p>
+              </div>
+              <div>
+                <p className="text-sm text-muted-foreground">
+                  Abonnementer ({analytics.recurring.subscriptions}) per måned
+                </p>
+                <p className="text-lg font-semibold">{formatAmount(analytics.recurring.monthly_cost)}</p>
+              </div>
+            </div>
+            <div className="flex flex-wrap gap-2">
+              {analytics.categories.filter(c => c.spent > 0).map(c => (
+                <Badge key={c.category} variant="secondary">
+                  {formatCategory(c.category)}: {formatAmount(c.spent)}
+                </Badge>
+              ))}
+            </div>
+          </CardContent>
+        </Card>
+      )}
+
       {/* Subscriptions */}
       <Card>
         <CardHeader>
@@ -489,6 +528,19 @@ export function TransactionList({ estateId }: Props) {
           )}
         </CardContent>
       </Card>
+
+      {nextCursor && (
+        <div className="flex justify-center">
+          <Button
+            variant="outline"
+            onClick={() => loadMoreTransactions(estateId)}
+            disabled={loadingMore}
+          >
+            {loadingMore && <Loader2 className="mr-2 h-4 w-4 animate-spin" />}
+            Vis eldre transaksjoner
+          </Button>
+        </div>
+      )}
     </div>
   );
 }
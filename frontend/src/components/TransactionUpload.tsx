@@ -12,27 +12,31 @@ interface Props {
 }
 
 export function TransactionUpload({ estateId, onSuccess }: Props) {
-  const { uploadTransactions, loading } = useTransactionStore();
+  const { uploadTransactions, uploadStatement, loading, uploadProgress } = useTransactionStore();
 
   const onDrop = useCallback(async (acceptedFiles: File[]) => {
     try {
-      const file = acceptedFiles[0];
-      if (!file) return;
+      if (acceptedFiles.length === 0) return;
 
-      // Check file type
+      // Check file types
       const validTypes = ['image/png', 'image/jpeg', 'application/pdf'];
-      if (!validTypes.includes(file.type)) {
+      if (acceptedFiles.some(file => !validTypes.includes(file.type))) {
         toast.error('Ugyldig filformat. Vennligst last opp PNG, JPEG eller PDF.');
         return;
       }
 
-      // Check file size (10MB)
-      if (file.size > 10 * 1024 * 1024) {
+      // Check file sizes (10MB each)
+      if (acceptedFiles.some(file => file.size > 10 * 1024 * 1024)) {
         toast.error('Filen er for stor. Maksimal størrelse er 10MB.');
         return;
       }
 
-      await uploadTransactions(estateId, file);
+      // PDFs and several photos are read page by page in one request
+      if (acceptedFiles.length === 1 && acceptedFiles[0].type !== 'application/pdf') {
+        await uploadTransactions(estateId, acceptedFiles[0]);
+      } else {
+        await uploadStatement(estateId, acceptedFiles);
+      }
       toast.success('Transaksjoner lastet opp');
       if (onSuccess) {
         onSuccess();
@@ -41,7 +45,7 @@ export function TransactionUpload({ estateId, onSuccess }: Props) {
       console.error('Upload failed:', error);
       toast.error('Kunne ikke laste opp filen');
     }
-  }, [estateId, uploadTransactions, onSuccess]);
+  }, [estateId, uploadTransactions, uploadStatement, onSuccess]);
 
   const { getRootProps, getInputProps, isDragActive } = useDropzone({
     onDrop,
@@ -49,7 +53,7 @@ export function TransactionUpload({ estateId, onSuccess }: Props) {
       'image/*': ['.png', '.jpg', '.jpeg'],
       'application/pdf': ['.pdf'],
     },
-    maxFiles: 1,
+    maxFiles: 50,
     disabled: loading,
   });
 
@@ -58,7 +62,7 @@ export function TransactionUpload({ estateId, onSuccess }: Props) {
       <CardHeader>
         <CardTitle>Last opp banktransaksjoner</CardTitle>
         <CardDescription>
-          Last opp kontoutskrift som bilde eller PDF.
+          Last opp kontoutskrift som PDF eller ett eller flere bilder.
           Vi støtter PNG, JPEG og PDF-filer opp til 10MB.
         </CardDescription>
       </CardHeader>
@@ -78,16 +82,22 @@ export function TransactionUpload({ estateId, onSuccess }: Props) {
             <div className="flex flex-col items-center gap-2 text-muted-foreground">
               <Loader2 className="h-8 w-8 animate-spin" />
               <p>Behandler fil...</p>
+              {uploadProgress?.total ? (
+                <p className="text-sm">
+                  {uploadProgress.stage === 'classifying' ? 'Kategoriserer' : 'Leser sider'}:{' '}
+                  {uploadProgress.done} av {uploadProgress.total}
+                </p>
+              ) : null}
             </div>
           ) : isDragActive ? (
             <div className="flex flex-col items-center gap-2 text-primary">
               <Upload className="h-8 w-8" />
-              <p>Slipp filen her...</p>
+              <p>Slipp filene her...</p>
             </div>
           ) : (
             <div className="flex flex-col items-center gap-2 text-muted-foreground">
               <Upload className="h-8 w-8" />
-              <p>Dra og slipp en fil her, eller klikk for å velge</p>
+              <p>Dra og slipp filer her, eller klikk for å velge</p>
               <p className="text-sm">PNG, JPEG eller PDF (maks 10MB)</p>
             </div>
           )}
@@ -16,21 +16,11 @@ export const useInvitationsStore = create<InvitationsStore>((set, get) => ({
   loadInvitations: async (userEmail: string) => {
     try {
       set({ loading: true });
-      const response = await brain.list_estates();
-      const estates = await response.json();
+      // Pending invitations for the signed-in user's email in one request
+      const response = await brain.list_my_invitations();
+      const invitations: Role[] = await response.json();
 
-      // For each estate, check if there are any pending invitations for this user's email
-      const allInvitations: Role[] = [];
-      for (const estate of estates) {
-        const rolesResponse = await brain.get_roles({ estateId: estate.id });
-        const roles = await rolesResponse.json();
-        const pendingInvites = roles.filter(
-          (role) => role.email === userEmail && role.status === "pending"
-        );
-        allInvitations.push(...pendingInvites);
-      }
-
-      set({ invitations: allInvitations });
+      set({ invitations });
     } catch (error) {
       console.error("Failed to load invitations:", error);
     } finally {
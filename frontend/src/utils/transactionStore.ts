@@ -29,6 +29,7 @@ export interface Transaction {
 export interface TransactionList {
   transactions: Transaction[];
   estate_id: string;
+  next_cursor?: string | null;
 }
 
 export interface CancellationRequest {
@@ -47,13 +48,89 @@ export interface CancellationResponse {
   contact_info: Record<string, any>;
 }
 
+export interface CategoryTotal {
+  category: string;
+  spent: number;
+  income: number;
+  count: number;
+}
+
+export interface TransactionAnalytics {
+  estate_id: string;
+  transactions: number;
+  spent: number;
+  income: number;
+  first_date?: string | null;
+  last_date?: string | null;
+  categories: CategoryTotal[];
+  months: Array<{ month: string; spent: number; income: number; count: number }>;
+  recurring: {
+    transactions: number;
+    subscriptions: number;
+    total: number;
+    monthly_cost: number;
+  };
+  top_recipients: Array<{ recipient: string; spent: number; count: number }>;
+}
+
+export interface UploadProgress {
+  stage: string;
+  done: number;
+  total?: number | null;
+}
+
+// Transactions are loaded from the estate's ledger a page at a time, newest first
+const TRANSACTION_PAGE_SIZE = 100;
+
+// A further page may overlap the loaded rows if the ledger changed in between
+const mergeTransactions = (existing: Transaction[], added: Transaction[]): Transaction[] => {
+  const ids = new Set(existing.map(t => t.id));
+  return [...existing, ...added.filter(t => !ids.has(t.id))];
+};
+
+// Uploads are processed in the background, poll the job until it is finished
+const JOB_POLL_INTERVAL_MS = 1000;
+// Give up on a job that never finishes, e.g. if the server lost it
+const JOB_TIMEOUT_MS = 15 * 60 * 1000;
+
+const waitForStatementJob = async (
+  jobId: string,
+  onProgress: (progress: UploadProgress) => void,
+): Promise<TransactionList> => {
+  const deadline = Date.now() + JOB_TIMEOUT_MS;
+  while (true) {
+    if (Date.now() > deadline) {
+      throw new Error('Behandlingen av filen tok for lang tid, prøv igjen');
+    }
+    const response = await brain.get_statement_job({ jobId });
+    const job = await response.json();
+    onProgress({ stage: job.stage, done: job.done, total: job.total });
+
+    if (job.status === 'succeeded') {
+      return job.result;
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Kunne ikke behandle filen');
+    }
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+};
+
 interface TransactionStore {
   transactions: Transaction[];
+  nextCursor: string | null;
+  // Totals over the whole ledger, computed by the backend rather than from the loaded pages
+  analytics: TransactionAnalytics | null;
   loading: boolean;
+  loadingMore: boolean;
+  uploadProgress: UploadProgress | null;
   error: Error | null;
   // Actions
   uploadTransactions: (estateId: string, file: File) => Promise<void>;
+  uploadStatement: (estateId: string, files: File[]) => Promise<void>;
   loadTransactions: (estateId: string) => Promise<void>;
+  loadMoreTransactions: (estateId: string) => Promise<void>;
+  loadAnalytics: (estateId: string) => Promise<void>;
   cancelSubscription: (request: CancellationRequest) => Promise<CancellationResponse>;
   confirmTransaction: (transactionId: string, confirmed: boolean) => void;
   correctTransaction: (transactionId: string, corrections: {
@@ -71,35 +148,51 @@ interface TransactionStore {
 
 export const useTransactionStore = create<TransactionStore>((set, get) => ({
   transactions: [],
+  nextCursor: null,
+  analytics: null,
   loading: false,
+  loadingMore: false,
+  uploadProgress: null,
   error: null,
 
   uploadTransactions: async (estateId: string, file: File) => {
     set({ loading: true, error: null });
     try {
-      // Convert file to base64
-      const base64 = await new Promise<string>((resolve, reject) => {
-        const reader = new FileReader();
-        reader.readAsDataURL(file);
-        reader.onload = () => {
-          const base64 = reader.result as string;
-          resolve(base64.split(',')[1]); // Remove data:image/png;base64, prefix
-        };
-        reader.onerror = reject;
-      });
-
+      // Sent as multipart/form-data, streamed by the backend and processed as a job
       const response = await brain.upload_transactions(
         { estateId },
-        { file: base64 }
+        { file }
       );
-      const data = await response.json();
+      const job = await response.json();
+      await waitForStatementJob(job.job_id, uploadProgress => set({ uploadProgress }));
 
-      set(state => ({
-        transactions: [...state.transactions, ...data.transactions],
-        loading: false,
-      }));
+      // The new rows can belong anywhere in the newest-first list, so reload the
+      // first page instead of merging them, which also keeps the cursor in step
+      set({ uploadProgress: null });
+      await get().loadTransactions(estateId);
     } catch (error) {
-      set({ error: error as Error, loading: false });
+      set({ error: error as Error, loading: false, uploadProgress: null });
+      throw error;
+    }
+  },
+
+  uploadStatement: async (estateId: string, files: File[]) => {
+    set({ loading: true, error: null });
+    try {
+      // All pages of a PDF or several photos, read by the backend in one request
+      const response = await brain.upload_statement(
+        { estateId },
+        { files }
+      );
+      const job = await response.json();
+      await waitForStatementJob(job.job_id, uploadProgress => set({ uploadProgress }));
+
+      // The new rows can belong anywhere in the newest-first list, so reload the
+      // first page instead of merging them, which also keeps the cursor in step
+      set({ uploadProgress: null });
+      await get().loadTransactions(estateId);
+    } catch (error) {
+      set({ error: error as Error, loading: false, uploadProgress: null });
       throw error;
     }
   },
@@ -107,19 +200,52 @@ export const useTransactionStore = create<TransactionStore>((set, get) => ({
   loadTransactions: async (estateId: string) => {
     set({ loading: true, error: null });
     try {
-      const response = await brain.get_transactions({ estate_id: estateId });
+      const response = await brain.get_transactions({ estateId, limit: TRANSACTION_PAGE_SIZE });
       const data = await response.json();
 
       set({
         transactions: data.transactions,
+        nextCursor: data.next_cursor ?? null,
         loading: false,
       });
+      get().loadAnalytics(estateId);
     } catch (error) {
       set({ error: error as Error, loading: false });
       throw error;
     }
   },
 
+  loadMoreTransactions: async (estateId: string) => {
+    const cursor = get().nextCursor;
+    if (!cursor || get().loadingMore) return;
+
+    set({ loadingMore: true, error: null });
+    try {
+      const response = await brain.get_transactions({ estateId, limit: TRANSACTION_PAGE_SIZE, cursor });
+      const data = await response.json();
+
+      set(state => ({
+        transactions: mergeTransactions(state.transactions, data.transactions),
+        nextCursor: data.next_cursor ?? null,
+        loadingMore: false,
+      }));
+    } catch (error) {
+      set({ error: error as Error, loadingMore: false });
+      throw error;
+    }
+  },
+
+  loadAnalytics: async (estateId: string) => {
+    try {
+      const response = await brain.get_transaction_analytics({ estateId });
+      const analytics = await response.json();
+      set({ analytics });
+    } catch (error) {
+      // The list is still usable without the totals
+      console.error('Error loading transaction analytics:', error);
+    }
+  },
+
   cancelSubscription: async (request: CancellationRequest) => {
     set({ loading: true, error: null });
     try {